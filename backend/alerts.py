@@ -0,0 +1,333 @@
+"""
+Alert rules over sampled metrics, evaluated incrementally.
+
+Each sample is a flat dict of metric name -> number. Every rule keeps only
+the state its window needs (a breach start time, running regression sums,
+a deque of counter readings), so a sample costs amortized O(1) per rule and
+history is never rescanned. When a rule changes state, a firing or
+resolved event goes to every sink.
+
+Rule types:
+    threshold  metric op value held continuously for a duration
+               (e.g. cpu_percent > 90 for 5m)
+    fill       least-squares trend of a percentage over a sliding window,
+               fires if it predicts hitting `full` within `horizon`
+               (e.g. disk_percent full within 24h)
+    burn_rate  increase of a downtime counter over a window, relative to
+               the error budget an availability SLO allows
+
+Rules come from ALERT_RULES_FILE (JSON: {"rules": [...]}, same keys as the
+constructors, durations as '5m' / '6h' strings) or each service's defaults.
+Sinks are picked with ALERT_SINKS=stdout,file,webhook (ALERT_FILE,
+ALERT_WEBHOOK_URL). `python alerts.py serve-webhook` runs a local stand-in
+webhook receiver that prints what it gets.
+"""
+
+import json
+import operator
+import os
+import queue
+import sys
+import threading
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+def parse_duration(value):
+    """Parse '90s', '5m', '6h', '1d', '1w' or a number of seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+# ====== RULES ======
+class Rule:
+    """Base class: subclasses implement update(value, now) -> (breaching, detail)"""
+
+    kind = None
+
+    def __init__(self, name, metric, severity='warning'):
+        self.name = name
+        self.metric = metric
+        self.severity = severity
+        self.firing = False
+
+
+class ThresholdRule(Rule):
+    """metric <op> threshold, continuously for `for_seconds`"""
+
+    kind = 'threshold'
+
+    def __init__(self, name, metric, threshold, op='>', for_seconds=0, severity='warning'):
+        super().__init__(name, metric, severity)
+        self.threshold = threshold
+        self.op = op
+        self.for_seconds = parse_duration(for_seconds)
+        self._compare = OPERATORS[op]
+        self._breach_since = None
+
+    def update(self, value, now):
+        if not self._compare(value, self.threshold):
+            self._breach_since = None
+            return False, f'{self.metric} is {value:.1f}'
+        if self._breach_since is None:
+            self._breach_since = now
+        held = now - self._breach_since
+        return held >= self.for_seconds, \
+            f'{self.metric} {self.op} {self.threshold} for {held:.0f}s (now {value:.1f})'
+
+
+class FillRule(Rule):
+    """
+    Predicts when a percentage reaches `full` from a least-squares fit over
+    a sliding window. Points are thinned to `window / 360` apart; the sums
+    are updated as points enter and leave the window, and rebased on the
+    oldest point once per window to keep the float arithmetic well
+    conditioned (amortized O(1)).
+    """
+
+    kind = 'fill'
+
+    def __init__(self, name, metric, window='6h', horizon='24h', full=100.0, severity='warning'):
+        super().__init__(name, metric, severity)
+        self.window = parse_duration(window)
+        self.horizon = parse_duration(horizon)
+        self.full = full
+        self._spacing = self.window / 360
+        self._points = deque()
+        self._origin = None
+        self._sums = [0, 0.0, 0.0, 0.0, 0.0]  # n, Σt, Σy, Σt², Σty
+
+    def _add(self, t, y, sign):
+        sums = self._sums
+        sums[0] += sign
+        sums[1] += sign * t
+        sums[2] += sign * y
+        sums[3] += sign * t * t
+        sums[4] += sign * t * y
+
+    def _rebase(self):
+        self._origin = self._points[0][0]
+        self._sums = [0, 0.0, 0.0, 0.0, 0.0]
+        for t, y in self._points:
+            self._add(t - self._origin, y, 1)
+
+    def update(self, value, now):
+        points = self._points
+        if not points or now - points[-1][0] >= self._spacing:
+            if self._origin is None:
+                self._origin = now
+            points.append((now, value))
+            self._add(now - self._origin, value, 1)
+            while now - points[0][0] > self.window:
+                t, y = points.popleft()
+                self._add(t - self._origin, y, -1)
+            if now - self._origin > 2 * self.window:
+                self._rebase()
+
+        n, st, sy, stt, sty = self._sums
+        # Need half a window of history before trusting a trend
+        if n < 3 or now - points[0][0] < self.window / 2:
+            return False, 'not enough history'
+        denominator = n * stt - st * st
+        if denominator <= 0:
+            return False, 'not enough history'
+        slope = (n * sty - st * sy) / denominator  # per second
+        if slope <= 0:
+            return False, f'{self.metric} is not growing'
+        current = (sy - slope * st) / n + slope * (now - self._origin)
+        seconds_to_full = max(self.full - current, 0.0) / slope
+        return seconds_to_full <= self.horizon, \
+            f'{self.metric} at {current:.1f}, full in {seconds_to_full / 3600:.1f}h at the current rate'
+
+
+class BurnRateRule(Rule):
+    """
+    Error-budget burn rate of a cumulative downtime counter: the downtime
+    accrued over `window`, divided by the downtime an `slo` (percent
+    availability) allows in the same time. 1.0 spends the budget exactly
+    on schedule; the classic page threshold for a 1h window is 14.4.
+    """
+
+    kind = 'burn_rate'
+
+    def __init__(self, name, metric, slo=99.9, window='1h', threshold=14.4, severity='critical'):
+        super().__init__(name, metric, severity)
+        self.slo = slo
+        self.window = parse_duration(window)
+        self.threshold = threshold
+        self._readings = deque()
+
+    def update(self, value, now):
+        readings = self._readings
+        readings.append((now, value))
+        # Keep one reading at or before the window start as the baseline
+        while len(readings) > 1 and now - readings[1][0] >= self.window:
+            readings.popleft()
+        start, baseline = readings[0]
+        elapsed = now - start
+        if elapsed < self.window / 2:
+            return False, 'not enough history'
+        budget = elapsed * (1 - self.slo / 100)
+        burn = max(value - baseline, 0.0) / budget if budget > 0 else 0.0
+        return burn >= self.threshold, f'burning the {self.slo}% budget at {burn:.1f}x over {elapsed / 60:.0f}m'
+
+
+RULE_TYPES = {rule.kind: rule for rule in (ThresholdRule, FillRule, BurnRateRule)}
+
+
+def build_rule(spec):
+    """Construct a rule from its JSON description"""
+    spec = dict(spec)
+    kind = spec.pop('type')
+    if 'for' in spec:
+        spec['for_seconds'] = spec.pop('for')
+    return RULE_TYPES[kind](**spec)
+
+
+# ====== SINKS ======
+class StdoutSink:
+    def send(self, event):
+        print(f"[ALERT] {event['state'].upper()} {event['rule']} ({event['severity']}): {event['message']}")
+
+
+class FileSink:
+    """Appends one JSON event per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, event):
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+
+class WebhookSink:
+    """POSTs events as JSON from a background thread so evaluation never waits on the network"""
+
+    def __init__(self, url, timeout=5.0, queue_size=100):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+
+    def send(self, event):
+        if self._pid != os.getpid():
+            self._thread = threading.Thread(target=self._deliver, name='alert-webhook', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            print(f"Alert webhook backlog full; dropped {event['rule']} {event['state']}")
+
+    def _deliver(self):
+        while True:
+            event = self._queue.get()
+            request = urllib.request.Request(
+                self.url, data=json.dumps(event).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, method='POST'
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            except Exception as e:
+                print(f"Alert webhook error: {e}")
+
+
+# ====== ENGINE ======
+class AlertEngine:
+    """Feeds samples to every rule and reports state changes to the sinks"""
+
+    def __init__(self, rules, sinks, service):
+        self.rules = rules
+        self.sinks = sinks
+        self.service = service
+
+    def observe(self, sample, now):
+        """Evaluate one sample (metric name -> number) taken at Unix time `now`"""
+        for rule in self.rules:
+            value = sample.get(rule.metric)
+            if value is None:
+                continue
+            breaching, message = rule.update(value, now)
+            if breaching != rule.firing:
+                rule.firing = breaching
+                self._emit(rule, value, message, now)
+
+    def _emit(self, rule, value, message, now):
+        event = {
+            'service': self.service,
+            'rule': rule.name,
+            'type': rule.kind,
+            'state': 'firing' if rule.firing else 'resolved',
+            'severity': rule.severity,
+            'metric': rule.metric,
+            'value': value,
+            'message': message,
+            'at': datetime.fromtimestamp(now, timezone.utc).isoformat()
+        }
+        for sink in self.sinks:
+            try:
+                sink.send(event)
+            except Exception as e:
+                print(f"Alert sink error: {e}")
+
+    def firing(self):
+        return [rule.name for rule in self.rules if rule.firing]
+
+
+def build_engine(service, default_rules, default_file):
+    """Engine configured from ALERT_* environment variables, falling back to `default_rules`"""
+    rules_file = os.environ.get('ALERT_RULES_FILE')
+    if rules_file:
+        with open(rules_file) as f:
+            specs = json.load(f)['rules']
+    else:
+        specs = default_rules
+
+    sinks = []
+    for name in os.environ.get('ALERT_SINKS', 'stdout').split(','):
+        name = name.strip()
+        if name == 'stdout':
+            sinks.append(StdoutSink())
+        elif name == 'file':
+            sinks.append(FileSink(os.environ.get('ALERT_FILE', default_file)))
+        elif name == 'webhook' and os.environ.get('ALERT_WEBHOOK_URL'):
+            sinks.append(WebhookSink(os.environ['ALERT_WEBHOOK_URL']))
+    return AlertEngine([build_rule(spec) for spec in specs], sinks, service)
+
+
+def serve_webhook(port):
+    """Local stand-in for a real webhook receiver: print every event"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            print(body.decode('utf-8'), flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Listening for alert webhooks on http://127.0.0.1:{port}/")
+    HTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'serve-webhook':
+        print("Usage:")
+        print("  python alerts.py serve-webhook [port]   - Print alerts POSTed to ALERT_WEBHOOK_URL")
+        sys.exit(1)
+    serve_webhook(int(sys.argv[2]) if len(sys.argv) > 2 else 9999)
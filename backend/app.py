@@ -1,20 +1,94 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import Integer, cast, func, text, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import psutil
+import atexit
+import fcntl
+import hashlib
+import hmac
+import json
+import re
+import signal
+import threading
 import time
 from datetime import datetime, timezone
 import os
 
+from alerts import build_engine
+from disk_indexer import DiskIndex
+from bulk_export import (EXPORT_BATCH, EXPORT_FORMATS, encode_batches, export_filename, import_rejection,
+                         parse_export_format, parse_import_records)
+from fleet import SAMPLE_FIELDS, Fleet
+from heartbeat_journal import HeartbeatJournal
+from host_agent import create_agent
+from host_collector import HostCollector
+from payload_codec import MSGPACK_TYPE, PayloadEncoder, StreamVariants, encode, negotiate
+from process_table import ProcessTable
+from shared_snapshot import SharedSnapshot, default_path
+from http_cache import ResponseCache, json_response
+from instrumentation import Instrumentation
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend access
 
 # Configure the SQLAlchemy part of the app instance
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "system_metrics.db")}'
+METRICS_DB_PATH = os.environ.get('METRICS_DB_PATH', os.path.join(basedir, 'system_metrics.db'))
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{METRICS_DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+# Prometheus metrics at /metrics (per-route latency, per-phase timings, host gauges)
+metrics = Instrumentation('homeserver')
+metrics.instrument_app(app)
+
+# How often the background sampler refreshes CPU/RAM/disk (seconds)
+METRICS_SAMPLE_INTERVAL = float(os.environ.get('METRICS_SAMPLE_INTERVAL', '1.0'))
+# How often the in-memory uptime record is written back to SQLite (seconds)
+UPTIME_FLUSH_INTERVAL = float(os.environ.get('UPTIME_FLUSH_INTERVAL', '60'))
+
+# Metrics history retention per tier (raw samples, 1-minute and 1-hour rollups)
+HISTORY_RAW_RETENTION = float(os.environ.get('HISTORY_RAW_RETENTION_HOURS', '6')) * 3600
+HISTORY_MINUTE_RETENTION = float(os.environ.get('HISTORY_MINUTE_RETENTION_DAYS', '7')) * 86400
+HISTORY_HOUR_RETENTION = float(os.environ.get('HISTORY_HOUR_RETENTION_DAYS', '400')) * 86400
+# Upper bound on points returned by /api/homeserver/history
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', '1500'))
+
+# Per-client buffer for /api/homeserver/stream; clients this far behind are dropped
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '8'))
+# How often the cached process table is re-read (seconds)
+PROCESS_REFRESH_INTERVAL = float(os.environ.get('PROCESS_REFRESH_INTERVAL', '5'))
+# Cache-Control max-age for /api/homeserver (seconds); one sampler tick by default
+STATS_MAX_AGE = int(os.environ.get('STATS_MAX_AGE', str(max(int(METRICS_SAMPLE_INTERVAL), 1))))
+# How often the heartbeat journal records that the server is up (seconds)
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', '10'))
+HEARTBEAT_JOURNAL_PATH = os.environ.get('HEARTBEAT_JOURNAL_PATH', os.path.join(basedir, 'heartbeat.journal'))
+HEARTBEAT_SUMMARY_PATH = os.environ.get('HEARTBEAT_SUMMARY_PATH', os.path.join(basedir, 'heartbeat_sessions.json'))
+# Shared-memory segment the collector worker publishes snapshots to (one per database)
+SHARED_SNAPSHOT_PATH = os.environ.get('SHARED_SNAPSHOT_PATH', default_path(
+    f"homeserver-snapshot-{hashlib.blake2b(METRICS_DB_PATH.encode('utf-8'), digest_size=6).hexdigest()}"
+))
+SHARED_SNAPSHOT_SIZE = int(os.environ.get('SHARED_SNAPSHOT_SIZE', str(1 << 20)))
+# Multi-host: bearer token agents must send to /api/hosts/ingest (unset disables ingest),
+# the largest batch accepted and the most distinct hosts tracked at once
+HOSTS_INGEST_TOKEN = os.environ.get('HOSTS_INGEST_TOKEN')
+MAX_HOST_BATCH = int(os.environ.get('MAX_HOST_BATCH', '5000'))
+MAX_HOSTS = int(os.environ.get('MAX_HOSTS', '256'))
+# Hosts silent for longer than this are reported offline (seconds)
+HOST_STALE_AFTER = float(os.environ.get('HOST_STALE_AFTER', '90'))
+HOST_SAMPLE_RETENTION = float(os.environ.get('HOST_SAMPLE_RETENTION_DAYS', '7')) * 86400
+# Largest batch accepted by /api/homeserver/import (records)
+MAX_IMPORT_BATCH = int(os.environ.get('MAX_IMPORT_BATCH', '5000'))
+# Directory trees indexed for /api/homeserver/disk/top (comma-separated; unset disables the indexer)
+DISK_INDEX_ROOTS = [root.strip() for root in os.environ.get('DISK_INDEX_ROOTS', '').split(',') if root.strip()]
+DISK_INDEX_PATH = os.environ.get('DISK_INDEX_PATH', os.path.join(basedir, 'disk_index.json'))
+# Seconds between incremental passes, and hours between full re-listings (catch files growing in place)
+DISK_INDEX_INTERVAL = float(os.environ.get('DISK_INDEX_INTERVAL', '300'))
+DISK_INDEX_FULL_RESCAN = float(os.environ.get('DISK_INDEX_FULL_RESCAN_HOURS', '24')) * 3600
+
 
 # ====== DATABASE MODELS ======
 class UptimeRecord(db.Model):
@@ -31,15 +105,59 @@ class UptimeRecord(db.Model):
         return f'<UptimeRecord {self.id}: accumulated={self.accumulated_uptime_seconds}s>'
 
 
+class MetricSample(db.Model):
+    """Raw CPU/RAM/disk samples, kept for HISTORY_RAW_RETENTION"""
+    # Unix seconds; whole seconds so duplicate writers collapse onto one row
+    timestamp = db.Column(db.Integer, primary_key=True)
+    cpu_percent = db.Column(db.Float)
+    ram_percent = db.Column(db.Float)
+    disk_percent = db.Column(db.Float)
+
+
+class MetricRollup(db.Model):
+    """Pre-aggregated min/avg/max buckets (60s and 3600s resolutions)"""
+    resolution = db.Column(db.Integer, primary_key=True)  # Bucket width in seconds
+    bucket_start = db.Column(db.Integer, primary_key=True)  # Unix seconds
+    sample_count = db.Column(db.Integer, default=0)
+    cpu_min = db.Column(db.Float)
+    cpu_avg = db.Column(db.Float)
+    cpu_max = db.Column(db.Float)
+    ram_min = db.Column(db.Float)
+    ram_avg = db.Column(db.Float)
+    ram_max = db.Column(db.Float)
+    disk_min = db.Column(db.Float)
+    disk_avg = db.Column(db.Float)
+    disk_max = db.Column(db.Float)
+
+    def __repr__(self):
+        return f'<MetricRollup {self.resolution}s @ {self.bucket_start}: n={self.sample_count}>'
+
+
+class HostSample(db.Model):
+    """Samples pushed by host agents (see host_agent.py), kept for HOST_SAMPLE_RETENTION"""
+    __table_args__ = (db.Index('ix_host_sample_host_timestamp', 'host_id', 'timestamp'),)
+    # Ingest order; workers catch up on new rows by id
+    id = db.Column(db.Integer, primary_key=True)
+    host_id = db.Column(db.String(64), nullable=False)
+    timestamp = db.Column(db.Float, nullable=False)  # Unix seconds, as sampled by the agent
+    received_at = db.Column(db.Float, nullable=False)  # Unix seconds, when this service stored it
+    cpu_percent = db.Column(db.Float)
+    ram_percent = db.Column(db.Float)
+    disk_percent = db.Column(db.Float)
+    load_1m = db.Column(db.Float)
+    net_rx_bps = db.Column(db.Float)
+    net_tx_bps = db.Column(db.Float)
+
+
 # ====== UPTIME MANAGEMENT ======
 def get_current_boot_time():
     """Get the system boot time as Unix timestamp"""
     return psutil.boot_time()
 
 
-def get_system_uptime_since_boot():
-    """Get uptime in seconds since last system boot"""
-    return time.time() - psutil.boot_time()
+def get_system_uptime_since_boot(now=None):
+    """Get uptime in seconds since last system boot (as of `now`, default: current time)"""
+    return (now or time.time()) - psutil.boot_time()
 
 
 def get_or_create_uptime_record():
@@ -56,104 +174,1047 @@ def get_or_create_uptime_record():
     return record
 
 
-def handle_boot_detection():
+# Every HEARTBEAT_INTERVAL seconds the sampler appends (boot_time, now) to a
+# memory-mapped journal. Sessions, downtime gaps and reboots are rebuilt
+# from those records, so the last seconds before a crash or power cut are
+# still counted, even when nobody was polling the API.
+heartbeat_journal = HeartbeatJournal(HEARTBEAT_JOURNAL_PATH, HEARTBEAT_SUMMARY_PATH,
+                                     interval=HEARTBEAT_INTERVAL)
+# Totals for the sessions before this boot; they can't change until the next reboot
+_journal_totals = None
+
+
+def get_journal_totals():
+    """Uptime/downtime/reboots of previous boots, read from the journal once per process"""
+    global _journal_totals
+    if _journal_totals is None:
+        _journal_totals = heartbeat_journal.totals(get_current_boot_time())
+    return _journal_totals
+
+
+def record_heartbeat(now=None, force=False):
+    """Append a heartbeat for the current boot (rate-limited to HEARTBEAT_INTERVAL)"""
+    try:
+        return heartbeat_journal.beat(get_current_boot_time(), now, force=force)
+    except Exception as e:
+        print(f"Heartbeat journal error: {e}")
+        return False
+
+
+def reconcile_uptime_journal():
     """
-    Check if a reboot occurred and update accumulated uptime accordingly.
+    Open the heartbeat journal and bring the UptimeRecord in line with it.
     This should be called at startup.
+    On the first run the journal is seeded with the uptime already stored
+    in the database, so history from before the journal isn't lost.
     """
     record = get_or_create_uptime_record()
     current_boot_time = get_current_boot_time()
-    
-    # Check if server was restarted (boot time changed)
+
+    baseline = record.accumulated_uptime_seconds or 0.0
     if record.last_boot_time and abs(record.last_boot_time - current_boot_time) > 60:
-        # Server was restarted!
-        # Add the last saved session uptime to accumulated total
-        record.accumulated_uptime_seconds += record.last_session_uptime
-        record.last_session_uptime = 0.0  # Reset for new session
-        record.last_boot_time = current_boot_time
-        record.last_updated = datetime.utcnow()
-        db.session.commit()
-        print(f"New boot detected. Accumulated uptime updated to: {record.accumulated_uptime_seconds}s")
-    
+        # Pre-journal data: the last saved session belongs to an earlier boot
+        baseline += record.last_session_uptime or 0.0
+    heartbeat_journal.open(baseline_uptime=baseline)
+    record_heartbeat(force=True)
+
+    totals = get_journal_totals()
+    record.accumulated_uptime_seconds = totals['previous_uptime_seconds']
+    record.last_session_uptime = get_system_uptime_since_boot()
+    record.last_boot_time = current_boot_time
+    record.last_updated = datetime.utcnow()
+    db.session.commit()
+    print(f"Heartbeat journal loaded. Reboots: {totals['reboots']}, "
+          f"downtime: {totals['downtime_seconds']:.0f}s")
+
     return record
 
 
-def calculate_persistent_uptime():
+# ====== UPTIME CACHE (WRITE-BEHIND) ======
+# The UptimeRecord row is mirrored in process memory. Reads are served from
+# the mirror and a background flusher writes it back every
+# UPTIME_FLUSH_INTERVAL seconds, so API requests never touch SQLite.
+_uptime_cache = None
+_uptime_dirty = False
+# Re-entrant because the SIGTERM handler may interrupt a flush in progress
+_uptime_lock = threading.RLock()
+_flusher_thread = None
+_flusher_pid = None
+_flusher_stop = threading.Event()
+
+
+def load_uptime_cache(record):
+    """Copy the persisted UptimeRecord into the in-memory cache"""
+    global _uptime_cache, _uptime_dirty
+    with _uptime_lock:
+        _uptime_cache = {
+            'accumulated_uptime_seconds': record.accumulated_uptime_seconds or 0.0,
+            'last_session_uptime': record.last_session_uptime or 0.0,
+            'last_boot_time': record.last_boot_time,
+            'last_updated': record.last_updated
+        }
+        _uptime_dirty = False
+    return _uptime_cache
+
+
+def get_uptime_cache():
+    """Return the cached uptime record, bootstrapping this process on first use"""
+    if _uptime_cache is None:
+        bootstrap()
+    return _uptime_cache
+
+
+def calculate_persistent_uptime(now=None):
     """
     Calculate the total persistent uptime.
-    Total = accumulated from previous sessions + current session uptime
+    Total = previous sessions from the heartbeat journal + current session uptime
     """
-    record = get_or_create_uptime_record()
-    current_session_uptime = get_system_uptime_since_boot()
+    current_session_uptime = get_system_uptime_since_boot(now)
     
     # Total uptime = accumulated (all previous sessions) + current session
-    total_uptime = record.accumulated_uptime_seconds + current_session_uptime
+    total_uptime = get_journal_totals()['previous_uptime_seconds'] + current_session_uptime
     
     return total_uptime
 
 
 def save_current_session_uptime():
     """
-    Save the current session uptime to the database.
-    This should be called periodically to ensure we don't lose data on unexpected shutdown.
-    The last_session_uptime is added to accumulated when a reboot is detected.
+    Record the current session uptime in the in-memory cache.
+    The value reaches the database on the next flush_uptime_cache().
+    The heartbeat journal is authoritative; the row mirrors it for reporting.
     """
-    record = get_or_create_uptime_record()
-    current_session_uptime = get_system_uptime_since_boot()
+    global _uptime_dirty
+    cache = get_uptime_cache()
+    with _uptime_lock:
+        cache['accumulated_uptime_seconds'] = get_journal_totals()['previous_uptime_seconds']
+        cache['last_session_uptime'] = get_system_uptime_since_boot()
+        cache['last_updated'] = datetime.utcnow()
+        _uptime_dirty = True
     
-    # Update the last session uptime (will be added to accumulated on next reboot)
-    record.last_session_uptime = current_session_uptime
-    record.last_updated = datetime.utcnow()
-    db.session.commit()
+    return cache
+
+
+def flush_uptime_cache():
+    """Write the cached uptime values back to the database if they changed"""
+    global _uptime_dirty
+    with _uptime_lock:
+        if _uptime_cache is None or not _uptime_dirty:
+            return False
+        try:
+            with app.app_context(), metrics.phase('db'):
+                record = get_or_create_uptime_record()
+                record.accumulated_uptime_seconds = _uptime_cache['accumulated_uptime_seconds']
+                record.last_session_uptime = _uptime_cache['last_session_uptime']
+                record.last_updated = _uptime_cache['last_updated']
+                db.session.commit()
+            _uptime_dirty = False
+            return True
+        except Exception as e:
+            print(f"Uptime flush error: {e}")
+            return False
+
+
+def _flusher_loop():
+    """Persist the session uptime every UPTIME_FLUSH_INTERVAL seconds (collector worker only)"""
+    while not _flusher_stop.wait(UPTIME_FLUSH_INTERVAL):
+        if not shared_snapshot.is_collector:
+            continue  # The collector writes the same row; no need for every worker to
+        save_current_session_uptime()
+        flush_uptime_cache()
+        flush_history()
+
+
+def start_uptime_flusher():
+    """Start the write-behind flusher thread once per process"""
+    global _flusher_thread, _flusher_pid
+    if _flusher_pid == os.getpid() and _flusher_thread is not None:
+        return
+
+    with _uptime_lock:
+        if _flusher_pid == os.getpid() and _flusher_thread is not None:
+            return
+        _flusher_stop.clear()
+        _flusher_thread = threading.Thread(target=_flusher_loop, name='uptime-flusher', daemon=True)
+        _flusher_thread.start()
+        _flusher_pid = os.getpid()
+
+
+def _flush_on_exit():
+    """Capture the latest session uptime before the process goes away"""
+    if _bootstrap_pid != os.getpid():
+        return  # Never served anything; nothing to record
+    # A final heartbeat pins the end of this session to the second
+    record_heartbeat(force=True)
+    heartbeat_journal.flush()
+    if _uptime_cache is not None:
+        save_current_session_uptime()
+        flush_uptime_cache()
+    flush_history()
+
+
+def _install_shutdown_hooks():
+    """Flush on normal interpreter exit and on SIGTERM (chaining any existing handler)"""
+    atexit.register(_flush_on_exit)
+
+    # signal handlers can only be installed from the main thread
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+
+    def _handle_sigterm(signum, frame):
+        _flush_on_exit()
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+        elif previous_handler != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+
+# ====== METRICS HISTORY ======
+# Samples are buffered in memory by the sampler thread and written by the
+# write-behind flusher. Rollup buckets are aggregated as they arrive, so a
+# history query reads a handful of pre-computed rows instead of raw samples.
+HISTORY_METRICS = (('cpu', 'cpu_percent'), ('ram', 'ram_percent'), ('disk', 'disk_percent'))
+ROLLUP_RESOLUTIONS = (60, 3600)
+HISTORY_RETENTION = {
+    0: HISTORY_RAW_RETENTION,  # Raw tier
+    60: HISTORY_MINUTE_RETENTION,
+    3600: HISTORY_HOUR_RETENTION
+}
+HISTORY_EVICT_INTERVAL = 600  # Run retention deletes at most every 10 minutes
+
+_history_lock = threading.Lock()
+_pending_samples = []
+# (resolution, bucket_start) -> partial aggregate not yet written to the DB
+_pending_rollups = {}
+_last_history_evict = 0.0
+
+
+def record_history_sample(snapshot):
+    """Buffer a sampler snapshot and fold it into the open rollup buckets"""
+    timestamp = int(snapshot['sampled_at'])
+    with _history_lock:
+        _pending_samples.append({
+            'timestamp': timestamp,
+            'cpu_percent': snapshot['cpu_percent'],
+            'ram_percent': snapshot['ram_percent'],
+            'disk_percent': snapshot['disk_percent']
+        })
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (resolution, timestamp - timestamp % resolution)
+            bucket = _pending_rollups.get(key)
+            if bucket is None:
+                bucket = _pending_rollups[key] = {'sample_count': 0}
+            bucket['sample_count'] += 1
+            for name, field in HISTORY_METRICS:
+                value = snapshot[field]
+                bucket[f'{name}_min'] = min(bucket.get(f'{name}_min', value), value)
+                bucket[f'{name}_max'] = max(bucket.get(f'{name}_max', value), value)
+                bucket[f'{name}_sum'] = bucket.get(f'{name}_sum', 0.0) + value
+
+
+def _rollup_upsert(resolution, bucket_start, bucket):
+    """
+    Build an upsert that merges a partial bucket into any existing row.
+    Buckets are flushed as deltas, so a bucket may be written several times
+    (every flush, and again after a restart) without losing samples.
+    """
+    count = bucket['sample_count']
+    values = {'resolution': resolution, 'bucket_start': bucket_start, 'sample_count': count}
+    for name, _ in HISTORY_METRICS:
+        values[f'{name}_min'] = bucket[f'{name}_min']
+        values[f'{name}_max'] = bucket[f'{name}_max']
+        values[f'{name}_avg'] = bucket[f'{name}_sum'] / count
+
+    stmt = sqlite_insert(MetricRollup).values(**values)
+    existing = MetricRollup.__table__.c
+    total = existing.sample_count + stmt.excluded.sample_count
+    merged = {'sample_count': total}
+    for name, _ in HISTORY_METRICS:
+        merged[f'{name}_min'] = func.min(existing[f'{name}_min'], stmt.excluded[f'{name}_min'])
+        merged[f'{name}_max'] = func.max(existing[f'{name}_max'], stmt.excluded[f'{name}_max'])
+        merged[f'{name}_avg'] = (
+            existing[f'{name}_avg'] * existing.sample_count
+            + stmt.excluded[f'{name}_avg'] * stmt.excluded.sample_count
+        ) / total
+    return stmt.on_conflict_do_update(index_elements=['resolution', 'bucket_start'], set_=merged)
+
+
+def evict_expired_history(now=None):
+    """Delete raw samples and rollups that fell out of their retention window"""
+    now = now or time.time()
+    MetricSample.query.filter(
+        MetricSample.timestamp < now - HISTORY_RETENTION[0]
+    ).delete(synchronize_session=False)
+    for resolution in ROLLUP_RESOLUTIONS:
+        MetricRollup.query.filter(
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket_start < now - HISTORY_RETENTION[resolution]
+        ).delete(synchronize_session=False)
+    HostSample.query.filter(
+        HostSample.timestamp < now - HOST_SAMPLE_RETENTION
+    ).delete(synchronize_session=False)
+
+
+def flush_history():
+    """Write buffered samples and rollup deltas in one transaction"""
+    global _pending_samples, _pending_rollups, _last_history_evict
+    with _history_lock:
+        samples, rollups = _pending_samples, _pending_rollups
+        _pending_samples, _pending_rollups = [], {}
+
+    if not samples and not rollups:
+        return 0
+
+    try:
+        with app.app_context(), metrics.phase('db'):
+            if samples:
+                # OR IGNORE: several workers may sample the same second
+                db.session.execute(sqlite_insert(MetricSample).prefix_with('OR IGNORE'), samples)
+            for (resolution, bucket_start), bucket in rollups.items():
+                db.session.execute(_rollup_upsert(resolution, bucket_start, bucket))
+
+            now = time.time()
+            if now - _last_history_evict >= HISTORY_EVICT_INTERVAL:
+                evict_expired_history(now)
+                _last_history_evict = now
+            db.session.commit()
+        return len(samples)
+    except Exception as e:
+        print(f"History flush error: {e}")
+        return 0
+
+
+def parse_duration(value):
+    """Parse durations like '90s', '15m', '24h', '30d' (bare numbers are seconds)"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    value = (value or '').strip().lower()
+    if not value:
+        raise ValueError('empty duration')
+    if value[-1] in units:
+        seconds = float(value[:-1]) * units[value[-1]]
+    else:
+        seconds = float(value)
+    if seconds <= 0:
+        raise ValueError(f'duration must be positive: {value}')
+    return seconds
+
+
+def choose_history_tier(range_seconds, step_seconds):
+    """
+    Pick the coarsest tier that still resolves the requested step and
+    whose retention covers the requested range.
+    """
+    if step_seconds < ROLLUP_RESOLUTIONS[0] and range_seconds <= HISTORY_RETENTION[0]:
+        return 0
+    for resolution in reversed(ROLLUP_RESOLUTIONS):
+        if resolution <= step_seconds and range_seconds <= HISTORY_RETENTION[resolution]:
+            return resolution
+    # Nothing fine enough covers the whole range; fall back to the widest tier
+    for resolution in ROLLUP_RESOLUTIONS:
+        if range_seconds <= HISTORY_RETENTION[resolution]:
+            return resolution
+    return ROLLUP_RESOLUTIONS[-1]
+
+
+def query_history(range_seconds, step_seconds, now=None, since=None):
+    """
+    Return min/avg/max points re-bucketed to step_seconds from a single tier.
+    With `since`, only buckets from the one containing it onwards.
+    """
+    now = now or time.time()
+    # Never hand back more than HISTORY_MAX_POINTS points
+    step = int(max(step_seconds, range_seconds / HISTORY_MAX_POINTS, 1))
+    start = int(now - range_seconds)
+    tier = choose_history_tier(range_seconds, step)
+    step = max(step, tier)
+    if since is not None and since > start:
+        start = int(since) - int(since) % step
+
+    if tier == 0:
+        columns = MetricSample.__table__.c
+        bucket = (columns.timestamp - columns.timestamp % step).label('bucket')
+        selected = [bucket, func.count().label('samples')]
+        for name, field in HISTORY_METRICS:
+            selected += [
+                func.min(columns[field]).label(f'{name}_min'),
+                func.avg(columns[field]).label(f'{name}_avg'),
+                func.max(columns[field]).label(f'{name}_max')
+            ]
+        query = db.session.query(*selected).filter(columns.timestamp >= start)
+    else:
+        columns = MetricRollup.__table__.c
+        bucket = (columns.bucket_start - columns.bucket_start % step).label('bucket')
+        selected = [bucket, func.sum(columns.sample_count).label('samples')]
+        for name, _ in HISTORY_METRICS:
+            selected += [
+                func.min(columns[f'{name}_min']).label(f'{name}_min'),
+                (func.sum(columns[f'{name}_avg'] * columns.sample_count)
+                 / func.sum(columns.sample_count)).label(f'{name}_avg'),
+                func.max(columns[f'{name}_max']).label(f'{name}_max')
+            ]
+        query = db.session.query(*selected).filter(
+            columns.resolution == tier,
+            columns.bucket_start >= start - start % tier
+        )
+
+    rows = query.group_by('bucket').order_by('bucket').all()
+    points = [dict(row._mapping, timestamp=row.bucket) for row in rows]
+    for point in points:
+        del point['bucket']
+    return {
+        'range_seconds': range_seconds,
+        'step_seconds': step,
+        'resolution_seconds': tier or None,
+        'points': points
+    }
+
+
+# ====== BULK EXPORT / IMPORT ======
+# The stored history (raw samples and rollups) streamed out one batch per
+# chunk, paging by primary key so every batch is an index range scan.
+# Imports use INSERT OR IGNORE: rows this service already has win, so an
+# import can be re-run and never double-counts a rollup bucket.
+EXPORT_TABLES = {
+    'metric_sample': MetricSample,
+    'metric_rollup': MetricRollup
+}
+
+
+def parse_export_tables(value):
+    """Tables named by ?table= (comma-separated), default all"""
+    if not value:
+        return list(EXPORT_TABLES)
+    tables = [table.strip() for table in value.split(',') if table.strip()]
+    unknown = set(tables) - set(EXPORT_TABLES)
+    if unknown:
+        raise ValueError(f"unknown tables: {', '.join(sorted(unknown))} (expected {', '.join(EXPORT_TABLES)})")
+    return tables
+
+
+def export_fields(tables):
+    """CSV columns for an export of `tables`: the table name, then every column once"""
+    fields = ['table']
+    for table in tables:
+        fields += [column.name for column in EXPORT_TABLES[table].__table__.columns if column.name not in fields]
+    return fields
+
+
+def iter_table_records(table, batch_size=EXPORT_BATCH):
+    """Yield every row of an export table as records, in primary key order, batch_size at a time"""
+    model = EXPORT_TABLES[table]
+    key = list(model.__table__.primary_key.columns)
+    last = None
+    while True:
+        # A fresh session per batch, so a slow reader holds no connection between chunks
+        with app.app_context(), metrics.phase('db'):
+            query = db.session.query(*model.__table__.columns)
+            if last is not None:
+                query = query.filter(tuple_(*key) > tuple_(*last))
+            rows = query.order_by(*key).limit(batch_size).all()
+        if not rows:
+            return
+        yield [{'table': table, **row._asdict()} for row in rows]
+        last = [getattr(rows[-1], column.name) for column in key]
+
+
+def export_chunks(fmt, tables):
+    """Encoded chunks of the export; nothing is read until the first chunk is requested"""
+    flush_history()  # Include samples still buffered in memory
+    batches = (batch for table in tables for batch in iter_table_records(table))
+    yield from encode_batches(batches, fmt, export_fields(tables))
+
+
+def parse_import_rows(records):
+    """Group import records into rows per table; raises ValueError if malformed"""
+    rows = {table: [] for table in EXPORT_TABLES}
+    for record in records:
+        table = record.get('table')
+        model = EXPORT_TABLES.get(table)
+        if model is None:
+            raise ValueError(f'unknown table: {table}')
+        row = {}
+        for column in model.__table__.columns:
+            value = record.get(column.name)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f'{table}.{column.name} must be a number')
+            if column.primary_key:
+                if value is None:
+                    raise ValueError(f'{table}.{column.name} is required')
+                value = int(value)
+            row[column.name] = value
+        rows[table].append(row)
+    return rows
+
+
+def import_history(body, authorization=None):
+    """Insert one import batch, keeping existing rows; returns (payload, status)"""
+    rejection = import_rejection(authorization)
+    if rejection is not None:
+        return {'error': rejection[0], 'status': 'error'}, rejection[1]
+    try:
+        records = parse_import_records(body, MAX_IMPORT_BATCH)
+        rows = parse_import_rows(records)
+    except ValueError as e:
+        return {'error': str(e), 'status': 'error'}, 400
+
+    imported = {}
+    with app.app_context():
+        with metrics.phase('db'):
+            for table, table_rows in rows.items():
+                if table_rows:
+                    result = db.session.execute(
+                        EXPORT_TABLES[table].__table__.insert().prefix_with('OR IGNORE'), table_rows
+                    )
+                    imported[table] = result.rowcount
+            db.session.commit()
+    return {
+        'status': 'ok',
+        'received': len(records),
+        'imported': imported,
+        'skipped': len(records) - sum(imported.values())
+    }, 200
+
+
+# ====== STATS PAYLOAD ======
+# One broadcaster per stream encoding (SSE or MessagePack, full or delta); see payload_codec.py
+stats_streams = StreamVariants(queue_size=STREAM_QUEUE_SIZE)
+# Serialized payload of the latest snapshot, shared by /api/homeserver and the stream
+stats_cache = ResponseCache(timer=lambda: metrics.phase('serialize'))
+# MessagePack and delta variants of that payload, encoded on demand
+stats_encoder = PayloadEncoder()
+
+
+def build_stats_payload(snapshot):
+    """
+    Build the public stats payload from a sampler snapshot.
+    Everything is computed as of the sample time, so the payload depends
+    only on the snapshot and can be serialized once and reused.
+    """
+    sampled_at = snapshot['sampled_at']
+    # Get uptime values (served from the in-memory uptime cache;
+    # the write-behind flusher persists them in the background)
+    current_uptime = get_system_uptime_since_boot(sampled_at)
+    total_uptime = calculate_persistent_uptime(sampled_at)
     
-    return record
+    # Gaps between one boot's last heartbeat and the next boot
+    totals = get_journal_totals()
+    
+    return {
+        'uptime': total_uptime,  # For backward compatibility
+        'current_uptime': current_uptime,
+        'total_uptime': total_uptime,
+        'downtime': totals['downtime_seconds'],
+        'reboots': totals['reboots'],
+        'cpu_percent': snapshot['cpu_percent'],
+        'ram_percent': snapshot['ram_percent'],
+        'disk_percent': snapshot['disk_percent'],
+        # Extended telemetry: per-core CPU, load, network/disk I/O rates, every mount
+        **(snapshot.get('host') or {}),
+        'timestamp': datetime.fromtimestamp(sampled_at, timezone.utc).isoformat(),
+        'status': 'online'
+    }
+
+
+def get_stats_body(snapshot):
+    """Serialized payload and ETag for a snapshot, built once per snapshot"""
+    return stats_cache.get(snapshot['sampled_at'], lambda: build_stats_payload(snapshot))
+
+
+# ====== ALERTS ======
+# Evaluated by the collector on every sample; see alerts.py for rule types
+DEFAULT_ALERT_RULES = [
+    {'type': 'threshold', 'name': 'cpu_saturated', 'metric': 'cpu_percent', 'threshold': 90, 'for': '5m'},
+    {'type': 'threshold', 'name': 'ram_saturated', 'metric': 'ram_percent', 'threshold': 90, 'for': '5m'},
+    {'type': 'fill', 'name': 'disk_full_within_24h', 'metric': 'disk_percent', 'window': '6h', 'horizon': '24h'}
+]
+alert_engine = build_engine('homeserver', DEFAULT_ALERT_RULES, os.path.join(basedir, 'alerts.ndjson'))
+
+
+def alert_sample(snapshot):
+    """Flatten a snapshot into the metric names alert rules refer to"""
+    host = snapshot.get('host') or {}
+    sample = {
+        'cpu_percent': snapshot['cpu_percent'],
+        'ram_percent': snapshot['ram_percent'],
+        'disk_percent': snapshot['disk_percent']
+    }
+    if host.get('load_avg'):
+        sample['load_1m'] = host['load_avg'][0]
+    for filesystem in host.get('filesystems') or []:
+        sample[f"filesystem_percent:{filesystem['mountpoint']}"] = filesystem['percent']
+    return sample
+
+
+# ====== FLEET (MULTI-HOST) ======
+# Host agents POST compact batches to /api/hosts/ingest; rows land in
+# host_sample. Every worker keeps its own in-memory Fleet (see fleet.py) and
+# catches up by reading only the rows with an id above the last one it
+# folded in, at most once per FLEET_SYNC_INTERVAL. /api/hosts then reads
+# running aggregates instead of scanning samples.
+FLEET_SYNC_INTERVAL = 1.0
+HOST_RECENT_POINTS = 120
+HOST_RECENT_WINDOW = 1800  # First sync folds in this much of each host's recent history (seconds)
+HOST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+HOSTS_MAX_AGE = 1
+
+fleet = Fleet(stale_after=HOST_STALE_AFTER, recent_points=HOST_RECENT_POINTS)
+hosts_cache = ResponseCache(timer=lambda: metrics.phase('serialize'))
+_fleet_lock = threading.Lock()
+_fleet_last_id = None  # Highest host_sample id folded in; None until the first sync
+_fleet_synced_at = 0.0
+
+
+def _fold_host_rows(rows):
+    for row in rows:
+        fleet.add(row.host_id, {field: getattr(row, field) for field in SAMPLE_FIELDS}, row.received_at)
+
+
+def sync_fleet(force=False):
+    """Fold host_sample rows this worker hasn't seen yet into the fleet (caller has an app context)"""
+    global _fleet_last_id, _fleet_synced_at
+    now = time.time()
+    if not force and now - _fleet_synced_at < FLEET_SYNC_INTERVAL:
+        return
+    with _fleet_lock:
+        if not force and now - _fleet_synced_at < FLEET_SYNC_INTERVAL:
+            return
+        columns = HostSample.__table__.c
+        query = db.session.query(columns.id, columns.host_id, columns.received_at,
+                                 *(columns[field] for field in SAMPLE_FIELDS))
+        with metrics.phase('db'):
+            if _fleet_last_id is None:
+                # Recent history plus every host's latest row, then each host's totals
+                totals = db.session.query(
+                    columns.host_id, func.min(columns.timestamp), func.count(), func.max(columns.id)
+                ).group_by(columns.host_id).all()
+                latest_ids = [row[3] for row in totals]
+                rows = query.filter(
+                    (columns.received_at >= now - HOST_RECENT_WINDOW) | columns.id.in_(latest_ids)
+                ).order_by(columns.id).all()
+                _fold_host_rows(rows)
+                for host_id, first_seen, sample_count, _ in totals:
+                    fleet.seed(host_id, first_seen, sample_count)
+                _fleet_last_id = max(latest_ids, default=0)
+            else:
+                rows = query.filter(columns.id > _fleet_last_id).order_by(columns.id).all()
+                _fold_host_rows(rows)
+                if rows:
+                    _fleet_last_id = rows[-1].id
+        # Hosts silent for the whole retention window have had their rows evicted
+        fleet.forget_silent(now - HOST_SAMPLE_RETENTION)
+        _fleet_synced_at = now
+
+
+def parse_host_batch(body):
+    """
+    Validate an agent batch and expand it into host_sample rows:
+    {"host": "nas", "fields": ["timestamp", "cpu_percent", ...], "rows": [[...], ...]}
+    Fields default to SAMPLE_FIELDS; any of them but timestamp may be left out or null.
+    """
+    if not isinstance(body, dict):
+        raise ValueError('expected a JSON object')
+    host_id = body.get('host')
+    if not isinstance(host_id, str) or not HOST_ID_PATTERN.fullmatch(host_id):
+        raise ValueError('host must be 1-64 letters, digits, ".", "_" or "-"')
+    fields = body.get('fields') or SAMPLE_FIELDS
+    unknown = set(fields) - set(SAMPLE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(map(str, unknown)))}")
+    if 'timestamp' not in fields:
+        raise ValueError('fields must include timestamp')
+    rows = body.get('rows')
+    if not isinstance(rows, list) or not rows:
+        raise ValueError('rows must be a non-empty list')
+    if len(rows) > MAX_HOST_BATCH:
+        raise ValueError(f'at most {MAX_HOST_BATCH} rows per batch')
+
+    received_at = time.time()
+    latest_allowed = received_at + 300  # Tolerate some clock skew, not samples from the future
+    samples = []
+    for row in rows:
+        if not isinstance(row, list) or len(row) != len(fields):
+            raise ValueError(f'every row must have {len(fields)} values')
+        sample = dict.fromkeys(SAMPLE_FIELDS)
+        for field, value in zip(fields, row):
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f'{field} must be a number')
+            sample[field] = value
+        if sample['timestamp'] is None or sample['timestamp'] > latest_allowed:
+            raise ValueError('every row needs a timestamp that is not in the future')
+        sample['host_id'] = host_id
+        sample['received_at'] = received_at
+        samples.append(sample)
+    return host_id, samples
+
+
+def ingest_host_batch(body, authorization=None):
+    """Store an agent batch and fold it into this worker's fleet; returns (payload, status)"""
+    if not HOSTS_INGEST_TOKEN:
+        return {'error': 'host ingest is disabled (set HOSTS_INGEST_TOKEN)', 'status': 'error'}, 404
+    if not hmac.compare_digest(authorization or '', f'Bearer {HOSTS_INGEST_TOKEN}'):
+        return {'error': 'invalid or missing ingest token', 'status': 'error'}, 401
+    try:
+        host_id, samples = parse_host_batch(body)
+    except ValueError as e:
+        return {'error': str(e), 'status': 'error'}, 400
+
+    with app.app_context():
+        sync_fleet(force=True)
+        if fleet.host(host_id) is None and len(fleet) >= MAX_HOSTS:
+            return {'error': f'already tracking the maximum of {MAX_HOSTS} hosts', 'status': 'error'}, 403
+        with metrics.phase('db'):
+            db.session.execute(HostSample.__table__.insert(), samples)
+            db.session.commit()
+        sync_fleet(force=True)
+    return {'status': 'ok', 'host': host_id, 'accepted': len(samples)}, 200
+
+
+def get_hosts_body():
+    """Serialized /api/hosts payload and ETag, rebuilt only when the fleet or the second changes"""
+    with app.app_context():
+        sync_fleet()
+    now = int(time.time())  # Online/offline flips with time alone, so the second is part of the version
+
+    def build():
+        with _fleet_lock:
+            return {'overview': fleet.overview(now), 'hosts': fleet.hosts(now)}
+    return hosts_cache.get((fleet.version, now), build)
+
+
+def query_host_history(host_id, range_seconds, step_seconds, now=None):
+    """Per-bucket averages of one host's samples"""
+    now = now or time.time()
+    step = int(max(step_seconds, range_seconds / HISTORY_MAX_POINTS, 1))
+    columns = HostSample.__table__.c
+    seconds = cast(columns.timestamp, Integer)
+    bucket = (seconds - seconds % step).label('bucket')
+    rows = db.session.query(
+        bucket, func.count().label('samples'),
+        *(func.avg(columns[field]).label(field) for field in SAMPLE_FIELDS[1:])
+    ).filter(
+        columns.host_id == host_id,
+        columns.timestamp >= now - range_seconds
+    ).group_by('bucket').order_by('bucket').all()
+    points = []
+    for row in rows:
+        point = dict(row._mapping, timestamp=row.bucket)
+        del point['bucket']
+        points.append(point)
+    return {'range_seconds': range_seconds, 'step_seconds': step, 'points': points}
+
+
+def get_host_detail(host_id, range_seconds=None, step_seconds=None):
+    """
+    One host's summary and series; returns (payload, status).
+    Without a range the series is the in-memory ring of recent samples.
+    """
+    with app.app_context():
+        sync_fleet()
+        now = time.time()
+        with _fleet_lock:
+            host = fleet.host(host_id)
+            if host is None:
+                return {'error': f'unknown host: {host_id}', 'status': 'error'}, 404
+            summary = host.summary(now, fleet.stale_after)
+            recent = list(host.recent)
+        if range_seconds is None:
+            series = {'points': recent}
+        else:
+            with metrics.phase('db'):
+                series = query_host_history(host_id, range_seconds, step_seconds or range_seconds / 120, now)
+    return {'host': summary, 'series': series}, 200
+
+
+# Forwards this host's own samples to a central service when AGENT_INGEST_URL is set
+host_agent = create_agent()
+
+
+# ====== DISK USAGE INDEX ======
+# Only the collector walks the disk, on its own thread since a first pass
+# over a large volume takes a while. It saves the index after each pass
+# that changed it; followers reload it from there and never walk.
+disk_index = DiskIndex(DISK_INDEX_ROOTS, DISK_INDEX_PATH, DISK_INDEX_FULL_RESCAN) if DISK_INDEX_ROOTS else None
+_disk_index_thread = None
+
+
+def _disk_index_loop():
+    """Collector: refresh the index every DISK_INDEX_INTERVAL until the sampler is stopped"""
+    while True:
+        try:
+            with metrics.phase('disk_index'):
+                disk_index.refresh()
+        except Exception as e:
+            print(f"Disk indexer error: {e}")
+        if _sampler_stop.wait(DISK_INDEX_INTERVAL):
+            return
+
+
+def start_disk_indexer():
+    """Collector: resume from the saved index and start refreshing it"""
+    global _disk_index_thread
+    if disk_index is None:
+        return
+    disk_index.load()
+    _disk_index_thread = threading.Thread(target=_disk_index_loop, name='disk-indexer', daemon=True)
+    _disk_index_thread.start()
+
+
+def get_disk_top(top, sort='total', path=None):
+    """/api/homeserver/disk/top payload from the in-memory index; returns (payload, status)"""
+    if disk_index is None:
+        return {'error': 'disk indexing is disabled (set DISK_INDEX_ROOTS)', 'status': 'error'}, 404
+    try:
+        directories = disk_index.top(top, sort, path)
+    except ValueError as e:
+        return {'error': str(e), 'status': 'error'}, 400
+    except KeyError:
+        return {'error': f'not an indexed directory: {path}', 'status': 'error'}, 404
+
+    refreshed_at = disk_index.refreshed_at
+    return {
+        'roots': disk_index.summary(),
+        'directories': directories,
+        'indexed_directories': len(disk_index),
+        'refreshed_at': datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat() if refreshed_at else None,
+        'last_pass': disk_index.last_pass
+    }, 200
+
+
+# ====== METRICS SAMPLER ======
+# One worker per host is elected collector (see shared_snapshot.py). Its
+# sampler thread samples psutil on a fixed cadence, records history and
+# heartbeats, and publishes the serialized payload to shared memory. Every
+# other worker follows: requests compare the shared sequence number and
+# adopt the collector's bytes when it moved, so no worker but one ever
+# samples (or evaluates alerts), and all of them serve the same body and ETag.
+_latest_snapshot = None
+_sampler_thread = None
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+_sampler_stop = threading.Event()
+
+
+_host_collector = None
+# Refreshed from the sampler thread; requests only read it
+process_table = ProcessTable(refresh_interval=PROCESS_REFRESH_INTERVAL)
+
+shared_snapshot = SharedSnapshot(SHARED_SNAPSHOT_PATH, SHARED_SNAPSHOT_SIZE)
+_shared_seq = 0
+_shared_processes_at = None
+_shared_lock = threading.Lock()
+_processes_json = (None, b'')  # (refreshed_at, serialized export), re-encoded only on refresh
+
+
+def sample_metrics():
+    """Collect one CPU/RAM/disk sample (plus extended host telemetry) without blocking"""
+    return {
+        # interval=None compares against the previous call, so this is instant
+        'cpu_percent': psutil.cpu_percent(interval=None),
+        'ram_percent': psutil.virtual_memory().percent,
+        'disk_percent': psutil.disk_usage('/').percent,
+        'host': _host_collector.collect() if _host_collector else None,
+        'sampled_at': time.time()
+    }
+
+
+def publish_shared_snapshot(snapshot):
+    """Collector: write the serialized payload, snapshot and process table to shared memory"""
+    global _processes_json
+    body, etag = get_stats_body(snapshot)
+    if _processes_json[0] != process_table.refreshed_at:
+        _processes_json = (process_table.refreshed_at, json.dumps(process_table.export()).encode('utf-8'))
+    shared_snapshot.write(snapshot['sampled_at'], etag, body, json.dumps(snapshot).encode('utf-8'),
+                          _processes_json[0] or 0.0, _processes_json[1])
+
+
+def sync_shared_snapshot():
+    """
+    Follower: adopt the collector's latest snapshot if it has changed.
+    When it hasn't, this is a read of the shared sequence number and nothing else.
+    """
+    global _latest_snapshot, _shared_seq, _shared_processes_at
+    view = shared_snapshot.read(_shared_seq, _shared_processes_at)
+    if view is None:
+        return False
+    with _shared_lock:
+        if view.seq <= _shared_seq:
+            return False  # Another thread adopted it first
+        snapshot = json.loads(view.snapshot)
+        # Serve the collector's bytes, so every worker answers with the same ETag
+        stats_cache.put(snapshot['sampled_at'], bytes(view.body), view.etag)
+        if view.processes:
+            process_table.load(json.loads(view.processes))
+            _shared_processes_at = view.processes_at
+        _latest_snapshot = snapshot
+        _shared_seq = view.seq
+    return True
+
+
+def _sampler_loop():
+    """Collector: refresh and publish the snapshot until the sampler is stopped"""
+    global _latest_snapshot
+    while not _sampler_stop.wait(METRICS_SAMPLE_INTERVAL):
+        try:
+            # Swap in a new dict; readers never see a half-written snapshot
+            with metrics.phase('sample'):
+                _latest_snapshot = sample_metrics()
+            record_history_sample(_latest_snapshot)
+            record_heartbeat(_latest_snapshot['sampled_at'])
+            with metrics.phase('processes'):
+                process_table.refresh()
+            with metrics.phase('alerts'):
+                alert_engine.observe(alert_sample(_latest_snapshot), _latest_snapshot['sampled_at'])
+            if host_agent:
+                host_agent.add(_latest_snapshot)
+            # Serialize once per tick, for every worker and however many clients are streaming
+            with metrics.phase('serialize'):
+                publish_shared_snapshot(_latest_snapshot)
+            if stats_streams.subscriber_count:
+                stats_streams.publish(*get_stats_body(_latest_snapshot))
+        except Exception as e:
+            print(f"Metrics sampler error: {e}")
+
+
+def _snapshot_is_fresh():
+    return _latest_snapshot is not None and \
+        time.time() - _latest_snapshot['sampled_at'] < 3 * METRICS_SAMPLE_INTERVAL
+
+
+def _follower_loop():
+    """Follower: relay the collector's snapshots to this worker's streams; take over if it dies"""
+    while not _sampler_stop.wait(METRICS_SAMPLE_INTERVAL):
+        try:
+            if disk_index is not None:
+                disk_index.reload_if_changed()
+            if sync_shared_snapshot():
+                if stats_streams.subscriber_count:
+                    stats_streams.publish(*get_stats_body(_latest_snapshot))
+            elif not _snapshot_is_fresh() and shared_snapshot.try_become_collector():
+                print(f"Worker {os.getpid()} took over metrics collection")
+                _start_collector()
+                return
+        except Exception as e:
+            print(f"Metrics follower error: {e}")
+
+
+def _start_collector():
+    """Prime psutil, publish a first snapshot and start the collector thread"""
+    global _latest_snapshot, _sampler_thread, _host_collector
+    # Prime cpu_percent with one short blocking sample so the very first
+    # snapshot is meaningful (interval=None returns 0.0 on its first call)
+    _host_collector = HostCollector()
+    psutil.cpu_percent(interval=0.1)
+    _latest_snapshot = sample_metrics()
+    publish_shared_snapshot(_latest_snapshot)
+
+    _sampler_thread = threading.Thread(target=_sampler_loop, name='metrics-sampler', daemon=True)
+    _sampler_thread.start()
+    start_disk_indexer()
+
+
+def _start_follower(timeout=5.0):
+    """Wait (briefly) for a current snapshot from the collector and start following it"""
+    global _sampler_thread
+    deadline = time.monotonic() + timeout
+    while True:
+        sync_shared_snapshot()
+        # A segment left over from a previous run holds a stale snapshot
+        if _snapshot_is_fresh() or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    _sampler_thread = threading.Thread(target=_follower_loop, name='metrics-follower', daemon=True)
+    _sampler_thread.start()
+
+
+def start_metrics_sampler():
+    """
+    Start this process's sampler (collector) or follower thread once.
+    Threads don't survive fork, so a gunicorn worker forked from a preloaded
+    master starts its own the first time it is asked for metrics.
+    """
+    global _sampler_pid
+    if _sampler_pid == os.getpid() and _sampler_thread is not None:
+        return
+
+    with _sampler_lock:
+        if _sampler_pid == os.getpid() and _sampler_thread is not None:
+            return
+
+        _sampler_stop.clear()
+        if shared_snapshot.try_become_collector():
+            _start_collector()
+        else:
+            _start_follower()
+        _sampler_pid = os.getpid()
+
+
+def get_latest_snapshot():
+    """Return the most recent metrics snapshot, starting the sampler if needed"""
+    start_metrics_sampler()
+    if not shared_snapshot.is_collector:
+        sync_shared_snapshot()
+    return _latest_snapshot
+
+
+# ====== PROMETHEUS GAUGES ======
+def _snapshot_value(field):
+    """Gauge reader for a field of the latest snapshot (None before the first sample)"""
+    return lambda: _latest_snapshot[field] if _latest_snapshot else None
+
+
+metrics.gauge('cpu_percent', 'Host CPU usage (percent)', _snapshot_value('cpu_percent'))
+metrics.gauge('ram_percent', 'Host RAM usage (percent)', _snapshot_value('ram_percent'))
+metrics.gauge('disk_percent', 'Root filesystem usage (percent)', _snapshot_value('disk_percent'))
+
+
+def _load_average():
+    host = (_latest_snapshot or {}).get('host') or {}
+    return host['load_avg'][0] if host.get('load_avg') else None
+
+
+metrics.gauge('load_average_1m', '1-minute load average', _load_average)
+metrics.gauge('current_uptime_seconds', 'Uptime since the last boot', get_system_uptime_since_boot)
+metrics.gauge('persistent_uptime_seconds', 'Uptime accumulated across reboots', calculate_persistent_uptime)
+metrics.gauge('downtime_seconds', 'Downtime between boots, from the heartbeat journal',
+              lambda: get_journal_totals()['downtime_seconds'])
+metrics.gauge('reboots', 'Reboots recorded in the heartbeat journal', lambda: get_journal_totals()['reboots'])
+metrics.gauge('stream_subscribers', 'Open /api/homeserver/stream connections',
+              lambda: stats_streams.subscriber_count)
+metrics.gauge('disk_index_directories', 'Directories in the disk usage index',
+              lambda: len(disk_index) if disk_index is not None else None)
 
 
 # ====== API ROUTES ======
+@app.before_request
+def ensure_background_tasks():
+    """Make sure this process is bootstrapped and has its sampler and uptime flusher running"""
+    bootstrap()
+    start_metrics_sampler()
+    start_uptime_flusher()
+
+
 @app.route('/api/homeserver', methods=['GET'])
 def get_server_stats():
     """
     Returns sanitized server metrics.
     No IPs, ports, or sensitive logs are exposed.
+    Send `Accept: application/msgpack` for MessagePack and `?since=<version>`
+    for only the fields changed since that version (see payload_codec.py).
     """
     try:
-        # Get CPU usage (percentage)
-        cpu_percent = psutil.cpu_percent(interval=0.1)
-        
-        # Get RAM usage
-        memory = psutil.virtual_memory()
-        ram_percent = memory.percent
-        
-        # Get Disk usage (root partition)
-        disk = psutil.disk_usage('/')
-        disk_percent = disk.percent
-        
-        # Get uptime values
-        current_uptime = get_system_uptime_since_boot()
-        total_uptime = calculate_persistent_uptime()
-        
-        # Save the current session uptime periodically (on each API call)
-        save_current_session_uptime()
-        
-        # Get the record for any additional info
-        record = get_or_create_uptime_record()
-        # Downtime is tracked separately via the downtime tracker service
-        downtime = 0.0
-        
-        # Build response
-        response = {
-            'uptime': total_uptime,  # For backward compatibility
-            'current_uptime': current_uptime,
-            'total_uptime': total_uptime,
-            'downtime': downtime,
-            'cpu_percent': cpu_percent,
-            'ram_percent': ram_percent,
-            'disk_percent': disk_percent,
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'status': 'online'
-        }
-        
-        return jsonify(response)
+        # CPU, RAM and disk come from the background sampler; the body is
+        # serialized once per snapshot and clients holding it get a 304
+        snapshot = get_latest_snapshot()
+        body, etag = get_stats_body(snapshot)
+        body, etag, content_type = stats_encoder.encode(
+            body, etag, negotiate(request.headers.get('Accept'), request.args.get('format')),
+            request.args.get('since')
+        )
+        return json_response(body, etag, STATS_MAX_AGE, content_type, vary='Accept')
     
     except Exception as e:
         return jsonify({
@@ -162,6 +1223,28 @@ def get_server_stats():
         }), 500
 
 
+@app.route('/api/homeserver/stream', methods=['GET'])
+def stream_server_stats():
+    """
+    Server-Sent Events stream of the same payload as /api/homeserver.
+    Every subscriber receives the snapshot the sampler already built,
+    so extra viewers add no psutil or database work.
+    ?delta=1 sends only changes after the first event; with
+    `Accept: application/msgpack` it is a MessagePack stream instead of SSE.
+    """
+    get_latest_snapshot()
+    fmt = negotiate(request.headers.get('Accept'), request.args.get('format'))
+    broadcaster, initial = stats_streams.open(
+        fmt, request.args.get('delta') in ('1', 'true'),
+        lambda: get_stats_body(get_latest_snapshot())
+    )
+    return Response(
+        broadcaster.stream(initial),
+        mimetype='text/event-stream' if fmt == 'json' else MSGPACK_TYPE,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'Vary': 'Accept'}
+    )
+
+
 @app.route('/api/homeserver/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint"""
@@ -171,6 +1254,110 @@ def health_check():
     })
 
 
+@app.route('/api/homeserver/processes', methods=['GET'])
+def get_top_processes():
+    """
+    Returns the heaviest processes from the cached process table.
+    Query params: top (1-100, default 10) and sort (cpu, memory, rss, threads).
+    Only process names and resource usage are exposed, never command lines.
+    """
+    try:
+        top = min(max(int(request.args.get('top', 10)), 1), 100)
+        processes = process_table.top(top, request.args.get('sort', 'cpu'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+    refreshed_at = process_table.refreshed_at
+    return jsonify({
+        'processes': processes,
+        'total_processes': process_table.total,
+        'refreshed_at': datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat() if refreshed_at else None
+    })
+
+
+@app.route('/api/homeserver/disk/top', methods=['GET'])
+def get_disk_usage():
+    """
+    Returns the largest directories under DISK_INDEX_ROOTS from the index
+    kept by the background disk indexer (requests never walk the disk).
+    Query params: top (1-100, default 10), sort (total: whole subtree, or
+    own: files directly inside) and path, to list the largest
+    subdirectories of one indexed directory, e.g. /api/homeserver/disk/top?path=/var
+    """
+    try:
+        top = min(max(int(request.args.get('top', 10)), 1), 100)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    payload, status = get_disk_top(top, request.args.get('sort', 'total'), request.args.get('path'))
+    return jsonify(payload), status
+
+
+@app.route('/api/homeserver/history', methods=['GET'])
+def get_history():
+    """
+    Returns CPU/RAM/disk history as min/avg/max points.
+    Query params: range (default 1h) and step (default range/120), e.g.
+    /api/homeserver/history?range=30d&step=6h
+    A client refreshing a chart can pass since=<timestamp of its last point>
+    to get only that point (which may have filled in) and newer ones.
+    MessagePack is negotiated as for /api/homeserver.
+    """
+    try:
+        range_seconds = parse_duration(request.args.get('range', '1h'))
+        step_param = request.args.get('step')
+        step_seconds = parse_duration(step_param) if step_param else range_seconds / 120
+        since = float(request.args['since']) if request.args.get('since') else None
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+    try:
+        with metrics.phase('db'):
+            history = query_history(range_seconds, step_seconds, since=since)
+        fmt = negotiate(request.headers.get('Accept'), request.args.get('format'))
+        if fmt == 'json':
+            return jsonify(history)
+        response = Response(encode(history, fmt), mimetype=MSGPACK_TYPE)
+        response.vary.add('Accept')
+        return response
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 500
+
+
+@app.route('/api/homeserver/export', methods=['GET'])
+def export_history():
+    """
+    Streams the stored history: /api/homeserver/export?format=ndjson|csv&table=metric_sample
+    Every record names its table; without table= all tables are exported.
+    """
+    try:
+        fmt = parse_export_format(request.args.get('format'))
+        tables = parse_export_tables(request.args.get('table'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    return Response(
+        export_chunks(fmt, tables),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={export_filename("metrics", fmt)}'}
+    )
+
+
+@app.route('/api/homeserver/import', methods=['POST'])
+def import_history_batch():
+    """
+    Imports a batch of exported records: {"records": [{"table": "metric_sample", ...}, ...]}
+    Rows that already exist are kept, so an interrupted import can be re-run.
+    Requires `Authorization: Bearer $IMPORT_TOKEN`; disabled (404) while that is unset.
+    """
+    try:
+        payload, status = import_history(request.get_json(silent=True), request.headers.get('Authorization'))
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+
 @app.route('/api/homeserver/save-uptime', methods=['POST'])
 def save_uptime():
     """
@@ -178,73 +1365,188 @@ def save_uptime():
     Can be called before server shutdown via a systemd hook.
     """
     try:
-        record = save_current_session_uptime()
-        total_uptime = calculate_persistent_uptime()
-        
-        return jsonify({
-            'status': 'saved',
-            'current_session_uptime': record.last_session_uptime,
-            'accumulated_uptime': record.accumulated_uptime_seconds,
-            'total_uptime': total_uptime
-        })
+        return jsonify(save_uptime_now())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-# ====== DATABASE MIGRATION ======
-def migrate_database():
+def save_uptime_now():
+    """Heartbeat, save and flush the session uptime synchronously; returns the response payload"""
+    record_heartbeat(force=True)
+    cache = save_current_session_uptime()
+    # Flush synchronously so the value is on disk before shutdown proceeds
+    flush_uptime_cache()
+    total_uptime = calculate_persistent_uptime()
+    
+    return {
+        'status': 'saved',
+        'current_session_uptime': cache['last_session_uptime'],
+        'accumulated_uptime': cache['accumulated_uptime_seconds'],
+        'total_uptime': total_uptime
+    }
+
+
+@app.route('/api/hosts/ingest', methods=['POST'])
+def ingest_hosts():
     """
-    Handle migration from old schema to new schema.
-    Old schema had: total_uptime_seconds
-    New schema has: accumulated_uptime_seconds, last_session_uptime
+    Accepts a batch of samples from a host agent (see host_agent.py).
+    Requires `Authorization: Bearer $HOSTS_INGEST_TOKEN`; disabled (404) while that is unset.
     """
-    with app.app_context():
-        try:
-            # Check if we need to migrate by checking for old column
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('uptime_record')]
-            
-            if 'total_uptime_seconds' in columns and 'accumulated_uptime_seconds' not in columns:
-                # Old schema detected - need to migrate
-                print("Migrating database from old schema to new schema...")
-                
-                # Add new columns
-                with db.engine.connect() as conn:
-                    conn.execute(text('ALTER TABLE uptime_record ADD COLUMN accumulated_uptime_seconds FLOAT DEFAULT 0.0'))
-                    conn.execute(text('ALTER TABLE uptime_record ADD COLUMN last_session_uptime FLOAT DEFAULT 0.0'))
-                    # Copy old total_uptime_seconds to accumulated_uptime_seconds
-                    conn.execute(text('UPDATE uptime_record SET accumulated_uptime_seconds = total_uptime_seconds'))
-                    conn.commit()
-                
-                print("Database migration completed!")
-            elif 'accumulated_uptime_seconds' not in columns:
-                # Fresh database, columns will be created by create_all()
-                pass
-        except Exception as e:
-            print(f"Migration check error (may be normal for new DB): {e}")
+    try:
+        payload, status = ingest_host_batch(request.get_json(silent=True), request.headers.get('Authorization'))
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 500
 
 
-# ====== INITIALIZATION ======
-def init_db():
-    """Initialize the database and handle boot time changes"""
-    with app.app_context():
-        # First, try to migrate if needed
-        migrate_database()
-        
-        # Create tables (will create new columns if missing)
-        db.create_all()
-        
-        # Handle boot detection - this will add previous session uptime to accumulated
-        # if a reboot is detected
-        handle_boot_detection()
-        
-        record = get_or_create_uptime_record()
-        print(f"Uptime tracker initialized. Accumulated: {record.accumulated_uptime_seconds}s, Last session: {record.last_session_uptime}s")
-
-
-# Initialize database on import
-init_db()
+@app.route('/api/hosts', methods=['GET'])
+def list_hosts():
+    """Fleet overview (hosts online, average CPU/RAM/disk) and every host's latest sample"""
+    try:
+        body, etag = get_hosts_body()
+        return json_response(body, etag, HOSTS_MAX_AGE)
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+
+@app.route('/api/hosts/<host_id>', methods=['GET'])
+def get_host(host_id):
+    """
+    One host's latest sample and series. Without query params the series is
+    its recent samples; with range (and optionally step) it is bucketed
+    averages from storage, e.g. /api/hosts/nas?range=24h&step=15m
+    """
+    try:
+        range_param = request.args.get('range')
+        step_param = request.args.get('step')
+        range_seconds = parse_duration(range_param) if range_param else None
+        step_seconds = parse_duration(step_param) if step_param else None
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+
+    try:
+        payload, status = get_host_detail(host_id, range_seconds, step_seconds)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
+
+# ====== SCHEMA & BOOTSTRAP ======
+# Nothing touches the database at import. The first request (or the init-db
+# CLI command) bootstraps the process: a single query confirms the schema
+# version and that this boot has been reconciled. Only if one of them is
+# stale does it take an exclusive file lock and do the work, so forked
+# workers and recycled workers start without DDL or racing commits.
+# Bump (and add a MIGRATIONS entry if needed) whenever the models change
+SCHEMA_VERSION = 2
+_bootstrap_pid = None
+_bootstrap_lock = threading.Lock()
+
+
+def _schema_version(conn):
+    """Version recorded in schema_version, or 0 for a database that predates it"""
+    try:
+        return conn.execute(text('SELECT version FROM schema_version')).scalar() or 0
+    except OperationalError:
+        return 0
+
+
+def _migrate_legacy_uptime_columns(conn):
+    """
+    Version 0 -> 1: the oldest schema had total_uptime_seconds where we now
+    have accumulated_uptime_seconds and last_session_uptime.
+    Only ever runs against a database without a schema_version table.
+    """
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info('uptime_record')"))}
+    if 'total_uptime_seconds' in columns and 'accumulated_uptime_seconds' not in columns:
+        print("Migrating database from old schema to new schema...")
+        conn.execute(text('ALTER TABLE uptime_record ADD COLUMN accumulated_uptime_seconds FLOAT DEFAULT 0.0'))
+        conn.execute(text('ALTER TABLE uptime_record ADD COLUMN last_session_uptime FLOAT DEFAULT 0.0'))
+        # Copy old total_uptime_seconds to accumulated_uptime_seconds
+        conn.execute(text('UPDATE uptime_record SET accumulated_uptime_seconds = total_uptime_seconds'))
+        print("Database migration completed!")
+
+
+# (version, migration) in order; create_all() adds any new tables afterwards
+# (version 2 only added host_sample, so it needs no migration of its own)
+MIGRATIONS = [
+    (1, _migrate_legacy_uptime_columns)
+]
+
+
+def upgrade_schema():
+    """Bring the schema up to SCHEMA_VERSION (caller holds the deployment lock)"""
+    with db.engine.begin() as conn:
+        version = _schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return False
+        for target, migration in MIGRATIONS:
+            if version < target:
+                migration(conn)
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+        conn.execute(text('DELETE FROM schema_version'))
+        conn.execute(text('INSERT INTO schema_version (version) VALUES (:version)'), {'version': SCHEMA_VERSION})
+    return True
+
+
+def _bootstrap_is_current():
+    """One query: is the schema current and has this boot been reconciled?"""
+    if not os.path.exists(HEARTBEAT_SUMMARY_PATH):
+        return False
+    with db.engine.connect() as conn:
+        if _schema_version(conn) < SCHEMA_VERSION:
+            return False
+        last_boot_time = conn.execute(text('SELECT last_boot_time FROM uptime_record LIMIT 1')).scalar()
+    return last_boot_time is not None and abs(last_boot_time - get_current_boot_time()) < 1
+
+
+class _DeploymentLock:
+    """Exclusive flock on a file next to the database, shared by every worker"""
+
+    def __enter__(self):
+        self._file = open(f'{METRICS_DB_PATH}.lock', 'a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+def bootstrap():
+    """
+    Initialize this process once: upgrade the schema and reconcile the
+    uptime record with the heartbeat journal if no other worker has done it
+    for this deployment and boot, then load the uptime cache.
+    """
+    global _bootstrap_pid
+    if _bootstrap_pid == os.getpid():
+        return
+    with _bootstrap_lock:
+        if _bootstrap_pid == os.getpid():
+            return
+        with app.app_context():
+            if not _bootstrap_is_current():
+                with _DeploymentLock():
+                    # Another worker may have finished while we waited for the lock
+                    if not _bootstrap_is_current():
+                        upgrade_schema()
+                        reconcile_uptime_journal()
+            record = get_or_create_uptime_record()
+            load_uptime_cache(record)
+        _bootstrap_pid = os.getpid()
+    print(f"Uptime tracker initialized. Accumulated: {record.accumulated_uptime_seconds}s, Last session: {record.last_session_uptime}s")
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Run the bootstrap once per deployment (e.g. as a pre-deploy step)"""
+    bootstrap()
+
+
+# Flush uptime on shutdown; this does no database work until a flush is needed
+_install_shutdown_hooks()
 
 
 if __name__ == '__main__':
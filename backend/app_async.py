@@ -0,0 +1,232 @@
+"""
+Async entry point for the homeserver stats API.
+
+Serves the same routes and JSON as app.py (which it imports for the
+sampler, caches, history and uptime accounting) from one aiohttp event
+loop, so streaming clients and slow dashboard viewers don't each hold a
+worker. Run with:
+
+    gunicorn app_async:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:8487
+
+or `python app_async.py` for a single process.
+"""
+
+import os
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+import app as homeserver
+from bulk_export import EXPORT_FORMATS, export_filename, parse_export_format
+from payload_codec import MSGPACK_TYPE, encode, negotiate
+from async_web import (chunked_response, cors_middleware, error_response, instrument, json_payload,
+                       json_response, read_json, run_blocking, sse_response)
+
+
+async def get_stats_body(snapshot):
+    """Cached body for a snapshot; only a new snapshot is serialized (off the loop)"""
+    cached = homeserver.stats_cache.peek(snapshot['sampled_at'])
+    if cached is not None:
+        return cached
+    return await run_blocking(homeserver.get_stats_body, snapshot)
+
+
+# ====== API ROUTES ======
+def _format(request):
+    return negotiate(request.headers.get('Accept'), request.query.get('format'))
+
+
+async def get_server_stats(request):
+    """Same payload (and MessagePack/delta variants) as GET /api/homeserver on the WSGI app"""
+    try:
+        body, etag = await get_stats_body(homeserver.get_latest_snapshot())
+        fmt, since = _format(request), request.query.get('since')
+        if fmt != 'json' or since is not None:
+            body, etag, content_type = await run_blocking(homeserver.stats_encoder.encode, body, etag, fmt, since)
+        else:
+            content_type = 'application/json'
+        return json_response(request, body, etag, homeserver.STATS_MAX_AGE, content_type, vary='Accept')
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def stream_server_stats(request):
+    """Stream of the /api/homeserver payload (SSE, or MessagePack; full or ?delta=1)"""
+    primed = await get_stats_body(homeserver.get_latest_snapshot())
+
+    def current():
+        # Runs on the loop once subscribed: use the cached body, never serialize here
+        snapshot = homeserver.get_latest_snapshot()
+        return homeserver.stats_cache.peek(snapshot['sampled_at']) or primed
+
+    fmt = _format(request)
+    broadcaster, initial = homeserver.stats_streams.open(fmt, request.query.get('delta') in ('1', 'true'), current)
+    return await sse_response(request, broadcaster, initial,
+                              'text/event-stream' if fmt == 'json' else MSGPACK_TYPE)
+
+
+async def health_check(request):
+    return json_payload({
+        'status': 'healthy',
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    })
+
+
+async def get_top_processes(request):
+    """Heaviest processes from the cached process table (refreshed by the sampler)"""
+    process_table = homeserver.process_table
+    try:
+        top = min(max(int(request.query.get('top', 10)), 1), 100)
+        processes = process_table.top(top, request.query.get('sort', 'cpu'))
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    refreshed_at = process_table.refreshed_at
+    return json_payload({
+        'processes': processes,
+        'total_processes': process_table.total,
+        'refreshed_at': datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat() if refreshed_at else None
+    })
+
+
+async def get_disk_usage(request):
+    """Largest directories from the in-memory disk usage index (see app.get_disk_usage)"""
+    try:
+        top = min(max(int(request.query.get('top', 10)), 1), 100)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    payload, status = homeserver.get_disk_top(top, request.query.get('sort', 'total'), request.query.get('path'))
+    return json_payload(payload, status)
+
+
+def _query_history(range_seconds, step_seconds, since, fmt):
+    with homeserver.app.app_context(), homeserver.metrics.phase('db'):
+        history = homeserver.query_history(range_seconds, step_seconds, since=since)
+    return encode(history, fmt)
+
+
+async def get_history(request):
+    """CPU/RAM/disk history; the SQLite query (and encoding) runs on the blocking pool"""
+    try:
+        range_seconds = homeserver.parse_duration(request.query.get('range', '1h'))
+        step_param = request.query.get('step')
+        step_seconds = homeserver.parse_duration(step_param) if step_param else range_seconds / 120
+        since = float(request.query['since']) if request.query.get('since') else None
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    try:
+        fmt = _format(request)
+        body = await run_blocking(_query_history, range_seconds, step_seconds, since, fmt)
+        return web.Response(body=body, headers={'Vary': 'Accept'},
+                            content_type='application/json' if fmt == 'json' else MSGPACK_TYPE)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def export_history(request):
+    """Stored history as chunked NDJSON or CSV; each batch is read on the blocking pool"""
+    try:
+        fmt = parse_export_format(request.query.get('format'))
+        tables = homeserver.parse_export_tables(request.query.get('table'))
+    except ValueError as e:
+        return error_response(str(e), 400)
+    return await chunked_response(
+        request, homeserver.export_chunks(fmt, tables), EXPORT_FORMATS[fmt],
+        {'Content-Disposition': f'attachment; filename={export_filename("metrics", fmt)}'}
+    )
+
+
+async def import_history(request):
+    """Batch of exported records (see app.import_history)"""
+    try:
+        payload, status = await run_blocking(homeserver.import_history, await read_json(request),
+                                             request.headers.get('Authorization'))
+        return json_payload(payload, status)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def save_uptime(request):
+    """Heartbeat and flush the uptime record before a shutdown"""
+    try:
+        return json_payload(await run_blocking(homeserver.save_uptime_now))
+    except Exception as e:
+        return json_payload({'error': str(e)}, 500)
+
+
+async def ingest_hosts(request):
+    """Batch of samples from a host agent (see app.ingest_host_batch)"""
+    try:
+        payload, status = await run_blocking(homeserver.ingest_host_batch, await read_json(request),
+                                             request.headers.get('Authorization'))
+        return json_payload(payload, status)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def list_hosts(request):
+    """Fleet overview and every host's latest sample"""
+    try:
+        body, etag = await run_blocking(homeserver.get_hosts_body)
+        return json_response(request, body, etag, homeserver.HOSTS_MAX_AGE)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def get_host(request):
+    """One host's latest sample and recent (or ?range= bucketed) series"""
+    try:
+        range_param = request.query.get('range')
+        step_param = request.query.get('step')
+        range_seconds = homeserver.parse_duration(range_param) if range_param else None
+        step_seconds = homeserver.parse_duration(step_param) if step_param else None
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    try:
+        payload, status = await run_blocking(homeserver.get_host_detail, request.match_info['host_id'],
+                                             range_seconds, step_seconds)
+        return json_payload(payload, status)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+# ====== APPLICATION ======
+async def _start_background_tasks(app):
+    await run_blocking(homeserver.bootstrap)
+    # The first sample blocks briefly to prime cpu_percent
+    await run_blocking(homeserver.start_metrics_sampler)
+    homeserver.start_uptime_flusher()
+
+
+async def _flush_on_shutdown(app):
+    await run_blocking(homeserver._flush_on_exit)
+
+
+def create_app():
+    """Build the aiohttp application (also usable as a gunicorn app factory)"""
+    app = web.Application(middlewares=[cors_middleware()])
+    instrument(app, homeserver.metrics)
+    app.router.add_get('/api/homeserver', get_server_stats)
+    app.router.add_get('/api/homeserver/stream', stream_server_stats)
+    app.router.add_get('/api/homeserver/health', health_check)
+    app.router.add_get('/api/homeserver/processes', get_top_processes)
+    app.router.add_get('/api/homeserver/disk/top', get_disk_usage)
+    app.router.add_get('/api/homeserver/history', get_history)
+    app.router.add_get('/api/homeserver/export', export_history)
+    app.router.add_post('/api/homeserver/import', import_history)
+    app.router.add_post('/api/homeserver/save-uptime', save_uptime)
+    app.router.add_post('/api/hosts/ingest', ingest_hosts)
+    app.router.add_get('/api/hosts', list_hosts)
+    app.router.add_get('/api/hosts/{host_id}', get_host)
+    app.on_startup.append(_start_background_tasks)
+    app.on_cleanup.append(_flush_on_shutdown)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8487)))
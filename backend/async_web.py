@@ -0,0 +1,182 @@
+"""
+aiohttp plumbing shared by the async entry points (app_async.py and
+downtime_tracker_async.py).
+
+Handlers run on a single event loop. Everything that can block (psutil
+reads, SQLite and Redis calls, JSON serialization of a new snapshot) goes
+through run_blocking(), which uses a small fixed-size thread pool. An open
+stream or a slow client therefore costs a coroutine and a socket, not a
+worker thread, and one process can hold thousands of them.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from instrumentation import CONTENT_TYPE
+
+# Threads available for blocking calls; extra calls queue for a free thread
+ASYNC_EXECUTOR_WORKERS = int(os.environ.get('ASYNC_EXECUTOR_WORKERS', '8'))
+
+_executor = None
+_executor_pid = None
+
+
+def get_executor():
+    """The bounded pool for blocking calls, created once per process"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix='blocking')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the bounded pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def dumps(payload):
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def json_payload(payload, status=200):
+    """JSON response for a freshly built (uncached) payload"""
+    return web.Response(text=dumps(payload), status=status, content_type='application/json')
+
+
+def error_response(message, status):
+    return json_payload({'error': message, 'status': 'error'}, status)
+
+
+async def read_json(request):
+    """Parsed JSON body, or None if it is missing or malformed (like get_json(silent=True))"""
+    try:
+        return json.loads(await request.read() or b'null')
+    except ValueError:
+        return None
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/').strip('"') == etag:
+            return True
+    return False
+
+
+def json_response(request, body, etag, max_age, content_type='application/json', vary=None):
+    """Serve a pre-serialized body, or 304 if the client already has it"""
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': f'public, max-age={max_age}'}
+    if vary:
+        headers['Vary'] = vary
+    if _etag_matches(request, etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=headers, content_type=content_type)
+
+
+async def sse_response(request, broadcaster, initial, content_type='text/event-stream'):
+    """
+    Relay a broadcaster to one client until it disconnects: Server-Sent
+    Events, or whatever framing the broadcaster uses for `content_type`.
+    """
+    response = web.StreamResponse(headers={
+        'Content-Type': content_type,
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    stream = broadcaster.astream(initial)
+    try:
+        async for chunk in stream:
+            await response.write(chunk)
+    except ConnectionResetError:
+        pass  # Client went away
+    finally:
+        await stream.aclose()
+    return response
+
+
+async def chunked_response(request, chunks, content_type, headers=None):
+    """
+    Stream a synchronous iterator of bytes chunks (e.g. a bulk export) with
+    chunked transfer encoding. Each chunk is produced on the blocking pool,
+    so reading the next batch never stalls the event loop.
+    """
+    response = web.StreamResponse(headers={'Content-Type': content_type, **(headers or {})})
+    await response.prepare(request)
+    chunks = iter(chunks)
+    try:
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+    except ConnectionResetError:
+        pass  # Client went away
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await run_blocking(close)
+    return response
+
+
+def cors_middleware(paths=None):
+    """
+    Allow cross-origin requests to `paths` (every path if None), matching
+    what flask_cors does for the WSGI apps.
+    """
+
+    @web.middleware
+    async def middleware(request, handler):
+        allowed = paths is None or request.path in paths
+        if allowed and request.method == 'OPTIONS' and 'Access-Control-Request-Method' in request.headers:
+            response = web.Response(headers={
+                'Access-Control-Allow-Methods': 'GET, HEAD, POST, OPTIONS',
+                'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '')
+            })
+        else:
+            response = await handler(request)
+        if allowed:
+            response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    return middleware
+
+
+def instrument(app, metrics, path='/metrics'):
+    """Time every request into `metrics` and expose the registry at `path`"""
+
+    @web.middleware
+    async def middleware(request, handler):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            # Route templates keep cardinality bounded (no raw paths or ids)
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else 'unmatched'
+            metrics.requests.observe((route, request.method, str(status)), time.perf_counter() - started)
+
+    async def metrics_endpoint(request):
+        text = await run_blocking(metrics.render)  # Gauges may read psutil or the store
+        return web.Response(text=text, headers={'Content-Type': CONTENT_TYPE})
+
+    app.middlewares.append(middleware)
+    app.router.add_get(path, metrics_endpoint)
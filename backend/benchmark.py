@@ -0,0 +1,444 @@
+"""
+Load and latency benchmark for the stats API and the downtime tracker.
+
+Starts both services locally, each in its own process, with a throwaway
+data directory. In the stats service, psutil is replaced by cheap
+deterministic fakes so the numbers measure this code and not the host.
+It then drives a client load, saves the results as JSON, and can compare
+two result files to catch regressions between commits.
+
+Scenarios:
+    polling  dashboard tabs polling /api/homeserver and /api/downtime/status
+             (sending If-None-Match like a browser)
+    burst    monitors hammering trigger-offline/online and /api/downtime/events
+             together, which contends for the tracker's write lock
+    mixed    both at once
+
+Usage:
+    python benchmark.py run --scenario mixed --clients 50 --duration 15 -o before.json
+    python benchmark.py run --server async -o after.json
+    python benchmark.py compare before.json after.json --threshold 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STATS_PORT = 18487
+TRACKER_PORT = 18501
+
+
+# ====== SERVERS ======
+class _FakeProcess:
+    def __init__(self, pid):
+        self.info = {
+            'pid': pid, 'name': f'proc-{pid}', 'username': 'bench', 'cpu_percent': pid % 7 * 1.5,
+            'memory_percent': pid % 11 * 0.4, 'memory_info': None, 'num_threads': pid % 5 + 1,
+            'status': 'sleeping'
+        }
+
+
+def stub_psutil():
+    """Replace host-dependent psutil calls with cheap deterministic fakes"""
+    from collections import namedtuple
+
+    import psutil
+
+    started = time.time()
+    memory = namedtuple('svmem', 'total available percent used free')
+    usage = namedtuple('sdiskusage', 'total used free percent')
+    partition = namedtuple('sdiskpart', 'device mountpoint fstype opts')
+    net = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv')
+    disk = namedtuple('sdiskio', 'read_count write_count read_bytes write_bytes')
+
+    def elapsed():
+        return int(time.time() - started)
+
+    psutil.cpu_percent = lambda interval=None, percpu=False: [12.5] * 4 if percpu else 12.5
+    psutil.virtual_memory = lambda: memory(8 << 30, 4 << 30, 50.0, 4 << 30, 4 << 30)
+    psutil.disk_usage = lambda path: usage(100 << 30, 40 << 30, 60 << 30, 40.0)
+    psutil.disk_partitions = lambda all=False: [partition('/dev/bench', '/', 'ext4', 'rw')]
+    psutil.net_io_counters = lambda: net(1000 * elapsed(), 2000 * elapsed(), 10 * elapsed(), 20 * elapsed())
+    psutil.disk_io_counters = lambda: disk(5 * elapsed(), 8 * elapsed(), 4096 * elapsed(), 8192 * elapsed())
+    psutil.boot_time = lambda: started - 3600
+    psutil.process_iter = lambda attrs=None, ad_value=None: iter([_FakeProcess(pid) for pid in range(1, 201)])
+
+
+def serve(service, server, port):
+    """Child-process entry point: run one service until killed"""
+    sys.path.insert(0, BACKEND_DIR)
+    if service == 'stats':
+        stub_psutil()
+    module = {
+        ('stats', 'wsgi'): 'app',
+        ('stats', 'async'): 'app_async',
+        ('tracker', 'wsgi'): 'downtime_tracker',
+        ('tracker', 'async'): 'downtime_tracker_async'
+    }[service, server]
+    application = __import__(module).app
+
+    if server == 'async':
+        from aiohttp import web
+        web.run_app(application, host='127.0.0.1', port=port, print=None)
+    else:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass  # An access log line per request would dominate the measurement
+
+        make_server('127.0.0.1', port, application, threaded=True,
+                    request_handler=QuietHandler).serve_forever()
+
+
+def start_servers(server, workdir):
+    """Spawn both services on local ports with their state inside `workdir`"""
+    env = dict(
+        os.environ,
+        METRICS_DB_PATH=os.path.join(workdir, 'system_metrics.db'),
+        DOWNTIME_DB_PATH=os.path.join(workdir, 'downtime_tracker.db'),
+        HEARTBEAT_JOURNAL_PATH=os.path.join(workdir, 'heartbeat.journal'),
+        HEARTBEAT_SUMMARY_PATH=os.path.join(workdir, 'heartbeat_sessions.json'),
+        SHARED_SNAPSHOT_PATH=os.path.join(workdir, 'snapshot.shm'),
+        DOWNTIME_STORE='sqlite',
+        # Every simulated client is 127.0.0.1; measure capacity, not the per-client rate limits
+        READ_RATE_LIMIT='1000000', READ_RATE_BURST='1000000',
+        WRITE_RATE_LIMIT='1000000', WRITE_RATE_BURST='1000000'
+    )
+    processes = []
+    for service, port in (('stats', STATS_PORT), ('tracker', TRACKER_PORT)):
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', service, '--server', server, '--port', str(port)],
+            env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL
+        ))
+    return processes
+
+
+async def wait_ready(session, urls, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'{url} did not come up within {timeout:.0f}s')
+            await asyncio.sleep(0.2)
+
+
+# ====== LOAD ======
+class Recorder:
+    """Latencies, status codes and lock errors per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.lock_errors = 0
+
+    async def request(self, session, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        counts = self.statuses.setdefault(name, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+        if status >= 500:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            if b'locked' in body or b'busy' in body:
+                self.lock_errors += 1
+        return response
+
+
+async def polling_tab(session, recorder, deadline, think):
+    """One dashboard tab: poll both status endpoints, revalidating with ETags"""
+    etags = {}
+    urls = (
+        ('GET /api/homeserver', f'http://127.0.0.1:{STATS_PORT}/api/homeserver'),
+        ('GET /api/downtime/status', f'http://127.0.0.1:{TRACKER_PORT}/api/downtime/status')
+    )
+    while time.monotonic() < deadline:
+        for name, url in urls:
+            headers = {'If-None-Match': etags[url]} if url in etags else {}
+            response = await recorder.request(session, name, 'GET', url, headers=headers)
+            if response is not None and response.headers.get('ETag'):
+                etags[url] = response.headers['ETag']
+        if think:
+            await asyncio.sleep(think)
+
+
+async def monitor(session, recorder, deadline, think, batch_size):
+    """One monitor: flip the tracker offline/online and push an event batch"""
+    base = f'http://127.0.0.1:{TRACKER_PORT}/api/downtime'
+    while time.monotonic() < deadline:
+        await recorder.request(session, 'POST /api/downtime/trigger-offline', 'POST',
+                               f'{base}/trigger-offline?source=benchmark')
+        await recorder.request(session, 'POST /api/downtime/trigger-online', 'POST', f'{base}/trigger-online')
+        now = datetime.now(timezone.utc)
+        events = [
+            {'id': uuid.uuid4().hex, 'type': 'offline' if i % 2 == 0 else 'online',
+             'timestamp': now.isoformat(), 'source': 'benchmark'}
+            for i in range(batch_size)
+        ]
+        await recorder.request(session, 'POST /api/downtime/events', 'POST', f'{base}/events',
+                               json={'events': events})
+        if think:
+            await asyncio.sleep(think)
+
+
+async def scrape_db_phase(session, port, namespace):
+    """(count, sum, cumulative bucket counts) of the 'db' phase histogram"""
+    async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+        text = await response.text()
+    prefix = f'{namespace}_phase_duration_seconds'
+    buckets, count, total = {}, 0, 0.0
+    for line in text.splitlines():
+        if 'phase="db"' not in line:
+            continue
+        value = float(line.rsplit(' ', 1)[1])
+        if line.startswith(f'{prefix}_bucket'):
+            buckets[re.search(r'le="([^"]+)"', line).group(1)] = value
+        elif line.startswith(f'{prefix}_count'):
+            count = value
+        elif line.startswith(f'{prefix}_sum'):
+            total = value
+    return count, total, buckets
+
+
+def db_phase_delta(before, after):
+    """Mean and histogram-estimated p95 of the 'db' phase during the run"""
+    count = after[0] - before[0]
+    if count <= 0:
+        return {'count': 0, 'mean_ms': None, 'p95_ms': None}
+    p95 = None
+    for le, cumulative in after[2].items():
+        if cumulative - before[2].get(le, 0) >= 0.95 * count:
+            bound = float('inf') if le == '+Inf' else float(le)
+            p95 = bound if p95 is None else min(p95, bound)
+    return {
+        'count': int(count),
+        'mean_ms': round((after[1] - before[1]) / count * 1000, 3),
+        # Upper bound of the bucket holding the 95th percentile
+        'p95_ms': None if p95 in (None, float('inf')) else p95 * 1000
+    }
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = sorted(recorder.latencies.get(name, []))
+        summary = {
+            'requests': len(latencies),
+            'errors': recorder.errors.get(name, 0),
+            'statuses': recorder.statuses.get(name, {}),
+            'throughput_rps': round(len(latencies) / elapsed, 1)
+        }
+        if latencies:
+            summary['latency_ms'] = {
+                'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+                'p50': round(percentile(latencies, 0.50) * 1000, 3),
+                'p95': round(percentile(latencies, 0.95) * 1000, 3),
+                'p99': round(percentile(latencies, 0.99) * 1000, 3),
+                'max': round(latencies[-1] * 1000, 3)
+            }
+        endpoints[name] = summary
+    return endpoints
+
+
+async def run_load(args):
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        await wait_ready(session, [
+            f'http://127.0.0.1:{STATS_PORT}/api/homeserver/health',
+            f'http://127.0.0.1:{TRACKER_PORT}/health'
+        ])
+        await session.post(f'http://127.0.0.1:{TRACKER_PORT}/api/downtime/reset')
+        before = {
+            'homeserver': await scrape_db_phase(session, STATS_PORT, 'homeserver'),
+            'downtime_tracker': await scrape_db_phase(session, TRACKER_PORT, 'downtime_tracker')
+        }
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        tasks = []
+        if args.scenario in ('polling', 'mixed'):
+            tasks += [polling_tab(session, recorder, deadline, args.think) for _ in range(args.clients)]
+        if args.scenario in ('burst', 'mixed'):
+            tasks += [monitor(session, recorder, deadline, args.burst_think, args.batch_size)
+                      for _ in range(args.monitors)]
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+        db = {'lock_errors': recorder.lock_errors}
+        for namespace, port in (('homeserver', STATS_PORT), ('downtime_tracker', TRACKER_PORT)):
+            db[f'{namespace}_db_phase'] = db_phase_delta(
+                before[namespace], await scrape_db_phase(session, port, namespace)
+            )
+    return summarize(recorder, elapsed), db, elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix='homeserver-bench-') as workdir:
+        processes = start_servers(args.server, workdir)
+        try:
+            endpoints, db, elapsed = asyncio.run(run_load(args))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'recorded_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server': args.server,
+            'scenario': args.scenario,
+            'clients': args.clients,
+            'monitors': args.monitors,
+            'duration_seconds': round(elapsed, 2)
+        },
+        'endpoints': endpoints,
+        'db': db
+    }
+    print_result(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def print_result(result):
+    meta = result['meta']
+    print(f"{meta['scenario']} / {meta['server']} @ {meta['commit'] or 'unknown'}: "
+          f"{meta['clients']} tabs, {meta['monitors']} monitors, {meta['duration_seconds']}s")
+    print(f"  {'endpoint':<36} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, summary in result['endpoints'].items():
+        latency = summary.get('latency_ms', {})
+        print(f"  {name:<36} {summary['throughput_rps']:>9.1f} {latency.get('p50', 0):>9.2f} "
+              f"{latency.get('p95', 0):>9.2f} {latency.get('p99', 0):>9.2f} {summary['errors']:>7}")
+    db = result['db']
+    print(f"  lock errors: {db['lock_errors']}")
+    for key in ('homeserver_db_phase', 'downtime_tracker_db_phase'):
+        phase = db.get(key) or {}
+        print(f"  {key}: {phase.get('count', 0)} calls, mean {phase.get('mean_ms')} ms, p95 <= {phase.get('p95_ms')} ms")
+
+
+# ====== COMPARE ======
+def compare(args):
+    """Print per-endpoint changes; exit 1 if anything regressed beyond --threshold percent"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
+
+    regressions = []
+    print(f"{baseline['meta'].get('commit')} -> {candidate['meta'].get('commit')}")
+    print(f"  {'endpoint':<36} {'req/s':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name in sorted(set(baseline['endpoints']) & set(candidate['endpoints'])):
+        old, new = baseline['endpoints'][name], candidate['endpoints'][name]
+        rps = change(old['throughput_rps'], new['throughput_rps'])
+        deltas = {
+            key: change(old.get('latency_ms', {}).get(key, 0), new.get('latency_ms', {}).get(key, 0))
+            for key in ('p50', 'p95', 'p99')
+        }
+        print(f"  {name:<36} {rps:>+8.1f}% {deltas['p50']:>+7.1f}% {deltas['p95']:>+7.1f}% {deltas['p99']:>+7.1f}%")
+        if rps < -args.threshold:
+            regressions.append(f'{name}: throughput {rps:+.1f}%')
+        if deltas['p95'] > args.threshold:
+            regressions.append(f'{name}: p95 latency {deltas["p95"]:+.1f}%')
+        if new['errors'] > old['errors']:
+            regressions.append(f"{name}: errors {old['errors']} -> {new['errors']}")
+
+    old_locks, new_locks = baseline['db']['lock_errors'], candidate['db']['lock_errors']
+    if new_locks > old_locks:
+        regressions.append(f'lock errors {old_locks} -> {new_locks}')
+
+    if regressions:
+        print('Regressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('No regressions beyond the threshold')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='start both services and drive a load')
+    run_parser.add_argument('--scenario', choices=('polling', 'burst', 'mixed'), default='mixed')
+    run_parser.add_argument('--server', choices=('wsgi', 'async'), default='wsgi',
+                            help='Flask apps on a threaded server, or the aiohttp entry points')
+    run_parser.add_argument('--clients', type=int, default=50, help='concurrent dashboard tabs')
+    run_parser.add_argument('--think', type=float, default=0.0,
+                            help='seconds each tab waits between polls (0 = as fast as possible)')
+    run_parser.add_argument('--monitors', type=int, default=5, help='concurrent monitors in a burst')
+    run_parser.add_argument('--burst-think', type=float, default=0.0,
+                            help='seconds each monitor waits between bursts')
+    run_parser.add_argument('--batch-size', type=int, default=10, help='events per /events request')
+    run_parser.add_argument('--duration', type=float, default=15.0, help='seconds of load')
+    run_parser.add_argument('-o', '--output', help='write results as JSON to this file')
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='allowed regression in percent (default 10)')
+
+    serve_parser = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('service', choices=('stats', 'tracker'))
+    serve_parser.add_argument('--server', choices=('wsgi', 'async'), default='wsgi')
+    serve_parser.add_argument('--port', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    else:
+        serve(args.service, args.server, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Streaming bulk export and batched import, shared by the stats API and the
+downtime tracker (client side: trigger_downtime.py export/import).
+
+Exports are generators: the service reads its history in keyset-paginated
+batches of EXPORT_BATCH rows and encodes each batch into one chunk, so a
+response of any length is sent with chunked transfer encoding in constant
+memory. Every record names its table, so an NDJSON export can mix tables
+and a CSV export is self-describing:
+
+    {"table": "outage", "start": "...", "end": "...", ...}
+
+Imports are the reverse in bounded pieces: the client groups exported
+records into POSTs of {"records": [...]} and the service applies each
+batch in one transaction, skipping records it already has, so an
+interrupted import can simply be run again. Importing rewrites history, so
+it is disabled until the service has an IMPORT_TOKEN, and every batch must
+carry it as `Authorization: Bearer <token>`.
+"""
+
+import csv
+import hmac
+import io
+import json
+import os
+
+# Rows read from the database per export chunk
+EXPORT_BATCH = int(os.environ.get('EXPORT_BATCH', '1000'))
+# Bearer token the import endpoints require; unset disables them
+IMPORT_TOKEN = os.environ.get('IMPORT_TOKEN')
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def parse_export_format(value):
+    fmt = (value or 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def encode_batches(batches, fmt, fields):
+    """
+    Encode an iterable of record batches (lists of dicts) into one bytes
+    chunk per batch. CSV gets a header first and uses `fields` as columns.
+    """
+    if fmt == 'csv':
+        yield _csv_rows([fields])
+        for batch in batches:
+            yield _csv_rows([record.get(field) for field in fields] for record in batch)
+    else:
+        for batch in batches:
+            yield ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in batch).encode('utf-8')
+
+
+def _csv_rows(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def export_filename(service, fmt):
+    return f'{service}-export.{fmt}'
+
+
+def import_rejection(authorization):
+    """None if an import with this Authorization header may proceed, else (error message, HTTP status)"""
+    if not IMPORT_TOKEN:
+        return 'import is disabled (set IMPORT_TOKEN)', 404
+    if not hmac.compare_digest(authorization or '', f'Bearer {IMPORT_TOKEN}'):
+        return 'invalid or missing import token', 401
+    return None
+
+
+def parse_import_records(body, max_records):
+    """The records of an import batch; raises ValueError if malformed"""
+    records = body.get('records') if isinstance(body, dict) else None
+    if not isinstance(records, list) or not records:
+        raise ValueError('records must be a non-empty list')
+    if len(records) > max_records:
+        raise ValueError(f'at most {max_records} records per batch')
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError('every record must be an object')
+    return records
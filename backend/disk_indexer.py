@@ -0,0 +1,252 @@
+"""
+Incremental per-directory disk usage index for /api/homeserver/disk/top.
+
+A `du` over a multi-terabyte volume stats every file on every run. This
+index keeps one record per directory instead: its mtime, the bytes and
+file count directly inside it, and its subdirectories. Creating, removing
+or renaming an entry changes the mtime of the directory holding it, so a
+refresh pass stats only directories, and lists (and stats the files of)
+just those whose mtime moved. Subtree totals are then re-summed from the
+records in memory.
+
+A file growing in place (a log, a database) leaves its directory's mtime
+alone, so every full_rescan_interval a pass re-lists everything. Sizes are
+allocated blocks, as `du` reports them. Symlinks are not followed, and
+filesystems mounted below a root are skipped, as with `du -x`. A file
+with several hard links is counted under each of its names.
+
+The records are saved as JSON after every pass that changed them, so a
+restart resumes incrementally rather than with a full walk. Other worker
+processes load the saved index instead of walking the disk themselves.
+Requests only slice lists sorted when the pass finished.
+"""
+
+import heapq
+import json
+import os
+import time
+from collections import namedtuple
+
+# Rows per sort key that top() can ever return
+MAX_TOP = 100
+
+# Sort keys accepted by top(): bytes in the whole subtree, or in the files directly inside
+SORT_KEYS = ('total', 'own')
+
+INDEX_FORMAT = 1
+# A directory changed this close to the start of a pass may change again within
+# the same mtime tick unseen, so it is listed again on the next pass too (ns)
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+# Per directory: (mtime_ns, own_bytes, own_files, subdirectory names)
+# Per index: records in walk order (parents before children) plus what requests read
+IndexView = namedtuple('IndexView', 'dirs totals sorted roots')
+
+
+def _allocated_bytes(st):
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def _row(dirs, totals, path):
+    total_bytes, total_files, total_dirs = totals[path]
+    return {
+        'path': path,
+        'total_bytes': total_bytes,
+        'own_bytes': dirs[path][1],
+        'files': total_files,
+        'directories': total_dirs
+    }
+
+
+def _is_under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class DiskIndex:
+    """Per-directory size tree for a set of roots, refreshed incrementally"""
+
+    def __init__(self, roots, path, full_rescan_interval=86400.0):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.path = path
+        self.full_rescan_interval = full_rescan_interval
+        self.refreshed_at = None  # Unix time the latest pass finished
+        self.last_pass = None  # What the latest pass of this process did
+        self._view = IndexView({}, {}, {}, [])
+        self._last_full_scan = 0.0
+        self._saved_mtime = None  # mtime_ns of the index file we last wrote or loaded
+
+    def __len__(self):
+        return len(self._view.dirs)
+
+    # ---- indexing ----
+    def refresh(self, now=None):
+        """Run one pass over every root; returns the pass summary"""
+        now = now or time.time()
+        started = time.monotonic()
+        full = now - self._last_full_scan >= self.full_rescan_interval
+        previous = self._view.dirs
+        dirs = {}
+        counts = {'visited': 0, 'listed': 0, 'errors': 0}
+        racy_after = time.time_ns() - RACY_WINDOW_NS
+        for root in self.roots:
+            self._walk(root, previous, dirs, full, racy_after, counts)
+
+        changed = full or counts['listed'] or dirs.keys() != previous.keys()
+        self._install(dirs)
+        self.refreshed_at = time.time()
+        if full:
+            self._last_full_scan = now
+        self.last_pass = {
+            'full': full,
+            'directories': counts['visited'],
+            'rescanned': counts['listed'],
+            'errors': counts['errors'],
+            'duration_seconds': round(time.monotonic() - started, 3)
+        }
+        if changed:
+            self.save()
+        return self.last_pass
+
+    def _walk(self, root, previous, dirs, full, racy_after, counts):
+        """Add the records under `root` to `dirs` in pre-order, re-listing only changed directories"""
+        try:
+            root_dev = os.lstat(root).st_dev
+        except OSError:
+            counts['errors'] += 1
+            return
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue  # Removed since its parent was listed
+            counts['visited'] += 1
+            record = previous.get(path)
+            if full or record is None or record[0] != st.st_mtime_ns:
+                record = self._list(path, st, root_dev, counts)
+            if st.st_mtime_ns >= racy_after:
+                record = (0, *record[1:])
+            dirs[path] = record
+            stack.extend(os.path.join(path, name) for name in reversed(record[3]))
+
+    @staticmethod
+    def _list(path, st, root_dev, counts):
+        """Fresh record for one directory: stat its files, note its subdirectories"""
+        counts['listed'] += 1
+        own_bytes = _allocated_bytes(st)  # The directory itself, as du counts it
+        own_files = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.stat(follow_symlinks=False).st_dev == root_dev:
+                                subdirs.append(entry.name)
+                        else:
+                            own_bytes += _allocated_bytes(entry.stat(follow_symlinks=False))
+                            own_files += 1
+                    except OSError:
+                        continue  # Vanished mid-listing
+        except OSError:
+            counts['errors'] += 1  # Unreadable: counted as empty
+        return st.st_mtime_ns, own_bytes, own_files, tuple(sorted(subdirs))
+
+    def _install(self, dirs):
+        """Sum subtree totals, pre-sort the top lists and swap in the new view"""
+        totals = {}
+        # Pre-order reversed visits every child before its parent
+        for path in reversed(dirs):
+            _, own_bytes, own_files, subdirs = dirs[path]
+            total_bytes, total_files, total_dirs = own_bytes, own_files, 0
+            for name in subdirs:
+                child = totals.get(os.path.join(path, name))
+                if child is not None:
+                    total_bytes += child[0]
+                    total_files += child[1]
+                    total_dirs += child[2] + 1
+            totals[path] = (total_bytes, total_files, total_dirs)
+
+        ranked = {
+            'total': heapq.nlargest(MAX_TOP, totals, key=lambda path: totals[path][0]),
+            'own': heapq.nlargest(MAX_TOP, totals, key=lambda path: dirs[path][1])
+        }
+        # Swap in complete results so readers never see a half-built index
+        self._view = IndexView(
+            dirs,
+            totals,
+            {key: [_row(dirs, totals, path) for path in paths] for key, paths in ranked.items()},
+            [_row(dirs, totals, root) for root in self.roots if root in totals]
+        )
+
+    # ---- persistence ----
+    def save(self):
+        """Write the records atomically, so a reader never loads half an index"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': INDEX_FORMAT,
+                'refreshed_at': self.refreshed_at,
+                'last_full_scan': self._last_full_scan,
+                'dirs': self._view.dirs
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self._saved_mtime = os.stat(self.path).st_mtime_ns
+
+    def load(self):
+        """Adopt the saved index (records under the configured roots); returns True if loaded"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(saved, dict) or saved.get('format') != INDEX_FORMAT:
+            return False
+        self._install({
+            path: (mtime_ns, own_bytes, own_files, tuple(subdirs))
+            for path, (mtime_ns, own_bytes, own_files, subdirs) in saved['dirs'].items()
+            if any(_is_under(path, root) for root in self.roots)
+        })
+        self.refreshed_at = saved.get('refreshed_at')
+        self._last_full_scan = saved.get('last_full_scan') or 0.0
+        self._saved_mtime = mtime
+        return True
+
+    def reload_if_changed(self):
+        """Load the saved index if another process has written a newer one"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        return mtime != self._saved_mtime and self.load()
+
+    # ---- queries ----
+    def top(self, n=10, sort='total', path=None):
+        """
+        The n largest directories by `sort` (one of SORT_KEYS) across all
+        roots, or the n largest subdirectories of `path`.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+        n = min(n, MAX_TOP)
+        view = self._view
+        if path is None:
+            return view.sorted.get(sort, [])[:n]
+        path = os.path.abspath(path)
+        record = view.dirs.get(path)
+        if record is None:
+            raise KeyError(path)
+        children = [os.path.join(path, name) for name in record[3]]
+        children = [child for child in children if child in view.totals]
+        if sort == 'total':
+            largest = heapq.nlargest(n, children, key=lambda child: view.totals[child][0])
+        else:
+            largest = heapq.nlargest(n, children, key=lambda child: view.dirs[child][1])
+        return [_row(view.dirs, view.totals, child) for child in largest]
+
+    def summary(self):
+        """Per-root totals"""
+        return self._view.roots
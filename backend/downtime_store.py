@@ -0,0 +1,607 @@
+"""
+Durable state backends for the downtime tracker.
+
+Every gunicorn worker (and every restart) sees the same state because it
+lives outside the process: in a local SQLite database in WAL mode by
+default, or in Redis when DOWNTIME_STORE=redis. Each transition is a
+single atomic read-modify-write, so concurrent triggers from several
+workers can't lose updates.
+
+Closed outages are appended to an event log, and per-day downtime/count
+aggregates are updated in the same transaction, so availability over a
+window is a sum over a few day rows rather than a scan of the log.
+
+apply_events() ingests a batch of timestamped offline/online events from
+the monitor's outbox. Each event carries an idempotency key; keys that
+were already processed are skipped, so retried batches are harmless.
+
+iter_outages() and import_outages() move the outage log between
+instances: the first pages through it oldest first, the second adds
+completed outages (skipping any already logged) to the log, the daily
+rollup and the running totals without touching the offline/online state.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SECONDS_PER_DAY = 86400
+# How long processed idempotency keys are remembered
+PROCESSED_EVENT_RETENTION = 30 * SECONDS_PER_DAY
+# An imported outage matches a logged one whose start and end are this close (seconds)
+IMPORT_MATCH_TOLERANCE = 0.001
+
+# Shape of the tracker state, with its initial values
+DEFAULT_STATE = {
+    'is_offline': False,
+    'offline_since': None,  # ISO timestamp when server went offline
+    'total_downtime_seconds': 0.0,  # Accumulated downtime
+    # Last outage information
+    'last_outage_start': None,  # ISO timestamp when last outage started
+    'last_outage_end': None,    # ISO timestamp when last outage ended
+    'last_outage_duration_seconds': 0.0,  # Duration of last completed outage
+    'outage_source': None,  # Who reported the running outage
+    'version': 0  # Incremented on every transition
+}
+
+
+def split_by_day(start_ts, end_ts):
+    """Yield (day_number, seconds) for each UTC day an interval overlaps"""
+    while start_ts < end_ts:
+        day = int(start_ts // SECONDS_PER_DAY)
+        day_end = min((day + 1) * SECONDS_PER_DAY, end_ts)
+        yield day, day_end - start_ts
+        start_ts = day_end
+
+
+def _apply_offline(state, at, source=None):
+    """Start an outage at `at` unless one is already running"""
+    if state['is_offline']:
+        return False
+    state['is_offline'] = True
+    state['offline_since'] = at.isoformat()
+    state['outage_source'] = source
+    state['version'] += 1
+    return True
+
+
+def _apply_online(state, at):
+    """Close the running outage at `at`; returns the outage or None"""
+    if not (state['is_offline'] and state['offline_since']):
+        return None
+    started = datetime.fromisoformat(state['offline_since'])
+    # Never record negative durations if clocks disagree
+    duration = max((at - started).total_seconds(), 0.0)
+    outage = {
+        'start': state['offline_since'],
+        'end': at.isoformat(),
+        'duration_seconds': duration,
+        'start_ts': started.timestamp(),
+        'end_ts': started.timestamp() + duration,
+        'source': state['outage_source']
+    }
+    state['total_downtime_seconds'] += duration
+    state['last_outage_start'] = outage['start']
+    state['last_outage_end'] = outage['end']
+    state['last_outage_duration_seconds'] = duration
+    state['is_offline'] = False
+    state['offline_since'] = None
+    state['outage_source'] = None
+    state['version'] += 1
+    return outage
+
+
+def _apply_event(state, event):
+    """
+    Apply one ingested event at its original timestamp.
+    Returns (result, outage) where result is 'applied' or 'noop'.
+    """
+    at = event['at']
+    if event['type'] == 'offline':
+        if _apply_offline(state, at, event.get('source')):
+            return 'applied', None
+        # Already offline, but this report is older: the outage started earlier
+        if state['offline_since'] and at < datetime.fromisoformat(state['offline_since']):
+            state['offline_since'] = at.isoformat()
+            state['version'] += 1
+            return 'applied', None
+        return 'noop', None
+    outage = _apply_online(state, at)
+    return ('applied' if outage else 'noop'), outage
+
+
+def _apply_imported_outage(state, outage):
+    """Count an imported outage in the totals; it becomes the last outage if it ended later"""
+    state['total_downtime_seconds'] += outage['duration_seconds']
+    last_end = state['last_outage_end']
+    if not last_end or outage['end_ts'] > datetime.fromisoformat(last_end).timestamp():
+        state['last_outage_start'] = outage['start']
+        state['last_outage_end'] = outage['end']
+        state['last_outage_duration_seconds'] = outage['duration_seconds']
+
+
+def _outage_row(start_ts, end_ts, duration_seconds, source):
+    return {'start_ts': start_ts, 'end_ts': end_ts, 'duration_seconds': duration_seconds, 'source': source}
+
+
+def _apply_reset(state):
+    version = state['version']
+    state.clear()
+    state.update(DEFAULT_STATE, version=version + 1)
+
+
+class SQLiteDowntimeStore:
+    """Tracker state in a single-row SQLite table (WAL mode)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS downtime_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                is_offline INTEGER NOT NULL DEFAULT 0,
+                offline_since TEXT,
+                total_downtime_seconds REAL NOT NULL DEFAULT 0.0,
+                last_outage_start TEXT,
+                last_outage_end TEXT,
+                last_outage_duration_seconds REAL NOT NULL DEFAULT 0.0,
+                outage_source TEXT,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(downtime_state)')]
+        if 'outage_source' not in columns:
+            conn.execute('ALTER TABLE downtime_state ADD COLUMN outage_source TEXT')
+        conn.execute('INSERT OR IGNORE INTO downtime_state (id) VALUES (1)')
+
+        # Every completed outage, indexed by start time
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outage_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_ts REAL NOT NULL,
+                end_ts REAL NOT NULL,
+                duration_seconds REAL NOT NULL,
+                source TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outage_events_start ON outage_events (start_ts)')
+        # Incrementally maintained per-UTC-day rollup of the event log
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outage_daily (
+                day INTEGER PRIMARY KEY,
+                downtime_seconds REAL NOT NULL DEFAULT 0.0,
+                outage_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Idempotency keys of ingested events
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS processed_events (
+                id TEXT PRIMARY KEY,
+                processed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_events_at ON processed_events (processed_at)')
+
+    def _connect(self):
+        """One connection per thread, re-opened after fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        # isolation_level=None: we issue BEGIN IMMEDIATE ourselves
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row_to_state(row):
+        state = dict(row)
+        state.pop('id', None)
+        state['is_offline'] = bool(state['is_offline'])
+        return state
+
+    def get_state(self):
+        row = self._connect().execute('SELECT * FROM downtime_state WHERE id = 1').fetchone()
+        return self._row_to_state(row)
+
+    @staticmethod
+    def _write_state(conn, state):
+        conn.execute('''
+            UPDATE downtime_state SET
+                is_offline = :is_offline,
+                offline_since = :offline_since,
+                total_downtime_seconds = :total_downtime_seconds,
+                last_outage_start = :last_outage_start,
+                last_outage_end = :last_outage_end,
+                last_outage_duration_seconds = :last_outage_duration_seconds,
+                outage_source = :outage_source,
+                version = :version
+            WHERE id = 1
+        ''', state)
+
+    def _transition(self, apply):
+        """Run apply(state) inside a write transaction and persist the result"""
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so two workers can't both
+        # read "online" and both start an outage
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = self._row_to_state(
+                conn.execute('SELECT * FROM downtime_state WHERE id = 1').fetchone()
+            )
+            before = state['version']
+            result = apply(state)
+            if state['version'] != before:
+                self._write_state(conn, state)
+            if isinstance(result, dict):
+                self._record_outage(conn, result)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result, state
+
+    def apply_events(self, events, now):
+        """
+        Apply a batch of events in timestamp order inside one transaction.
+        Returns ({event_id: 'applied' | 'noop' | 'duplicate'}, state).
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = self._row_to_state(
+                conn.execute('SELECT * FROM downtime_state WHERE id = 1').fetchone()
+            )
+            before = state['version']
+            results = {}
+            for event in sorted(events, key=lambda e: e['at']):
+                if event['id'] in results:
+                    continue  # Repeated within this batch; keep the first outcome
+                seen = conn.execute('SELECT 1 FROM processed_events WHERE id = ?', (event['id'],)).fetchone()
+                if seen:
+                    results[event['id']] = 'duplicate'
+                    continue
+                results[event['id']], outage = _apply_event(state, event)
+                if outage:
+                    self._record_outage(conn, outage)
+                conn.execute(
+                    'INSERT INTO processed_events (id, processed_at) VALUES (?, ?)',
+                    (event['id'], now.timestamp())
+                )
+            if state['version'] != before:
+                self._write_state(conn, state)
+            conn.execute(
+                'DELETE FROM processed_events WHERE processed_at < ?',
+                (now.timestamp() - PROCESSED_EVENT_RETENTION,)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return results, state
+
+    @staticmethod
+    def _record_outage(conn, outage):
+        """Append the outage to the log and fold it into the daily rollup"""
+        conn.execute(
+            'INSERT INTO outage_events (start_ts, end_ts, duration_seconds, source) VALUES (?, ?, ?, ?)',
+            (outage['start_ts'], outage['end_ts'], outage['duration_seconds'], outage['source'])
+        )
+        for day, seconds in split_by_day(outage['start_ts'], outage['end_ts']):
+            conn.execute('''
+                INSERT INTO outage_daily (day, downtime_seconds) VALUES (?, ?)
+                ON CONFLICT (day) DO UPDATE SET downtime_seconds = downtime_seconds + excluded.downtime_seconds
+            ''', (day, seconds))
+        # Outages are counted on the day they ended
+        end_day = int(outage['end_ts'] // SECONDS_PER_DAY)
+        conn.execute('''
+            INSERT INTO outage_daily (day, outage_count) VALUES (?, 1)
+            ON CONFLICT (day) DO UPDATE SET outage_count = outage_count + 1
+        ''', (end_day,))
+
+    def iter_outages(self, batch_size=1000):
+        """Yield the outage log, oldest first, in lists of up to batch_size outages"""
+        last = (float('-inf'), 0)
+        while True:
+            # Keyset pagination: each page is an index range scan, however deep.
+            # Connect per page: a streaming response may resume on another thread
+            rows = self._connect().execute(
+                '''SELECT id, start_ts, end_ts, duration_seconds, source FROM outage_events
+                   WHERE (start_ts, id) > (?, ?) ORDER BY start_ts, id LIMIT ?''',
+                (*last, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield [_outage_row(row['start_ts'], row['end_ts'], row['duration_seconds'], row['source'])
+                   for row in rows]
+            last = (rows[-1]['start_ts'], rows[-1]['id'])
+
+    def import_outages(self, outages):
+        """
+        Add completed outages to the log in one transaction, skipping ones
+        already logged. Returns (imported_count, state).
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = self._row_to_state(
+                conn.execute('SELECT * FROM downtime_state WHERE id = 1').fetchone()
+            )
+            imported = 0
+            for outage in outages:
+                seen = conn.execute(
+                    '''SELECT 1 FROM outage_events
+                       WHERE start_ts BETWEEN ? AND ? AND ABS(end_ts - ?) <= ?''',
+                    (outage['start_ts'] - IMPORT_MATCH_TOLERANCE, outage['start_ts'] + IMPORT_MATCH_TOLERANCE,
+                     outage['end_ts'], IMPORT_MATCH_TOLERANCE)
+                ).fetchone()
+                if seen:
+                    continue
+                self._record_outage(conn, outage)
+                _apply_imported_outage(state, outage)
+                imported += 1
+            if imported:
+                state['version'] += 1
+                self._write_state(conn, state)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return imported, state
+
+    def mark_offline(self, at, source=None):
+        return self._transition(lambda state: _apply_offline(state, at, source))
+
+    def mark_online(self, at):
+        return self._transition(lambda state: _apply_online(state, at))
+
+    def reset(self):
+        """Reset the state and clear the outage history and processed event ids, in one transaction"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = self._row_to_state(
+                conn.execute('SELECT * FROM downtime_state WHERE id = 1').fetchone()
+            )
+            _apply_reset(state)
+            self._write_state(conn, state)
+            conn.execute('DELETE FROM outage_events')
+            conn.execute('DELETE FROM outage_daily')
+            conn.execute('DELETE FROM processed_events')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return state
+
+    def daily_totals(self, first_day, last_day):
+        """Sum the daily rollup over [first_day, last_day]; returns (downtime_seconds, outage_count)"""
+        row = self._connect().execute(
+            '''SELECT COALESCE(SUM(downtime_seconds), 0.0), COALESCE(SUM(outage_count), 0)
+               FROM outage_daily WHERE day BETWEEN ? AND ?''',
+            (first_day, last_day)
+        ).fetchone()
+        return row[0], row[1]
+
+
+class RedisDowntimeStore:
+    """
+    Tracker state in a Redis hash, updated with WATCH/MULTI transactions.
+    Works with any redis-py compatible client (including fakeredis).
+    Keys: <prefix>:state (hash), <prefix>:events (sorted set by start time),
+    <prefix>:daily_seconds and <prefix>:daily_count (hashes keyed by day),
+    <prefix>:processed (sorted set of ingested event ids).
+    """
+
+    def __init__(self, client, prefix='downtime'):
+        self.client = client
+        self.key = f'{prefix}:state'
+        self.events_key = f'{prefix}:events'
+        self.daily_seconds_key = f'{prefix}:daily_seconds'
+        self.daily_count_key = f'{prefix}:daily_count'
+        self.processed_key = f'{prefix}:processed'  # Sorted set of idempotency keys by time
+
+    @staticmethod
+    def _decode(raw):
+        raw = {
+            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in raw.items()
+        }
+        state = dict(DEFAULT_STATE)
+        for field, default in DEFAULT_STATE.items():
+            value = raw.get(field)
+            # Unset optional fields are stored as ''
+            if value is None or value == '':
+                continue
+            if isinstance(default, bool):
+                state[field] = value == '1'
+            elif isinstance(default, int):
+                state[field] = int(value)
+            elif isinstance(default, float):
+                state[field] = float(value)
+            else:
+                state[field] = value
+        return state
+
+    @staticmethod
+    def _encode(state):
+        encoded = {}
+        for field, value in state.items():
+            if isinstance(value, bool):
+                encoded[field] = '1' if value else '0'
+            elif value is None:
+                encoded[field] = ''
+            else:
+                encoded[field] = str(value)
+        return encoded
+
+    def get_state(self):
+        return self._decode(self.client.hgetall(self.key))
+
+    def _transition(self, apply):
+        outcome = {}
+
+        def run(pipe):
+            state = self._decode(pipe.hgetall(self.key))
+            before = state['version']
+            outcome['result'] = apply(state)
+            outcome['state'] = state
+            pipe.multi()
+            if state['version'] != before:
+                pipe.hset(self.key, mapping=self._encode(state))
+            if isinstance(outcome['result'], dict):
+                self._record_outage(pipe, outcome['result'], state['version'])
+
+        # Retries automatically if another worker touched the key meanwhile
+        self.client.transaction(run, self.key)
+        return outcome['result'], outcome['state']
+
+    def _record_outage(self, pipe, outage, event_id):
+        """Queue the event-log and daily-rollup writes inside the transaction"""
+        # The state version is unique per transition, so it doubles as the event id
+        event = {
+            'id': event_id,
+            'start_ts': outage['start_ts'],
+            'end_ts': outage['end_ts'],
+            'duration_seconds': outage['duration_seconds'],
+            'source': outage['source']
+        }
+        pipe.zadd(self.events_key, {json.dumps(event, sort_keys=True): outage['start_ts']})
+        for day, seconds in split_by_day(outage['start_ts'], outage['end_ts']):
+            pipe.hincrbyfloat(self.daily_seconds_key, day, seconds)
+        pipe.hincrby(self.daily_count_key, int(outage['end_ts'] // SECONDS_PER_DAY), 1)
+
+    def apply_events(self, events, now):
+        """
+        Apply a batch of events in timestamp order inside one transaction.
+        Returns ({event_id: 'applied' | 'noop' | 'duplicate'}, state).
+        """
+        outcome = {}
+
+        def run(pipe):
+            state = self._decode(pipe.hgetall(self.key))
+            before = state['version']
+            results = {}
+            outages = []
+            for event in sorted(events, key=lambda e: e['at']):
+                if event['id'] in results:
+                    continue  # Repeated within this batch; keep the first outcome
+                if pipe.zscore(self.processed_key, event['id']) is not None:
+                    results[event['id']] = 'duplicate'
+                    continue
+                results[event['id']], outage = _apply_event(state, event)
+                if outage:
+                    outages.append((outage, state['version']))
+            outcome['results'], outcome['state'] = results, state
+
+            pipe.multi()
+            if state['version'] != before:
+                pipe.hset(self.key, mapping=self._encode(state))
+            for outage, event_id in outages:
+                self._record_outage(pipe, outage, event_id)
+            fresh = [event_id for event_id, result in results.items() if result != 'duplicate']
+            if fresh:
+                pipe.zadd(self.processed_key, {event_id: now.timestamp() for event_id in fresh})
+            pipe.zremrangebyscore(self.processed_key, 0, now.timestamp() - PROCESSED_EVENT_RETENTION)
+
+        self.client.transaction(run, self.key, self.processed_key)
+        return outcome['results'], outcome['state']
+
+    def iter_outages(self, batch_size=1000):
+        """Yield the outage log, oldest first, in lists of up to batch_size outages"""
+        offset = 0
+        while True:
+            members = self.client.zrange(self.events_key, offset, offset + batch_size - 1)
+            if not members:
+                return
+            events = [json.loads(member) for member in members]
+            yield [_outage_row(event['start_ts'], event['end_ts'], event['duration_seconds'], event['source'])
+                   for event in events]
+            offset += len(members)
+
+    def import_outages(self, outages):
+        """
+        Add completed outages to the log in one transaction, skipping ones
+        already logged. Returns (imported_count, state).
+        """
+        outcome = {}
+
+        def run(pipe):
+            state = self._decode(pipe.hgetall(self.key))
+            fresh = []
+            for outage in outages:
+                nearby = pipe.zrangebyscore(self.events_key, outage['start_ts'] - IMPORT_MATCH_TOLERANCE,
+                                            outage['start_ts'] + IMPORT_MATCH_TOLERANCE)
+                if any(abs(json.loads(member)['end_ts'] - outage['end_ts']) <= IMPORT_MATCH_TOLERANCE
+                       for member in nearby):
+                    continue
+                fresh.append(outage)
+                _apply_imported_outage(state, outage)
+            if fresh:
+                state['version'] += 1
+            outcome['imported'], outcome['state'] = len(fresh), state
+
+            pipe.multi()
+            if fresh:
+                pipe.hset(self.key, mapping=self._encode(state))
+            for index, outage in enumerate(fresh):
+                # Not a plain version, so it can't collide with a transition's event id
+                self._record_outage(pipe, outage, f"import-{state['version']}-{index}")
+
+        self.client.transaction(run, self.key, self.events_key)
+        return outcome['imported'], outcome['state']
+
+    def mark_offline(self, at, source=None):
+        return self._transition(lambda state: _apply_offline(state, at, source))
+
+    def mark_online(self, at):
+        return self._transition(lambda state: _apply_online(state, at))
+
+    def reset(self):
+        """Reset the state and clear the outage history and processed event ids, in one transaction"""
+        outcome = {}
+
+        def run(pipe):
+            state = self._decode(pipe.hgetall(self.key))
+            _apply_reset(state)
+            outcome['state'] = state
+            pipe.multi()
+            pipe.hset(self.key, mapping=self._encode(state))
+            pipe.delete(self.events_key, self.daily_seconds_key, self.daily_count_key, self.processed_key)
+
+        self.client.transaction(run, self.key)
+        return outcome['state']
+
+    def daily_totals(self, first_day, last_day):
+        """Sum the daily rollup over [first_day, last_day]; returns (downtime_seconds, outage_count)"""
+        days = list(range(first_day, last_day + 1))
+        seconds = self.client.hmget(self.daily_seconds_key, days)
+        counts = self.client.hmget(self.daily_count_key, days)
+        return (
+            sum(float(value) for value in seconds if value is not None),
+            sum(int(value) for value in counts if value is not None)
+        )
+
+
+def create_store():
+    """Build the backend selected by DOWNTIME_STORE (sqlite or redis)"""
+    backend = os.environ.get('DOWNTIME_STORE', 'sqlite').lower()
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('DOWNTIME_STORE=redis requires the redis package (pip install redis)')
+        client = redis.Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+        return RedisDowntimeStore(client, prefix=os.environ.get('REDIS_PREFIX', 'downtime'))
+    if backend != 'sqlite':
+        raise RuntimeError(f'Unknown DOWNTIME_STORE: {backend}')
+
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    path = os.environ.get('DOWNTIME_DB_PATH', os.path.join(basedir, 'downtime_tracker.db'))
+    return SQLiteDowntimeStore(path)
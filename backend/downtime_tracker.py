@@ -1,65 +1,409 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS, cross_origin
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import fcntl
+import math
 import os
+import threading
+import time
+
+from alerts import build_engine
+from bulk_export import (EXPORT_BATCH, EXPORT_FORMATS, encode_batches, export_filename, import_rejection,
+                         parse_export_format, parse_import_records)
+from downtime_store import IMPORT_MATCH_TOLERANCE, PROCESSED_EVENT_RETENTION, create_store
+from event_stream import EventBroadcaster
+from http_cache import ResponseCache, json_response
+from instrumentation import Instrumentation
+from overload import SingleFlight, TimeSliceCache, TokenBucketLimiter
 
 app = Flask(__name__)
 
+# How often /api/downtime/stream pushes a fresh status (seconds)
+STREAM_INTERVAL = float(os.environ.get('STREAM_INTERVAL', '1.0'))
+# Per-client buffer for the stream; clients this far behind are dropped
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '8'))
+# Longest window /api/downtime/availability will answer for (days)
+AVAILABILITY_MAX_DAYS = int(os.environ.get('AVAILABILITY_MAX_DAYS', '3650'))
+# Cache-Control max-age for /api/downtime/status (seconds)
+STATUS_MAX_AGE = int(os.environ.get('STATUS_MAX_AGE', '1'))
+# Largest batch accepted by /api/downtime/events
+MAX_INGEST_BATCH = int(os.environ.get('MAX_INGEST_BATCH', '500'))
+# Oldest event /api/downtime/events will apply (seconds); never beyond how long event ids are
+# remembered, so a replayed id can't be applied twice
+MAX_EVENT_AGE = min(float(os.environ.get('MAX_EVENT_AGE', str(7 * 86400))), PROCESSED_EVENT_RETENTION)
+# How often downtime alert rules are evaluated (seconds)
+ALERT_INTERVAL = float(os.environ.get('ALERT_INTERVAL', '15'))
+# Per-client token buckets: sustained requests per second and burst size, for reads and for POSTs
+READ_RATE_LIMIT = float(os.environ.get('READ_RATE_LIMIT', '10'))
+READ_RATE_BURST = int(os.environ.get('READ_RATE_BURST', '30'))
+WRITE_RATE_LIMIT = float(os.environ.get('WRITE_RATE_LIMIT', '0.5'))
+WRITE_RATE_BURST = int(os.environ.get('WRITE_RATE_BURST', '10'))
+# Clients tracked at once; the least recently seen are forgotten beyond this
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', '10000'))
+# Reverse proxies in front of the app (Render has one) whose X-Forwarded-For entry is trusted
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+# Status reads within one slice share a single store read (seconds; 0 disables)
+STATUS_COALESCE_SECONDS = float(os.environ.get('STATUS_COALESCE_SECONDS', '0.25'))
+
+# Prometheus metrics at /metrics (per-route latency, per-phase timings, downtime gauges)
+metrics = Instrumentation('downtime_tracker')
+metrics.instrument_app(app)
+
 # Don't enable CORS globally - we'll add it selectively
 # CORS(app)  # REMOVED
 
-# In-memory storage (for simple deployment)
-# For production, consider using Redis or a database
-downtime_tracker = {
-    'is_offline': False,
-    'offline_since': None,  # ISO timestamp when server went offline
-    'total_downtime_seconds': 0.0,  # Accumulated downtime
-    # Last outage information
-    'last_outage_start': None,  # ISO timestamp when last outage started
-    'last_outage_end': None,    # ISO timestamp when last outage ended
-    'last_outage_duration_seconds': 0.0  # Duration of last completed outage
-}
+# Shared, durable state (SQLite in WAL mode by default, Redis via DOWNTIME_STORE=redis)
+# so every worker sees the same outage and restarts don't wipe total downtime
+store = create_store()
 
 
-@app.route('/api/downtime/status', methods=['GET'])
-@cross_origin()  # Allow CORS only for this GET endpoint
-def get_downtime_status():
-    """
-    Get current downtime status.
-    Returns the current downtime in seconds if offline, or 0 if online.
-    Also includes last outage information when server is online.
-    """
+def build_status_payload(state=None):
+    """Build the /api/downtime/status payload from the tracker state"""
+    state = state or store.get_state()
+    
     # Build last outage info (available in both states)
     last_outage_info = {
-        'last_outage_start': downtime_tracker['last_outage_start'],
-        'last_outage_end': downtime_tracker['last_outage_end'],
-        'last_outage_duration_seconds': downtime_tracker['last_outage_duration_seconds']
+        'last_outage_start': state['last_outage_start'],
+        'last_outage_end': state['last_outage_end'],
+        'last_outage_duration_seconds': state['last_outage_duration_seconds']
     }
     
-    if downtime_tracker['is_offline'] and downtime_tracker['offline_since']:
+    if state['is_offline'] and state['offline_since']:
         # Calculate current downtime
-        offline_since = datetime.fromisoformat(downtime_tracker['offline_since'])
+        offline_since = datetime.fromisoformat(state['offline_since'])
         current_downtime = (datetime.now(timezone.utc) - offline_since).total_seconds()
-        total_downtime = downtime_tracker['total_downtime_seconds'] + current_downtime
+        total_downtime = state['total_downtime_seconds'] + current_downtime
         
-        return jsonify({
+        return {
             'is_offline': True,
             'current_downtime_seconds': current_downtime,
             'total_downtime_seconds': total_downtime,
-            'offline_since': downtime_tracker['offline_since'],
+            'offline_since': state['offline_since'],
             'timestamp': datetime.now(timezone.utc).isoformat(),
             **last_outage_info
-        })
+        }
     else:
-        return jsonify({
+        return {
             'is_offline': False,
             'current_downtime_seconds': 0,
-            'total_downtime_seconds': downtime_tracker['total_downtime_seconds'],
+            'total_downtime_seconds': state['total_downtime_seconds'],
             'offline_since': None,
             'timestamp': datetime.now(timezone.utc).isoformat(),
             **last_outage_info
-        })
+        }
+
+
+# Serialized status for the current state version, shared by /status and the stream
+status_cache = ResponseCache(timer=lambda: metrics.phase('serialize'))
+
+
+def _read_state():
+    with metrics.phase('db'):
+        return store.get_state()
+
+
+# Concurrent status reads within a slice share one store read; transitions
+# made by this process invalidate it, others show up within a slice
+status_state = TimeSliceCache(_read_state, STATUS_COALESCE_SECONDS)
+
+
+def get_status_body():
+    """
+    Serialized status payload and ETag, keyed by the state version and the
+    current second: the payload carries a response timestamp (and, while
+    offline, the running downtime), so requests within one second share a
+    single serialization.
+    """
+    state = status_state.get()
+    return status_cache.get((state['version'], int(time.time())), lambda: build_status_payload(state))
+
+
+def get_trigger_source():
+    """Who is reporting the transition (?source= or JSON body), for the outage log"""
+    return parse_trigger_source(request.args.get('source'), request.get_json(silent=True))
+
+
+def parse_trigger_source(query_source, body):
+    """Source from the query string or a JSON body, default 'api'"""
+    body = body if isinstance(body, dict) else {}
+    source = query_source or body.get('source') or 'api'
+    return str(source)[:64]
+
+
+# ====== AVAILABILITY ======
+def parse_window_days(value):
+    """Parse '30d', '12w', '24h' or a bare number of days into whole UTC days"""
+    units = {'h': 1 / 24, 'd': 1, 'w': 7}
+    value = (value or '').strip().lower()
+    if value and value[-1] in units:
+        days = float(value[:-1]) * units[value[-1]]
+    else:
+        days = float(value)
+    if days <= 0:
+        raise ValueError(f'window must be positive: {value}')
+    # The daily rollup has day granularity, so round partial days up
+    return min(int(-(-days // 1)), AVAILABILITY_MAX_DAYS)
+
+
+def compute_availability(window_days, now=None):
+    """
+    Uptime %, MTTR, MTBF and outage count over the last `window_days`
+    UTC days (including today so far), read from the per-day rollup.
+    """
+    now_ts = (now or datetime.now(timezone.utc)).timestamp()
+    last_day = int(now_ts // 86400)
+    first_day = last_day - window_days + 1
+    window_start = first_day * 86400
+    window_seconds = now_ts - window_start
+
+    completed_downtime, outage_count = store.daily_totals(first_day, last_day)
+
+    # Include the running outage, clipped to the window
+    ongoing_downtime = 0.0
+    state = store.get_state()
+    if state['is_offline'] and state['offline_since']:
+        started = max(datetime.fromisoformat(state['offline_since']).timestamp(), window_start)
+        ongoing_downtime = max(now_ts - started, 0.0)
+
+    downtime = min(completed_downtime + ongoing_downtime, window_seconds)
+    uptime = window_seconds - downtime
+    return {
+        'window_days': window_days,
+        'window_start': datetime.fromtimestamp(window_start, timezone.utc).isoformat(),
+        'window_end': datetime.fromtimestamp(now_ts, timezone.utc).isoformat(),
+        'uptime_percent': 100.0 * uptime / window_seconds if window_seconds > 0 else 100.0,
+        'downtime_seconds': downtime,
+        'outage_count': outage_count,
+        # Mean time to recovery covers completed outages only
+        'mttr_seconds': completed_downtime / outage_count if outage_count else None,
+        'mtbf_seconds': uptime / outage_count if outage_count else None,
+        'is_offline': state['is_offline']
+    }
+
+
+# ====== STATUS STREAM ======
+# One ticker thread computes the status once per STREAM_INTERVAL and fans it
+# out to every connected viewer, instead of each tab polling once a second.
+status_broadcaster = EventBroadcaster(queue_size=STREAM_QUEUE_SIZE)
+_ticker_thread = None
+_ticker_pid = None
+_ticker_lock = threading.Lock()
+
+
+def publish_status():
+    """Push the current status to all stream subscribers"""
+    if status_broadcaster.subscriber_count:
+        body, _ = get_status_body()
+        status_broadcaster.publish(body.decode('utf-8'))
+
+
+def state_changed():
+    """After a transition by this process: drop the coalesced state and push the new status"""
+    status_state.invalidate()
+    publish_status()
+
+
+def _ticker_loop():
+    """Publish the status every STREAM_INTERVAL seconds"""
+    while True:
+        time.sleep(STREAM_INTERVAL)
+        try:
+            publish_status()
+        except Exception as e:
+            print(f"Status ticker error: {e}")
+
+
+def start_status_ticker():
+    """Start the ticker thread once per process"""
+    global _ticker_thread, _ticker_pid
+    if _ticker_pid == os.getpid() and _ticker_thread is not None:
+        return
+    with _ticker_lock:
+        if _ticker_pid == os.getpid() and _ticker_thread is not None:
+            return
+        _ticker_thread = threading.Thread(target=_ticker_loop, name='status-ticker', daemon=True)
+        _ticker_thread.start()
+        _ticker_pid = os.getpid()
+
+
+# ====== ALERTS ======
+# Error-budget burn of total downtime against a 99.9% availability SLO
+DEFAULT_ALERT_RULES = [
+    {'type': 'burn_rate', 'name': 'downtime_budget_burn', 'metric': 'total_downtime_seconds',
+     'slo': 99.9, 'window': '1h', 'threshold': 14.4, 'severity': 'critical'}
+]
+alert_engine = build_engine('downtime_tracker', DEFAULT_ALERT_RULES,
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alerts.ndjson'))
+# Every worker runs the alert thread, but only the holder of this flock evaluates,
+# so each transition reaches the sinks once; the others retry every ALERT_INTERVAL
+ALERT_LOCK_PATH = os.environ.get('ALERT_LOCK_PATH') or (
+    f"{store.path}.alerts.lock" if hasattr(store, 'path')
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downtime_tracker.alerts.lock'))
+_alert_thread = None
+_alert_pid = None
+_alert_lock_file = None
+
+
+def try_become_alert_evaluator():
+    """Take the evaluator role if no live process holds it (non-blocking)"""
+    global _alert_lock_file
+    if _alert_lock_file is not None:
+        return True
+    lock_file = open(ALERT_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Held (and the fd kept open) for the life of the process
+    _alert_lock_file = lock_file
+    return True
+
+
+def _alert_loop():
+    """Feed the running downtime total to the alert rules every ALERT_INTERVAL seconds (evaluator only)"""
+    while True:
+        try:
+            if not try_become_alert_evaluator():
+                time.sleep(ALERT_INTERVAL)
+                continue
+            state = store.get_state()
+            alert_engine.observe({
+                'total_downtime_seconds': current_total_downtime(state),
+                'is_offline': int(state['is_offline'])
+            }, time.time())
+        except Exception as e:
+            print(f"Alert evaluation error: {e}")
+        time.sleep(ALERT_INTERVAL)
+
 
+def start_alert_evaluator():
+    """Start the alert thread once per process"""
+    global _alert_thread, _alert_pid, _alert_lock_file
+    if _alert_pid == os.getpid() and _alert_thread is not None:
+        return
+    with _ticker_lock:
+        if _alert_pid == os.getpid() and _alert_thread is not None:
+            return
+        _alert_lock_file = None  # A flock inherited over fork is not this process's to hold
+        _alert_thread = threading.Thread(target=_alert_loop, name='alert-evaluator', daemon=True)
+        _alert_thread.start()
+        _alert_pid = os.getpid()
+
+
+@app.before_request
+def ensure_alert_evaluator():
+    start_alert_evaluator()
+
+
+# ====== OVERLOAD PROTECTION ======
+# Every request spends a token from its client's bucket (reads and POSTs
+# have separate buckets) before any store work; an empty bucket gets a 429
+# with Retry-After. Concurrent identical triggers share one transition.
+read_limiter = TokenBucketLimiter(READ_RATE_LIMIT, READ_RATE_BURST, RATE_LIMIT_MAX_CLIENTS)
+write_limiter = TokenBucketLimiter(WRITE_RATE_LIMIT, WRITE_RATE_BURST, RATE_LIMIT_MAX_CLIENTS)
+transitions = SingleFlight()
+
+
+def client_key(remote_addr, forwarded_for):
+    """The client's address: the X-Forwarded-For entry added by the outermost trusted proxy, else the peer"""
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return remote_addr or 'unknown'
+
+
+def rate_limit_rejection(method, remote_addr, forwarded_for):
+    """None if the request may proceed, else (429 payload, Retry-After seconds)"""
+    if method == 'OPTIONS':
+        return None  # CORS preflights are cheap and sent by the browser, not the page
+    limiter = read_limiter if method in ('GET', 'HEAD') else write_limiter
+    allowed, retry_after = limiter.allow(client_key(remote_addr, forwarded_for))
+    if allowed:
+        return None
+    return {'status': 'error', 'error': 'Too many requests, slow down'}, max(math.ceil(retry_after), 1)
+
+
+@app.before_request
+def enforce_rate_limit():
+    rejection = rate_limit_rejection(request.method, request.remote_addr, request.headers.get('X-Forwarded-For'))
+    if rejection is None:
+        return None
+    payload, retry_after = rejection
+    response = jsonify(payload)
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    # Public endpoints are called cross-origin; let the page see why it was refused
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+# ====== PROMETHEUS GAUGES ======
+def current_total_downtime(state=None):
+    """Total downtime in seconds, including an outage still in progress"""
+    state = state or store.get_state()
+    total = state['total_downtime_seconds']
+    if state['is_offline'] and state['offline_since']:
+        offline_since = datetime.fromisoformat(state['offline_since'])
+        total += (datetime.now(timezone.utc) - offline_since).total_seconds()
+    return total
+
+
+metrics.gauge('total_downtime_seconds', 'Accumulated downtime including any running outage',
+              current_total_downtime)
+metrics.gauge('is_offline', '1 while the main server is marked offline',
+              lambda: int(store.get_state()['is_offline']))
+metrics.gauge('stream_subscribers', 'Open /api/downtime/stream connections',
+              lambda: status_broadcaster.subscriber_count)
+metrics.gauge('rate_limited_requests', 'Requests refused with 429 since start',
+              lambda: read_limiter.rejected_total + write_limiter.rejected_total)
+metrics.gauge('rate_limit_clients', 'Clients with a token bucket', lambda: len(read_limiter) + len(write_limiter))
+metrics.gauge('collapsed_triggers', 'Trigger calls that joined a transition already in flight',
+              lambda: transitions.collapsed_total)
+
+
+@app.route('/api/downtime/status', methods=['GET'])
+@cross_origin()  # Allow CORS only for this GET endpoint
+def get_downtime_status():
+    """
+    Get current downtime status.
+    Returns the current downtime in seconds if offline, or 0 if online.
+    Also includes last outage information when server is online.
+    """
+    # Served from the per-version cache; clients holding it get a 304
+    body, etag = get_status_body()
+    return json_response(body, etag, STATUS_MAX_AGE)
+
+
+@app.route('/api/downtime/stream', methods=['GET'])
+@cross_origin()  # Public, read-only like /status
+def stream_downtime_status():
+    """
+    Server-Sent Events stream of the same payload as /api/downtime/status.
+    Pushed every STREAM_INTERVAL seconds and immediately on transitions.
+    """
+    start_status_ticker()
+    return Response(
+        status_broadcaster.stream(get_status_body()[0].decode('utf-8')),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+
+@app.route('/api/downtime/availability', methods=['GET'])
+@cross_origin()  # Public, read-only like /status
+def get_availability():
+    """
+    Availability summary over a window, e.g. /api/downtime/availability?window=30d
+    Windows are whole UTC days ending now.
+    """
+    try:
+        window_days = parse_window_days(request.args.get('window', '30d'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return jsonify(compute_availability(window_days))
 
 
 @app.route('/api/downtime/trigger-offline', methods=['POST'])
@@ -70,23 +414,36 @@ def trigger_offline():
     Anyone can call this, but it will only start tracking ONCE.
     Once offline, it won't reset until trigger-online is called.
     """
-    if not downtime_tracker['is_offline']:
+    return jsonify(apply_trigger_offline(get_trigger_source()))
+
+
+def apply_trigger_offline(source):
+    """Start an outage unless one is already running; returns the response payload"""
+    # A burst of triggers (several monitors, a hostile client) shares one transition
+    (started, state), shared = transitions.do('offline', lambda: _mark_offline(source))
+    # Only the caller whose run started the outage reports it; the rest of a burst see it already running
+    if started and not shared:
         # First time going offline - start tracking
-        downtime_tracker['is_offline'] = True
-        downtime_tracker['offline_since'] = datetime.now(timezone.utc).isoformat()
-        
-        return jsonify({
+        return {
             'status': 'success',
             'message': 'Downtime tracking started',
-            'offline_since': downtime_tracker['offline_since']
-        })
+            'offline_since': state['offline_since']
+        }
     else:
         # Already offline - don't reset the timer
-        return jsonify({
+        return {
             'status': 'already_offline',
             'message': 'Server is already marked as offline. Downtime continues.',
-            'offline_since': downtime_tracker['offline_since']
-        })
+            'offline_since': state['offline_since']
+        }
+
+
+def _mark_offline(source):
+    with metrics.phase('db'):
+        started, state = store.mark_offline(datetime.now(timezone.utc), source=source)
+    if started:
+        state_changed()
+    return started, state
 
 
 
@@ -97,39 +454,205 @@ def trigger_online():
     Call this endpoint when you detect the server is back up.
     Saves the outage details for later reference.
     """
-    if downtime_tracker['is_offline'] and downtime_tracker['offline_since']:
-        # Calculate the downtime for this outage
-        offline_since = datetime.fromisoformat(downtime_tracker['offline_since'])
-        now = datetime.now(timezone.utc)
-        downtime_duration = (now - offline_since).total_seconds()
-        
-        # Add to total downtime
-        downtime_tracker['total_downtime_seconds'] += downtime_duration
-        
-        # Save last outage information
-        downtime_tracker['last_outage_start'] = downtime_tracker['offline_since']
-        downtime_tracker['last_outage_end'] = now.isoformat()
-        downtime_tracker['last_outage_duration_seconds'] = downtime_duration
-        
-        # Reset offline status
-        downtime_tracker['is_offline'] = False
-        previous_offline_since = downtime_tracker['offline_since']
-        downtime_tracker['offline_since'] = None
-        
-        return jsonify({
+    return jsonify(apply_trigger_online())
+
+
+def apply_trigger_online():
+    """Close the running outage, if any; returns the response payload"""
+    # Closing the outage and adding it to the total is one atomic transition
+    (outage, state), shared = transitions.do('online', _mark_online)
+    if outage and not shared:
+        return {
             'status': 'success',
             'message': 'Server is back online',
-            'downtime_duration_seconds': downtime_duration,
-            'total_downtime_seconds': downtime_tracker['total_downtime_seconds'],
-            'was_offline_since': previous_offline_since,
-            'last_outage_start': downtime_tracker['last_outage_start'],
-            'last_outage_end': downtime_tracker['last_outage_end']
-        })
+            'downtime_duration_seconds': outage['duration_seconds'],
+            'total_downtime_seconds': state['total_downtime_seconds'],
+            'was_offline_since': outage['start'],
+            'last_outage_start': state['last_outage_start'],
+            'last_outage_end': state['last_outage_end']
+        }
     else:
-        return jsonify({
+        return {
             'status': 'already_online',
             'message': 'Server is already marked as online'
-        })
+        }
+
+
+def _mark_online():
+    with metrics.phase('db'):
+        outage, state = store.mark_online(datetime.now(timezone.utc))
+    if outage:
+        state_changed()
+    return outage, state
+
+
+def parse_ingest_event(raw, now):
+    """Validate one bulk-ingest event; raises ValueError if malformed"""
+    if not isinstance(raw, dict):
+        raise ValueError('event must be an object')
+    event_id = str(raw.get('id') or '')
+    if not 0 < len(event_id) <= 128:
+        raise ValueError('event id must be 1-128 characters')
+    if raw.get('type') not in ('offline', 'online'):
+        raise ValueError(f"event {event_id}: type must be 'offline' or 'online'")
+    at = datetime.fromisoformat(str(raw.get('timestamp')))
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return {
+        'id': event_id,
+        'type': raw['type'],
+        # A sender with a fast clock can't schedule events in the future
+        'at': min(at, now),
+        'source': str(raw.get('source') or 'monitor')[:64]
+    }
+
+
+@app.route('/api/downtime/events', methods=['POST'])
+def ingest_events():
+    """
+    Bulk ingest of offline/online transitions with their original timestamps.
+    Body: {"events": [{"id": "<idempotency key>", "type": "offline" | "online",
+                       "timestamp": "<ISO 8601>", "source": "monitor"}, ...]}
+    Events are applied in timestamp order; ids seen before are reported as
+    'duplicate' and skipped, so senders can safely retry a whole batch.
+    Events older than MAX_EVENT_AGE are reported as 'expired' and not applied,
+    so history can't be backdated.
+    """
+    payload, status = apply_ingest(request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+def apply_ingest(body):
+    """Validate and apply one bulk-ingest body; returns (response payload, HTTP status)"""
+    body = body if isinstance(body, dict) else {}
+    raw_events = body.get('events')
+    if not isinstance(raw_events, list) or not raw_events:
+        return {'status': 'error', 'error': 'events must be a non-empty list'}, 400
+    if len(raw_events) > MAX_INGEST_BATCH:
+        return {'status': 'error', 'error': f'at most {MAX_INGEST_BATCH} events per batch'}, 413
+
+    now = datetime.now(timezone.utc)
+    try:
+        events = [parse_ingest_event(raw, now) for raw in raw_events]
+    except (TypeError, ValueError) as e:
+        return {'status': 'error', 'error': str(e)}, 400
+
+    oldest = now - timedelta(seconds=MAX_EVENT_AGE)
+    expired = {event['id']: 'expired' for event in events if event['at'] < oldest}
+    with metrics.phase('db'):
+        results, state = store.apply_events([event for event in events if event['id'] not in expired], now)
+    results.update(expired)
+    if 'applied' in results.values():
+        state_changed()
+
+    return {
+        'status': 'success',
+        'results': results,
+        'is_offline': state['is_offline'],
+        'offline_since': state['offline_since'],
+        'total_downtime_seconds': state['total_downtime_seconds']
+    }, 200
+
+
+# ====== BULK EXPORT / IMPORT ======
+# Columns of a CSV export; NDJSON records carry the same keys
+OUTAGE_EXPORT_FIELDS = ('table', 'start', 'end', 'start_ts', 'end_ts', 'duration_seconds', 'source')
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def outage_records():
+    """The outage log as export records, in batches of EXPORT_BATCH"""
+    for batch in store.iter_outages(EXPORT_BATCH):
+        yield [{'table': 'outage', 'start': _iso(outage['start_ts']), 'end': _iso(outage['end_ts']), **outage}
+               for outage in batch]
+
+
+def export_chunks(fmt):
+    """Encoded chunks of the whole outage log; read lazily, one batch per chunk"""
+    return encode_batches(outage_records(), fmt, OUTAGE_EXPORT_FIELDS)
+
+
+def parse_import_outage(raw):
+    """Validate one imported outage record; raises ValueError if malformed"""
+    if raw.get('table', 'outage') != 'outage':
+        raise ValueError(f"unknown table: {raw.get('table')}")
+    try:
+        start_ts = float(raw['start_ts'])
+        end_ts = float(raw['end_ts'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('outage start_ts and end_ts must be numbers')
+    if not (math.isfinite(start_ts) and math.isfinite(end_ts)) or end_ts < start_ts:
+        raise ValueError('outage must end after it starts')
+    if end_ts > time.time():
+        raise ValueError('outage must have ended already')
+    # Keep the exported duration (bit for bit) unless it disagrees with the endpoints
+    duration = raw.get('duration_seconds')
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)) \
+            or abs(duration - (end_ts - start_ts)) > IMPORT_MATCH_TOLERANCE:
+        duration = end_ts - start_ts
+    return {
+        'start': _iso(start_ts),
+        'end': _iso(end_ts),
+        'duration_seconds': float(duration),
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'source': str(raw.get('source') or 'import')[:64]
+    }
+
+
+@app.route('/api/downtime/export', methods=['GET'])
+def export_outages():
+    """
+    The full outage log, oldest first: /api/downtime/export?format=ndjson|csv
+    Streamed in chunks read from the store batch by batch.
+    """
+    try:
+        fmt = parse_export_format(request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    return Response(
+        export_chunks(fmt),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={export_filename("outages", fmt)}'}
+    )
+
+
+@app.route('/api/downtime/import', methods=['POST'])
+def import_outages():
+    """
+    Import completed outages, e.g. from another instance's export.
+    Body: {"records": [{"start_ts": ..., "end_ts": ..., "source": ...}, ...]}
+    Outages already in the log are skipped, so a batch can be retried.
+    Requires `Authorization: Bearer $IMPORT_TOKEN`; disabled (404) while that is unset.
+    """
+    payload, status = apply_import(request.get_json(silent=True), request.headers.get('Authorization'))
+    return jsonify(payload), status
+
+
+def apply_import(body, authorization=None):
+    """Validate and apply one import batch; returns (response payload, HTTP status)"""
+    rejection = import_rejection(authorization)
+    if rejection is not None:
+        return {'status': 'error', 'error': rejection[0]}, rejection[1]
+    try:
+        outages = [parse_import_outage(raw) for raw in parse_import_records(body, MAX_INGEST_BATCH)]
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}, 400
+
+    with metrics.phase('db'):
+        imported, state = store.import_outages(outages)
+    if imported:
+        state_changed()
+
+    return {
+        'status': 'success',
+        'imported': imported,
+        'skipped': len(outages) - imported,
+        'total_downtime_seconds': state['total_downtime_seconds']
+    }, 200
 
 
 @app.route('/api/downtime/reset', methods=['POST'])
@@ -139,29 +662,33 @@ def reset_downtime():
     Use this to start fresh or for maintenance.
     Clears both current and last outage information.
     """
-    downtime_tracker['is_offline'] = False
-    downtime_tracker['offline_since'] = None
-    downtime_tracker['total_downtime_seconds'] = 0.0
-    # Also reset last outage info
-    downtime_tracker['last_outage_start'] = None
-    downtime_tracker['last_outage_end'] = None
-    downtime_tracker['last_outage_duration_seconds'] = 0.0
+    return jsonify(apply_reset())
+
+
+def apply_reset():
+    """Clear all downtime state; returns the response payload"""
+    store.reset()
+    state_changed()
     
-    return jsonify({
+    return {
         'status': 'success',
         'message': 'Downtime tracker has been reset (including last outage info)'
-    })
+    }
 
 
 @app.route('/health', methods=['GET'])
 @cross_origin()  # Allow CORS for health check
 def health_check():
     """Health check endpoint for Render"""
-    return jsonify({
+    return jsonify(health_payload())
+
+
+def health_payload():
+    return {
         'status': 'healthy',
         'service': 'downtime-tracker',
         'timestamp': datetime.now(timezone.utc).isoformat()
-    })
+    }
 
 
 
@@ -0,0 +1,138 @@
+"""
+Async entry point for the downtime tracker.
+
+Serves the same routes and JSON as downtime_tracker.py (and shares its
+store, caches and status stream) from one aiohttp event loop. Store calls
+run on the bounded blocking pool, so a status stream or a slow viewer
+never ties up a worker. Run with:
+
+    gunicorn downtime_tracker_async:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:5001
+
+or `python downtime_tracker_async.py` for a single process.
+"""
+
+import os
+
+from aiohttp import web
+
+import downtime_tracker as tracker
+from async_web import (chunked_response, cors_middleware, instrument, json_payload, json_response,
+                       read_json, run_blocking, sse_response)
+from bulk_export import EXPORT_FORMATS, export_filename, parse_export_format
+
+# Same selective CORS as the WSGI app: public reads and trigger-offline only
+CORS_PATHS = {
+    '/api/downtime/status',
+    '/api/downtime/stream',
+    '/api/downtime/availability',
+    '/api/downtime/trigger-offline',
+    '/health'
+}
+
+
+@web.middleware
+async def rate_limit_middleware(request, handler):
+    """Same per-client token buckets as the WSGI app (see downtime_tracker.rate_limit_rejection)"""
+    rejection = tracker.rate_limit_rejection(request.method, request.remote,
+                                             request.headers.get('X-Forwarded-For'))
+    if rejection is None:
+        return await handler(request)
+    payload, retry_after = rejection
+    response = json_payload(payload, 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+async def get_downtime_status(request):
+    """Same payload as GET /api/downtime/status on the WSGI app"""
+    body, etag = await run_blocking(tracker.get_status_body)
+    return json_response(request, body, etag, tracker.STATUS_MAX_AGE)
+
+
+async def stream_downtime_status(request):
+    """Server-Sent Events stream of the /api/downtime/status payload"""
+    body, _ = await run_blocking(tracker.get_status_body)
+    return await sse_response(request, tracker.status_broadcaster, body.decode('utf-8'))
+
+
+async def get_availability(request):
+    """Availability summary over a window, e.g. ?window=30d"""
+    try:
+        window_days = tracker.parse_window_days(request.query.get('window', '30d'))
+    except ValueError as e:
+        return json_payload({'status': 'error', 'error': str(e)}, 400)
+    return json_payload(await run_blocking(tracker.compute_availability, window_days))
+
+
+async def trigger_offline(request):
+    source = tracker.parse_trigger_source(request.query.get('source'), await read_json(request))
+    return json_payload(await run_blocking(tracker.apply_trigger_offline, source))
+
+
+async def trigger_online(request):
+    return json_payload(await run_blocking(tracker.apply_trigger_online))
+
+
+async def ingest_events(request):
+    """Bulk ingest of offline/online transitions (see downtime_tracker.ingest_events)"""
+    payload, status = await run_blocking(tracker.apply_ingest, await read_json(request))
+    return json_payload(payload, status)
+
+
+async def export_outages(request):
+    """The full outage log as chunked NDJSON or CSV (see downtime_tracker.export_outages)"""
+    try:
+        fmt = parse_export_format(request.query.get('format'))
+    except ValueError as e:
+        return json_payload({'status': 'error', 'error': str(e)}, 400)
+    return await chunked_response(
+        request, tracker.export_chunks(fmt), EXPORT_FORMATS[fmt],
+        {'Content-Disposition': f'attachment; filename={export_filename("outages", fmt)}'}
+    )
+
+
+async def import_outages(request):
+    """Import completed outages (see downtime_tracker.import_outages)"""
+    payload, status = await run_blocking(tracker.apply_import, await read_json(request),
+                                         request.headers.get('Authorization'))
+    return json_payload(payload, status)
+
+
+async def reset_downtime(request):
+    return json_payload(await run_blocking(tracker.apply_reset))
+
+
+async def health_check(request):
+    return json_payload(tracker.health_payload())
+
+
+# ====== APPLICATION ======
+async def _start_ticker(app):
+    tracker.start_status_ticker()
+    tracker.start_alert_evaluator()
+
+
+def create_app():
+    """Build the aiohttp application (also usable as a gunicorn app factory)"""
+    # Refusals pass back out through the CORS middleware, so pages can read them
+    app = web.Application(middlewares=[cors_middleware(CORS_PATHS), rate_limit_middleware])
+    instrument(app, tracker.metrics)
+    app.router.add_get('/api/downtime/status', get_downtime_status)
+    app.router.add_get('/api/downtime/stream', stream_downtime_status)
+    app.router.add_get('/api/downtime/availability', get_availability)
+    app.router.add_post('/api/downtime/trigger-offline', trigger_offline)
+    app.router.add_post('/api/downtime/trigger-online', trigger_online)
+    app.router.add_post('/api/downtime/events', ingest_events)
+    app.router.add_get('/api/downtime/export', export_outages)
+    app.router.add_post('/api/downtime/import', import_outages)
+    app.router.add_post('/api/downtime/reset', reset_downtime)
+    app.router.add_get('/health', health_check)
+    app.on_startup.append(_start_ticker)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5001)))
@@ -0,0 +1,192 @@
+"""
+Server-Sent Events fan-out shared by the stats API and the downtime tracker.
+
+A single producer (the metrics sampler, the downtime ticker) publishes one
+pre-serialized payload per tick. Each connected client owns a small bounded
+queue; a client that falls behind far enough to fill it is dropped instead
+of making the producer wait or buffering without limit.
+
+Streaming responses hold a connection open, so run the services with a
+threaded or async worker; gunicorn.conf.py selects gthread for the Flask apps.
+The async entry points use astream(), where an idle subscriber is just a
+parked coroutine rather than a thread.
+"""
+
+import asyncio
+import queue
+import threading
+
+
+class AsyncSubscriber:
+    """
+    Subscriber queue for a coroutine on an event loop.
+    It speaks the subset of queue.Queue that EventBroadcaster uses, so
+    publish() from the producer thread can treat both kinds alike; the
+    messages themselves are handed to the loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, loop, maxsize):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize)
+        self._maxsize = maxsize
+        # Messages handed to the loop but not yet queued count towards the limit
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def put_nowait(self, message):
+        if message is None:
+            # Close marker from _drop(): discard the backlog on the loop itself
+            self._loop.call_soon_threadsafe(self._close)
+            return
+        with self._lock:
+            if self._queue.qsize() + self._in_flight >= self._maxsize:
+                raise queue.Full
+            self._in_flight += 1
+        self._loop.call_soon_threadsafe(self._put, message)
+
+    def get_nowait(self):
+        # Draining happens in _close(), on the loop that owns the queue
+        raise queue.Empty
+
+    def _put(self, message):
+        with self._lock:
+            self._in_flight -= 1
+        if self._queue.full():
+            return  # Closed by _drop() in the meantime
+        self._queue.put_nowait(message)
+
+    def _close(self):
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+
+class EventBroadcaster:
+    """Fan one stream of SSE messages out to many subscribers"""
+
+    # Comment line keeps proxies from closing an idle stream
+    KEEPALIVE = b': keepalive\n\n'
+
+    def __init__(self, queue_size=8, keepalive_seconds=15.0, retry_ms=3000):
+        self.queue_size = queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self.retry_ms = retry_ms
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.dropped_total = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    @staticmethod
+    def format_message(data, event=None):
+        """Encode a payload as an SSE message (data must already be serialized)"""
+        lines = []
+        if event:
+            lines.append(f'event: {event}')
+        lines.extend(f'data: {line}' for line in data.splitlines() or [''])
+        return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+    def preamble(self):
+        """Sent once when a client connects, before the initial payload"""
+        return f'retry: {self.retry_ms}\n\n'.encode('utf-8')
+
+    def subscribe(self, loop=None):
+        """Register a new subscriber and return its queue (an AsyncSubscriber if `loop` is given)"""
+        if loop is None:
+            subscriber = queue.Queue(maxsize=self.queue_size)
+        else:
+            subscriber = AsyncSubscriber(loop, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _drop(self, subscriber):
+        """Disconnect a slow consumer: empty its queue and leave a close marker"""
+        self.unsubscribe(subscriber)
+        self.dropped_total += 1
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def publish(self, data, event=None):
+        """
+        Send one serialized payload to every subscriber.
+        The message is encoded once; per subscriber this is a single
+        non-blocking enqueue. Returns the number of subscribers reached.
+        """
+        message = self.format_message(data, event)
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        delivered = 0
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                self._drop(subscriber)
+        return delivered
+
+    def stream(self, initial=None, event=None):
+        """
+        Generator for a streaming response body.
+        Sends `initial` (already serialized) first so the client renders
+        immediately, then relays published messages until the client goes
+        away or is dropped for being too slow. `initial` may also be a
+        callable; it is then called after subscribing, so nothing published
+        in between is missed.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield self.preamble()
+            if callable(initial):
+                initial = initial()
+            if initial is not None:
+                yield self.format_message(initial, event)
+            while True:
+                try:
+                    message = subscriber.get(timeout=self.keepalive_seconds)
+                except queue.Empty:
+                    yield self.KEEPALIVE
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def astream(self, initial=None, event=None):
+        """Async-generator version of stream() for the async entry points"""
+        subscriber = self.subscribe(asyncio.get_running_loop())
+        try:
+            yield self.preamble()
+            if callable(initial):
+                initial = initial()
+            if initial is not None:
+                yield self.format_message(initial, event)
+            while True:
+                try:
+                    message = await subscriber.get(self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield self.KEEPALIVE
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,147 @@
+"""
+In-memory fleet summary for the multi-host endpoints.
+
+Samples pushed by host agents are folded in as they arrive. Each host
+keeps its latest values and a short ring of recent points. The fleet
+keeps running sums of every host's latest CPU/RAM/disk and a list of
+hosts ordered by when they last reported. Folding in a sample is O(1):
+subtract the host's previous values and add the new ones. An overview
+only reads those sums, and finds stale hosts by walking in from the least
+recently heard-from end.
+
+Staleness goes by when the central service received a host's samples, not
+by the agent's clock, so a host with a skewed clock or a delayed batch
+neither looks offline nor breaks the ordering.
+"""
+
+from collections import OrderedDict, deque
+
+# Columns an agent may send, in wire order; 'timestamp' is required
+SAMPLE_FIELDS = ('timestamp', 'cpu_percent', 'ram_percent', 'disk_percent',
+                 'load_1m', 'net_rx_bps', 'net_tx_bps')
+SUMMED_FIELDS = ('cpu_percent', 'ram_percent', 'disk_percent')
+
+
+class HostState:
+    """Latest sample and recent points for one host"""
+
+    def __init__(self, host_id, recent_points):
+        self.host_id = host_id
+        self.first_seen = None
+        self.last_seen = None  # Timestamp of the latest sample (agent clock)
+        self.last_received = None  # When the central service last heard from it
+        self.latest = {}
+        self.sample_count = 0
+        self.recent = deque(maxlen=recent_points)
+
+    def summary(self, now, stale_after):
+        return {
+            'id': self.host_id,
+            'online': now - self.last_received <= stale_after,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'last_received': self.last_received,
+            'samples': self.sample_count,
+            **{field: self.latest.get(field) for field in SAMPLE_FIELDS[1:]}
+        }
+
+
+class Fleet:
+    """Incrementally maintained per-host state plus fleet-wide aggregates"""
+
+    def __init__(self, stale_after=90.0, recent_points=120):
+        self.stale_after = stale_after
+        self.recent_points = recent_points
+        self.version = 0  # Bumped on every change; keys the response caches
+        self._hosts = OrderedDict()  # host_id -> HostState, least recently heard from first
+        self._last_received = 0.0
+        self._sums = dict.fromkeys(SUMMED_FIELDS, 0.0)
+        self._counts = dict.fromkeys(SUMMED_FIELDS, 0)
+
+    def add(self, host_id, sample, received_at):
+        """Fold one sample (dict keyed by SAMPLE_FIELDS) received at `received_at` into the fleet"""
+        # Samples are folded in ingest order; never let the order go backwards
+        received_at = self._last_received = max(received_at, self._last_received)
+        host = self._hosts.get(host_id)
+        if host is None:
+            host = self._hosts[host_id] = HostState(host_id, self.recent_points)
+            host.first_seen = sample['timestamp']
+        host.last_received = received_at
+        self._hosts.move_to_end(host_id)
+        if host.last_seen is not None and sample['timestamp'] < host.last_seen:
+            # Late sample (e.g. a retried batch): history only, the latest values stand
+            host.sample_count += 1
+            self.version += 1
+            return
+
+        for field in SUMMED_FIELDS:
+            old, new = host.latest.get(field), sample.get(field)
+            if old is not None:
+                self._sums[field] -= old
+                self._counts[field] -= 1
+            if new is not None:
+                self._sums[field] += new
+                self._counts[field] += 1
+
+        host.latest = sample
+        host.last_seen = sample['timestamp']
+        host.sample_count += 1
+        host.recent.append(sample)
+        self.version += 1
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def forget_silent(self, cutoff):
+        """Drop hosts not heard from since `cutoff` (their samples have expired); returns their ids"""
+        forgotten = []
+        while self._hosts:
+            host = next(iter(self._hosts.values()))
+            if host.last_received >= cutoff:
+                break  # Everything after this reported more recently
+            del self._hosts[host.host_id]
+            for field in SUMMED_FIELDS:
+                if host.latest.get(field) is not None:
+                    self._sums[field] -= host.latest[field]
+                    self._counts[field] -= 1
+            forgotten.append(host.host_id)
+        if forgotten:
+            self.version += 1
+        return forgotten
+
+    def seed(self, host_id, first_seen, sample_count):
+        """Set lifetime totals for a host loaded from storage (only recent samples are folded in)"""
+        host = self._hosts.get(host_id)
+        if host is not None:
+            host.first_seen = first_seen
+            host.sample_count = sample_count
+
+    def host(self, host_id):
+        return self._hosts.get(host_id)
+
+    def stale_hosts(self, now):
+        """Hosts that haven't reported within stale_after (oldest first)"""
+        stale = []
+        for host in self._hosts.values():
+            if now - host.last_received <= self.stale_after:
+                break  # Everything after this reported more recently
+            stale.append(host.host_id)
+        return stale
+
+    def overview(self, now):
+        """Fleet-wide summary from the running aggregates"""
+        stale = self.stale_hosts(now)
+        return {
+            'host_count': len(self._hosts),
+            'online': len(self._hosts) - len(stale),
+            'stale': stale,
+            **{
+                f'avg_{field}': self._sums[field] / self._counts[field] if self._counts[field] else None
+                for field in SUMMED_FIELDS
+            },
+            'stale_after_seconds': self.stale_after
+        }
+
+    def hosts(self, now):
+        """Per-host summaries, most recently heard from first"""
+        return [host.summary(now, self.stale_after) for host in reversed(self._hosts.values())]
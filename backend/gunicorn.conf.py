@@ -0,0 +1,23 @@
+"""
+Gunicorn settings for the Flask entry points (app.py, downtime_tracker.py).
+
+gunicorn reads this file from the working directory, so both services
+started from backend/ get it:
+
+    gunicorn app:app --bind 0.0.0.0:8487
+    gunicorn downtime_tracker:app --bind 0.0.0.0:5001
+
+The default sync worker serves one request at a time, so every open
+/stream tab would hold a whole worker. gthread gives each worker a pool of
+threads, and its timeout watches the worker rather than each request, so a
+long-lived stream isn't killed as a hung request. The async entry points
+pass their own worker class on the command line, which overrides this one.
+"""
+
+import os
+
+worker_class = 'gthread'
+# Workers per service (gunicorn's WEB_CONCURRENCY convention)
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Concurrent requests, including open streams, per worker
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
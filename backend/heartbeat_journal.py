@@ -0,0 +1,195 @@
+"""
+Heartbeat journal for gap-free uptime accounting on the homeserver.
+
+While the stats service runs it appends a fixed-size (boot_time,
+timestamp) record every interval to a memory-mapped file. Records with
+the same boot belong to one session, and that session lasted from
+boot_time to its last heartbeat. The gap between one session's last
+heartbeat and the next boot_time is downtime. Together these give total
+uptime, downtime and reboot count without depending on anyone polling
+the API.
+
+When the journal fills up, its records are folded into a small JSON
+summary (one entry per boot) and the journal starts over. Folding is
+idempotent (a session's last_seen only ever moves forward), so a crash
+halfway through compaction can't double count. An exclusive flock
+serializes writers across gunicorn workers.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'HBJ1'
+HEADER = struct.Struct('<4sII')  # magic, capacity, record count
+RECORD = struct.Struct('<dd')  # boot_time, timestamp
+
+
+class HeartbeatJournal:
+    """Append-only heartbeat log plus compacted per-boot session summary"""
+
+    def __init__(self, path, summary_path, interval=10.0, capacity=8640):
+        self.path = path
+        self.summary_path = summary_path
+        self.interval = interval
+        self.capacity = capacity  # Default: one day of 10-second heartbeats
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._last_beat = 0.0
+
+    # ---- file handling ----
+    def open(self, baseline_uptime=0.0):
+        """
+        Map the journal, creating it (and the summary) on first use.
+        baseline_uptime carries over uptime recorded before the journal
+        existed; it is only used when the summary is first created.
+        """
+        if not os.path.exists(self.summary_path):
+            self._write_summary({'baseline_uptime_seconds': baseline_uptime, 'sessions': []})
+
+        size = HEADER.size + RECORD.size * self.capacity
+        self._file = open(self.path, 'a+b')
+        with self._locked(fcntl.LOCK_EX):
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            magic, capacity, _ = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or capacity != self.capacity:
+                # New file, or capacity changed: fold whatever is there and start fresh
+                if magic == MAGIC:
+                    self._compact_locked(min(capacity, self.capacity))
+                HEADER.pack_into(self._map, 0, MAGIC, self.capacity, 0)
+        self._pid = os.getpid()
+        return self
+
+    def _ensure_open(self):
+        # mmap and flock state don't carry over a fork cleanly; reopen per process
+        if self._map is None or self._pid != os.getpid():
+            self.open()
+
+    def _locked(self, mode):
+        journal = self
+
+        class _Lock:
+            def __enter__(self):
+                fcntl.flock(journal._file.fileno(), mode)
+
+            def __exit__(self, *exc):
+                fcntl.flock(journal._file.fileno(), fcntl.LOCK_UN)
+
+        return _Lock()
+
+    def _read_summary(self):
+        try:
+            with open(self.summary_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'baseline_uptime_seconds': 0.0, 'sessions': []}
+
+    def _write_summary(self, summary):
+        # Write-then-rename so readers never see a partial file
+        tmp_path = f'{self.summary_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.summary_path)
+
+    def _records(self, count=None):
+        if count is None:
+            count = HEADER.unpack_from(self._map, 0)[2]
+        return [RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size) for i in range(count)]
+
+    # ---- writing ----
+    def beat(self, boot_time, now=None, force=False):
+        """Append a heartbeat (at most one per interval unless forced)"""
+        now = now or time.time()
+        if not force and now - self._last_beat < self.interval:
+            return False
+        self._ensure_open()
+
+        with self._locked(fcntl.LOCK_EX):
+            count = HEADER.unpack_from(self._map, 0)[2]
+            if count:
+                _, last_ts = RECORD.unpack_from(self._map, HEADER.size + (count - 1) * RECORD.size)
+                # Another worker already wrote this interval's heartbeat
+                if not force and now - last_ts < self.interval / 2:
+                    self._last_beat = now
+                    return False
+            if count >= self.capacity:
+                self._compact_locked(count)
+                count = 0
+            RECORD.pack_into(self._map, HEADER.size + count * RECORD.size, boot_time, now)
+            HEADER.pack_into(self._map, 0, MAGIC, self.capacity, count + 1)
+        self._last_beat = now
+        return True
+
+    def _compact_locked(self, count):
+        """Fold the first `count` records into the summary and empty the journal"""
+        summary = self._read_summary()
+        summary['sessions'] = fold_sessions(summary['sessions'], self._records(count))
+        self._write_summary(summary)
+        HEADER.pack_into(self._map, 0, MAGIC, self.capacity, 0)
+        self._map.flush()
+
+    def flush(self):
+        """Push dirty pages to disk (the kernel does this anyway; used at shutdown)"""
+        if self._map is not None and self._pid == os.getpid():
+            self._map.flush()
+
+    # ---- reading ----
+    def sessions(self):
+        """(summary, every boot session seen so far as [{'boot_time', 'last_seen'}, ...])"""
+        self._ensure_open()
+        with self._locked(fcntl.LOCK_SH):
+            summary = self._read_summary()
+            records = self._records()
+        return summary, fold_sessions(summary['sessions'], records)
+
+    def totals(self, current_boot_time):
+        """
+        Reconstruct uptime accounting from the journal.
+        previous_uptime_seconds covers the baseline plus every earlier boot,
+        so total uptime right now is previous_uptime_seconds + time since boot.
+        """
+        summary, sessions = self.sessions()
+        previous = sessions
+        if sessions and current_boot_time <= sessions[-1]['last_seen']:
+            previous = sessions[:-1]  # Same rule as fold_sessions: the last session is this boot
+        downtime = sum((
+            max(later['boot_time'] - earlier['last_seen'], 0.0)
+            for earlier, later in zip(sessions, sessions[1:])
+        ), 0.0)
+        # Downtime before the current boot isn't in the list until its first heartbeat
+        if previous is sessions and sessions:
+            downtime += max(current_boot_time - sessions[-1]['last_seen'], 0.0)
+        return {
+            'previous_uptime_seconds': summary.get('baseline_uptime_seconds', 0.0) + sum(
+                s['last_seen'] - s['boot_time'] for s in previous
+            ),
+            'downtime_seconds': downtime,
+            'reboots': len(previous)
+        }
+
+
+def fold_sessions(sessions, records):
+    """
+    Merge heartbeat records into per-boot sessions.
+    A record whose boot_time is no later than the last heartbeat of the
+    latest session belongs to that boot (boot_time jitters and drifts with
+    clock adjustments, so it can't be compared exactly); a later boot_time
+    means the machine went down and came back.
+    """
+    sessions = [dict(s) for s in sessions]
+    for boot_time, timestamp in records:
+        if sessions and boot_time <= sessions[-1]['last_seen']:
+            session = sessions[-1]
+            session['last_seen'] = max(session['last_seen'], timestamp)
+        else:
+            sessions.append({'boot_time': boot_time, 'last_seen': timestamp})
+    return sessions
@@ -0,0 +1,154 @@
+"""
+Host agent: push this machine's metrics to a central stats service.
+
+Samples are thinned to one per sample_interval, buffered, and POSTed in
+compact batches to the central /api/hosts/ingest endpoint, with field
+names sent once per batch:
+
+    {"host": "nas", "fields": ["timestamp", "cpu_percent", ...],
+     "rows": [[1760000000.0, 12.5, ...], ...]}
+
+A failed push keeps the buffer (bounded) and retries on the next
+interval, so a central restart loses nothing recent.
+
+Run standalone on any host with psutil:
+    AGENT_INGEST_URL=http://central:8487/api/hosts/ingest AGENT_HOST_ID=nas AGENT_TOKEN=... python host_agent.py
+or set AGENT_INGEST_URL on a homeserver stats service and its collector
+pushes the samples it already takes. AGENT_TOKEN must match the central
+service's HOSTS_INGEST_TOKEN; ingest is disabled there until one is set.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import urllib.request
+from collections import deque
+
+from fleet import SAMPLE_FIELDS
+
+AGENT_INGEST_URL = os.environ.get('AGENT_INGEST_URL')
+AGENT_HOST_ID = os.environ.get('AGENT_HOST_ID') or socket.gethostname()
+AGENT_TOKEN = os.environ.get('AGENT_TOKEN')
+# One row per this many seconds, pushed every AGENT_PUSH_INTERVAL seconds
+AGENT_SAMPLE_INTERVAL = float(os.environ.get('AGENT_SAMPLE_INTERVAL', '10'))
+AGENT_PUSH_INTERVAL = float(os.environ.get('AGENT_PUSH_INTERVAL', '30'))
+
+
+def sample_row(snapshot):
+    """Wire row (ordered like SAMPLE_FIELDS) from a stats sampler snapshot"""
+    host = snapshot.get('host') or {}
+    network = host.get('network') or {}
+    load_avg = host.get('load_avg')
+    values = {
+        'timestamp': round(snapshot['sampled_at'], 3),
+        'cpu_percent': snapshot['cpu_percent'],
+        'ram_percent': snapshot['ram_percent'],
+        'disk_percent': snapshot['disk_percent'],
+        'load_1m': load_avg[0] if load_avg else None,
+        'net_rx_bps': network.get('bytes_recv_per_sec'),
+        'net_tx_bps': network.get('bytes_sent_per_sec')
+    }
+    return [round(value, 2) if isinstance(value, float) and field != 'timestamp' else value
+            for field, value in values.items()]
+
+
+class HostAgent:
+    """Buffers sampled rows and pushes them to the central ingest endpoint"""
+
+    def __init__(self, url, host_id, token=None, sample_interval=10.0, push_interval=30.0, max_buffer=4096):
+        self.url = url
+        self.host_id = host_id
+        self.token = token
+        self.sample_interval = sample_interval
+        self.push_interval = push_interval
+        self._buffer = deque(maxlen=max_buffer)  # (seq, row); oldest dropped if central is down for long
+        self._seq = 0  # Sequence number of the latest buffered row
+        self._lock = threading.Lock()
+        self._last_sample = 0.0
+        self._thread = None
+        self._pid = None
+
+    def add(self, snapshot):
+        """Offer a snapshot; kept if sample_interval has passed since the last kept one"""
+        if snapshot['sampled_at'] - self._last_sample < self.sample_interval:
+            return False
+        self._last_sample = snapshot['sampled_at']
+        with self._lock:
+            self._seq += 1
+            self._buffer.append((self._seq, sample_row(snapshot)))
+        self.start()
+        return True
+
+    def start(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._push_loop, name='host-agent', daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def push(self):
+        """Send everything buffered; rows stay buffered if the push fails"""
+        with self._lock:
+            entries = list(self._buffer)
+        if not entries:
+            return 0
+        rows = [row for _, row in entries]
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        body = json.dumps({'host': self.host_id, 'fields': SAMPLE_FIELDS, 'rows': rows},
+                          separators=(',', ':')).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+        # Drop what was sent by sequence number: rows added meanwhile stay even if
+        # older ones were evicted from the bounded buffer during the request
+        last_sent = entries[-1][0]
+        with self._lock:
+            while self._buffer and self._buffer[0][0] <= last_sent:
+                self._buffer.popleft()
+        return len(rows)
+
+    def _push_loop(self):
+        while True:
+            time.sleep(self.push_interval)
+            try:
+                self.push()
+            except Exception as e:
+                print(f"Host agent push error: {e}")
+
+
+def create_agent():
+    """Agent configured from AGENT_* environment variables, or None if AGENT_INGEST_URL is unset"""
+    if not AGENT_INGEST_URL:
+        return None
+    return HostAgent(AGENT_INGEST_URL, AGENT_HOST_ID, AGENT_TOKEN,
+                     sample_interval=AGENT_SAMPLE_INTERVAL, push_interval=AGENT_PUSH_INTERVAL)
+
+
+def main():
+    import psutil
+
+    from host_collector import HostCollector
+
+    agent = create_agent()
+    if agent is None:
+        raise SystemExit('Set AGENT_INGEST_URL (e.g. http://central:8487/api/hosts/ingest)')
+    collector = HostCollector()
+    psutil.cpu_percent(interval=None)
+    print(f"Pushing metrics for {agent.host_id} to {agent.url}")
+    while True:
+        time.sleep(agent.sample_interval)
+        agent.add({
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'ram_percent': psutil.virtual_memory().percent,
+            'disk_percent': psutil.disk_usage('/').percent,
+            'host': collector.collect(),
+            'sampled_at': time.time()
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Extended host telemetry for the stats API.
+
+HostCollector is called once per sampler tick. Rates (network throughput,
+disk IOPS and bytes/s) come from diffing the cumulative psutil counters
+against the previous tick, so each tick is a handful of cheap reads. The
+calls that can be slow (listing partitions, statvfs on every mount) are
+rate-limited and their results reused between refreshes.
+"""
+
+import os
+import time
+
+import psutil
+
+# Filesystem types that never hold user data
+IGNORED_FSTYPES = {'squashfs', 'tmpfs', 'devtmpfs', 'overlay', 'iso9660'}
+
+
+class HostCollector:
+    """Per-core CPU, load, network/disk I/O rates and per-mount usage"""
+
+    def __init__(self, partitions_refresh=300.0, usage_refresh=30.0):
+        self.partitions_refresh = partitions_refresh  # Re-list mounts this often (seconds)
+        self.usage_refresh = usage_refresh  # Re-stat mounts this often (seconds)
+
+        self._last_time = None
+        self._last_net = None
+        self._last_disk = None
+
+        self._partitions = []
+        self._partitions_at = 0.0
+        self._filesystems = []
+        self._usage_at = 0.0
+
+        # Prime per-core CPU so the first collect() has a baseline to compare against
+        psutil.cpu_percent(percpu=True, interval=None)
+
+    @staticmethod
+    def _rate(current, previous, elapsed):
+        # Counters can reset (e.g. interface re-created); report 0 rather than a negative rate
+        return max(current - previous, 0) / elapsed
+
+    def _io_rates(self, now):
+        """Network and disk I/O rates since the previous call (None on the first)"""
+        net = psutil.net_io_counters()
+        try:
+            disk = psutil.disk_io_counters()
+        except Exception:
+            disk = None  # Unavailable in some containers
+
+        network = disk_io = None
+        elapsed = now - self._last_time if self._last_time else 0
+        if elapsed > 0:
+            if net and self._last_net:
+                network = {
+                    'bytes_sent_per_sec': self._rate(net.bytes_sent, self._last_net.bytes_sent, elapsed),
+                    'bytes_recv_per_sec': self._rate(net.bytes_recv, self._last_net.bytes_recv, elapsed),
+                    'packets_sent_per_sec': self._rate(net.packets_sent, self._last_net.packets_sent, elapsed),
+                    'packets_recv_per_sec': self._rate(net.packets_recv, self._last_net.packets_recv, elapsed)
+                }
+            if disk and self._last_disk:
+                disk_io = {
+                    'read_iops': self._rate(disk.read_count, self._last_disk.read_count, elapsed),
+                    'write_iops': self._rate(disk.write_count, self._last_disk.write_count, elapsed),
+                    'read_bytes_per_sec': self._rate(disk.read_bytes, self._last_disk.read_bytes, elapsed),
+                    'write_bytes_per_sec': self._rate(disk.write_bytes, self._last_disk.write_bytes, elapsed)
+                }
+
+        self._last_time = now
+        self._last_net = net
+        self._last_disk = disk
+        return network, disk_io
+
+    def _refresh_filesystems(self, now):
+        """Usage for every real mount, re-listed and re-stat'ed on their own cadences"""
+        if now - self._partitions_at >= self.partitions_refresh:
+            seen = set()
+            partitions = []
+            for part in psutil.disk_partitions(all=False):
+                # Bind mounts of the same device would be counted twice
+                if part.fstype in IGNORED_FSTYPES or part.device in seen:
+                    continue
+                seen.add(part.device)
+                partitions.append(part)
+            self._partitions = partitions
+            self._partitions_at = now
+            self._usage_at = 0.0  # Mounts changed; re-stat them now
+
+        if now - self._usage_at >= self.usage_refresh:
+            filesystems = []
+            for part in self._partitions:
+                try:
+                    usage = psutil.disk_usage(part.mountpoint)
+                except (PermissionError, OSError):
+                    continue
+                # Device names are left out on purpose; mountpoints are enough to act on
+                filesystems.append({
+                    'mountpoint': part.mountpoint,
+                    'fstype': part.fstype,
+                    'total_bytes': usage.total,
+                    'used_bytes': usage.used,
+                    'percent': usage.percent
+                })
+            self._filesystems = filesystems
+            self._usage_at = now
+        return self._filesystems
+
+    def collect(self, now=None):
+        """Collect one tick of extended telemetry"""
+        now = now or time.monotonic()
+        network, disk_io = self._io_rates(now)
+        try:
+            load_avg = list(os.getloadavg())
+        except (AttributeError, OSError):
+            load_avg = None  # Not available on Windows
+        return {
+            'cpu_per_core': psutil.cpu_percent(percpu=True, interval=None),
+            'load_avg': load_avg,
+            'network': network,
+            'disk_io': disk_io,
+            'filesystems': self._refresh_filesystems(now)
+        }
@@ -0,0 +1,72 @@
+"""
+HTTP caching helpers shared by the stats API and the downtime tracker.
+
+ResponseCache keeps the serialized JSON body of an endpoint's latest
+snapshot, so requests for the same snapshot version reuse those bytes and
+their ETag instead of rebuilding the JSON (payload_codec.PayloadEncoder
+derives the MessagePack and delta variants from that body).
+json_response() serves a pre-serialized body in any of those encodings; a
+client (or CDN) that already has the current version gets an empty 304
+Not Modified.
+"""
+
+import hashlib
+import json
+import threading
+from contextlib import nullcontext
+
+from flask import Response, request
+
+
+class ResponseCache:
+    """Serialized body and ETag for the most recent snapshot version"""
+
+    def __init__(self, timer=None):
+        self._entry = None  # (version, body, etag)
+        self._lock = threading.Lock()
+        # Optional context-manager factory used to time cache misses
+        self._timer = timer or nullcontext
+
+    def peek(self, version):
+        """(body, etag) if `version` is already cached, else None; never builds"""
+        entry = self._entry
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+        return None
+
+    def put(self, version, body, etag):
+        """Adopt a body serialized elsewhere (e.g. by another worker) for `version`"""
+        self._entry = (version, body, etag)
+
+    def get(self, version, build):
+        """
+        Return (body, etag) for `version`, calling build() to produce the
+        payload only the first time that version is requested.
+        """
+        entry = self._entry
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[0] == version:
+                return entry[1], entry[2]
+            with self._timer():
+                body = json.dumps(build(), separators=(',', ':'), sort_keys=True).encode('utf-8')
+            # Content-derived, so workers serving the same snapshot agree on it
+            etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+            self._entry = (version, body, etag)
+            return body, etag
+
+
+def json_response(body, etag, max_age, mimetype='application/json', vary=None):
+    """Serve a pre-serialized body, or 304 if the client already has it"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    if vary:
+        response.vary.add(vary)
+    return response
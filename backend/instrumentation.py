@@ -0,0 +1,194 @@
+"""
+Prometheus/OpenMetrics instrumentation shared by the stats API and the
+downtime tracker.
+
+Counters and histograms are sharded per thread: each thread increments
+its own plain Python lists, with no lock and no shared cache line, and a
+scrape of /metrics sums the shards. Recording a request costs a couple of
+list index updates, so the instrumentation never becomes the hot path.
+When a thread exits its shard is folded into a retired total, so servers
+that start a thread per request keep a bounded number of shards.
+
+Usage:
+    metrics = Instrumentation('homeserver')
+    metrics.instrument_app(app)                     # per-route counts + latency
+    metrics.gauge('cpu_percent', 'CPU usage', fn)   # sampled at scrape time
+    with metrics.phase('db'):                       # per-phase latency breakdown
+        ...
+"""
+
+import bisect
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# Seconds; tuned for endpoints that should answer in well under 100 ms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _ShardOwner:
+    """Thread-local handle to a shard; it is freed, and the shard retired, when its thread exits"""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self):
+        self.shard = {}
+
+
+class ShardedHistogram:
+    """A labelled histogram whose observations go to per-thread shards"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = {}  # Live threads' shard dicts by id, for collection
+        self._retired = {}  # Observations of threads that have exited, already merged
+        self._shards_lock = threading.Lock()  # Only taken when a thread first records or exits
+
+    def _shard(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards[id(owner.shard)] = owner.shard
+            weakref.finalize(owner, self._retire, owner.shard)
+        return owner.shard
+
+    def _retire(self, shard):
+        """Fold an exited thread's shard into the retired total"""
+        with self._shards_lock:
+            del self._shards[id(shard)]
+            self._merge(self._retired, shard)
+
+    def _merge(self, into, shard):
+        for labels, series in list(shard.items()):
+            total = into.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(series):
+                total[i] += value
+
+    def observe(self, labels, value):
+        """Record one observation; `labels` is a tuple matching label_names"""
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # [per-bucket counts..., +Inf count, sum]
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        """Merge all shards into {labels: [cumulative bucket counts..., count, sum]}"""
+        merged = {}
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            self._merge(merged, self._retired)
+        for shard in shards:
+            self._merge(merged, shard)
+        for series in merged.values():
+            running = 0
+            for i in range(len(self.buckets) + 1):
+                running += series[i]
+                series[i] = running
+        return merged
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Instrumentation:
+    """Request/phase histograms plus scrape-time gauges for one Flask app"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.requests = ShardedHistogram(
+            f'{namespace}_request_duration_seconds',
+            'Request latency by route, method and status',
+            ('route', 'method', 'status')
+        )
+        self.phases = ShardedHistogram(
+            f'{namespace}_phase_duration_seconds',
+            'Time spent in each phase of request handling or sampling',
+            ('phase',)
+        )
+        self._gauges = []  # (name, help, fn)
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value is read by calling fn() at scrape time"""
+        self._gauges.append((f'{self.namespace}_{name}', help_text, fn))
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of work as one phase (e.g. 'sample', 'db', 'serialize')"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.observe((name,), time.perf_counter() - started)
+
+    def instrument_app(self, app, path='/metrics'):
+        """Time every request and expose the registry at `path`"""
+
+        @app.before_request
+        def _start_timer():
+            g._metrics_started = time.perf_counter()
+
+        @app.after_request
+        def _observe_request(response):
+            started = getattr(g, '_metrics_started', None)
+            if started is not None:
+                # url_rule keeps cardinality bounded (no raw paths or ids)
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                self.requests.observe(
+                    (route, request.method, str(response.status_code)),
+                    time.perf_counter() - started
+                )
+            return response
+
+        @app.route(path, methods=['GET'])
+        def metrics_endpoint():
+            return Response(self.render(), content_type=CONTENT_TYPE)
+
+    def _render_histogram(self, histogram, lines):
+        lines.append(f'# HELP {histogram.name} {histogram.help_text}')
+        lines.append(f'# TYPE {histogram.name} histogram')
+        for labels, series in sorted(histogram.collect().items()):
+            names = histogram.label_names
+            for bound, count in zip(histogram.buckets + ('+Inf',), series):
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'{histogram.name}_bucket{_format_labels(names, labels, ("le", le))} {count}')
+            lines.append(f'{histogram.name}_count{_format_labels(names, labels)} {series[-2]}')
+            lines.append(f'{histogram.name}_sum{_format_labels(names, labels)} {series[-1]}')
+
+    def render(self):
+        """Prometheus text exposition of every gauge and histogram"""
+        lines = []
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue  # A failing gauge shouldn't break the whole scrape
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {float(value)}')
+        self._render_histogram(self.requests, lines)
+        self._render_histogram(self.phases, lines)
+        return '\n'.join(lines) + '\n'
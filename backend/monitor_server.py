@@ -2,97 +2,433 @@
 Server Monitor Script
 This script monitors your main server and automatically triggers the downtime tracker.
 Run this on a separate service (like Render, Railway, or your local machine).
+
+Checks run on asyncio over one pooled keep-alive HTTP client, so a single
+process can watch many targets at once and a slow target never delays the
+others. By default only MAIN_SERVER_URL is watched; point
+MONITOR_TARGETS_FILE at a JSON list to watch a fleet:
+
+    [
+        {"name": "homeserver", "url": "https://stats.gowshik.online/api/homeserver",
+         "interval": 30, "timeout": 10, "jitter": 0.1, "notify_tracker": true},
+        {"name": "portfolio", "url": "https://gowshik.online/", "interval": 60}
+    ]
+
+Only targets with "notify_tracker": true report to the downtime tracker.
+
+A single failed check doesn't mark a target down. It must fail
+FAILURES_TO_DOWN of the last WINDOW_SIZE checks, and it must then pass
+SUCCESSES_TO_UP checks in a row to come back. When a check flips the
+current verdict, a short burst of re-probes confirms it right away, so
+real outages are still caught within seconds rather than after several
+full intervals. Any of these can be overridden per target in the JSON
+file ("failures_to_down", "window_size", "successes_to_up",
+"degraded_latency_ms", ...).
+
+Transitions are not sent to the tracker directly. They are written to a
+small on-disk outbox (SQLite) first, each with an idempotency key and
+the time the outage actually started or ended. A delivery task posts
+them in order and in batches to the tracker's /events endpoint, backing
+off exponentially while the tracker is unreachable. An outage is never
+lost because the tracker was cold-starting, and a restart of the
+monitor resumes delivery where it stopped.
 """
 
-import requests
+import asyncio
+import json
+import os
+import random
+import sqlite3
 import time
-from datetime import datetime
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import aiohttp
 
 # Configuration
 MAIN_SERVER_URL = 'https://stats.gowshik.online/api/homeserver'
 DOWNTIME_TRACKER_URL = 'https://your-downtime-tracker.onrender.com/api/downtime'
 CHECK_INTERVAL = 30  # Check every 30 seconds
+CHECK_TIMEOUT = 10  # Seconds before a check counts as failed
+CHECK_JITTER = 0.1  # Randomize each interval by up to +/-10% to avoid synchronized bursts
+MONITOR_TARGETS_FILE = os.environ.get('MONITOR_TARGETS_FILE')
+MAX_CONNECTIONS = int(os.environ.get('MONITOR_MAX_CONNECTIONS', '100'))  # Shared pool size
+REPORT_INTERVAL = 300  # Print a latency summary every 5 minutes
 
-# State tracking
-last_status = None
+# Detection thresholds
+FAILURES_TO_DOWN = 3  # Failed checks (out of WINDOW_SIZE) before declaring DOWN
+WINDOW_SIZE = 5  # Sliding window of recent checks used for FAILURES_TO_DOWN
+SUCCESSES_TO_UP = 2  # Consecutive successful checks before declaring UP again
+DEGRADED_LATENCY_MS = None  # Optional: responses slower than this count as DEGRADED
+REPROBE_COUNT = 3  # Quick re-checks fired when a check disagrees with the current state
+REPROBE_DELAY = 2  # Seconds between re-probes
 
+# Tracker delivery
+OUTBOX_PATH = os.environ.get(
+    'MONITOR_OUTBOX_PATH',
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'monitor_outbox.db')
+)
+OUTBOX_BATCH_SIZE = 100  # Events per POST to the tracker
+DELIVERY_INTERVAL = 5  # Seconds between delivery attempts when nothing new arrives
+RETRY_BASE_DELAY = 2  # First retry after 2s, doubling each failure...
+RETRY_MAX_DELAY = 300  # ...up to 5 minutes
 
-def check_server_status():
-    """Check if the main server is online"""
-    try:
-        response = requests.get(MAIN_SERVER_URL, timeout=10)
-        if response.status_code == 200:
-            return True
-        return False
-    except requests.exceptions.RequestException as e:
-        print(f"[{datetime.now()}] Server check failed: {e}")
-        return False
+# Target states
+UP = 'up'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+
+class Target:
+    """A monitored endpoint, its detection state machine and latest check results"""
+
+    def __init__(self, name, url, interval=CHECK_INTERVAL, timeout=CHECK_TIMEOUT,
+                 jitter=CHECK_JITTER, notify_tracker=False,
+                 failures_to_down=FAILURES_TO_DOWN, window_size=WINDOW_SIZE,
+                 successes_to_up=SUCCESSES_TO_UP, degraded_latency_ms=DEGRADED_LATENCY_MS,
+                 reprobe_count=REPROBE_COUNT, reprobe_delay=REPROBE_DELAY):
+        self.name = name
+        self.url = url
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self.jitter = float(jitter)
+        self.notify_tracker = notify_tracker
+
+        self.failures_to_down = failures_to_down
+        self.successes_to_up = successes_to_up
+        self.degraded_latency_ms = degraded_latency_ms
+        self.reprobe_count = reprobe_count
+        self.reprobe_delay = float(reprobe_delay)
+
+        # State tracking
+        self.state = None  # None until the first verdict, then UP / DEGRADED / DOWN
+        # (passed, checked_at) for the last few checks
+        self.recent = deque(maxlen=max(window_size, failures_to_down))
+        self.consecutive_successes = 0
+        self.success_streak_started = None  # When the current run of successes began
+        self.last_latency_ms = None
+        self.avg_latency_ms = None  # Exponentially weighted moving average
+        self.checks = 0
+        self.failures = 0
+
+    @property
+    def last_status(self):
+        """True/False/None view of the state, as used by the tracker triggers"""
+        if self.state is None:
+            return None
+        return self.state != DOWN
+
+    def record(self, is_online, latency_ms, checked_at=None):
+        """Store the outcome of one check"""
+        checked_at = checked_at or datetime.now(timezone.utc)
+        self.checks += 1
+        self.recent.append((is_online, checked_at))
+        if not is_online:
+            self.failures += 1
+            self.consecutive_successes = 0
+            return
+        if self.consecutive_successes == 0:
+            self.success_streak_started = checked_at
+        self.consecutive_successes += 1
+        self.last_latency_ms = latency_ms
+        if self.avg_latency_ms is None:
+            self.avg_latency_ms = latency_ms
+        else:
+            self.avg_latency_ms += 0.2 * (latency_ms - self.avg_latency_ms)
+
+    def evaluate(self):
+        """Apply the thresholds to the recent checks; returns the new state"""
+        failures = sum(1 for passed, _ in self.recent if not passed)
+        if self.state is None:
+            # First verdict: trust the first check so startup isn't delayed
+            return DOWN if self.recent and not self.recent[-1][0] else self._up_state()
+        if self.state == DOWN:
+            return self._up_state() if self.consecutive_successes >= self.successes_to_up else DOWN
+        if failures >= self.failures_to_down:
+            return DOWN
+        return self._up_state()
 
+    def _up_state(self):
+        """UP, or DEGRADED when the latency average is above the threshold"""
+        if (self.degraded_latency_ms is not None and self.avg_latency_ms is not None
+                and self.avg_latency_ms > self.degraded_latency_ms):
+            return DEGRADED
+        return UP
 
-def trigger_offline():
-    """Notify downtime tracker that server is offline"""
+    def needs_confirmation(self):
+        """True when the latest check disagrees with the current verdict"""
+        if self.state is None or not self.recent:
+            return False
+        return self.recent[-1][0] == (self.state == DOWN)
+
+    def transition_time(self):
+        """
+        When the current state really began: the first failure of the
+        trailing run of failed checks for DOWN, the start of the success
+        streak for UP.
+        """
+        if self.state == DOWN:
+            started = None
+            for passed, at in reversed(self.recent):
+                if passed:
+                    break
+                started = at
+            return started or datetime.now(timezone.utc)
+        return self.success_streak_started or datetime.now(timezone.utc)
+
+
+class Outbox:
+    """
+    Durable FIFO of tracker notifications.
+    Delivery is strictly in order: while the oldest event is backing off,
+    nothing behind it is sent, so the tracker never sees 'online' before
+    the 'offline' it closes.
+    """
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                type TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                source TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        self.wakeup = asyncio.Event()
+
+    def enqueue(self, event_type, occurred_at, source='monitor'):
+        """Persist a transition and wake the delivery task"""
+        event_id = str(uuid.uuid4())
+        self.conn.execute(
+            'INSERT INTO outbox (id, type, timestamp, source) VALUES (?, ?, ?, ?)',
+            (event_id, event_type, occurred_at.isoformat(), source)
+        )
+        self.wakeup.set()
+        return event_id
+
+    def pending(self):
+        return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def due_batch(self, now, limit=OUTBOX_BATCH_SIZE):
+        """The oldest events, or nothing if the head of the queue is backing off"""
+        rows = self.conn.execute(
+            'SELECT seq, id, type, timestamp, source, attempts, next_attempt FROM outbox ORDER BY seq LIMIT ?',
+            (limit,)
+        ).fetchall()
+        if not rows or rows[0][6] > now:
+            return []
+        return rows
+
+    def mark_delivered(self, seqs):
+        self.conn.executemany('DELETE FROM outbox WHERE seq = ?', [(seq,) for seq in seqs])
+
+    def mark_failed(self, rows, now):
+        """Schedule a retry with exponential backoff and jitter"""
+        attempts = rows[0][5] + 1
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        delay *= random.uniform(0.8, 1.2)
+        self.conn.executemany(
+            'UPDATE outbox SET attempts = ?, next_attempt = ? WHERE seq = ?',
+            [(attempts, now + delay, row[0]) for row in rows]
+        )
+        return delay
+
+
+def load_targets():
+    """Load targets from MONITOR_TARGETS_FILE, or watch MAIN_SERVER_URL alone"""
+    if not MONITOR_TARGETS_FILE:
+        return [Target('main', MAIN_SERVER_URL, notify_tracker=True)]
+
+    with open(MONITOR_TARGETS_FILE) as f:
+        entries = json.load(f)
+    return [
+        Target(
+            entry.get('name', entry['url']),
+            entry['url'],
+            interval=entry.get('interval', CHECK_INTERVAL),
+            timeout=entry.get('timeout', CHECK_TIMEOUT),
+            jitter=entry.get('jitter', CHECK_JITTER),
+            notify_tracker=entry.get('notify_tracker', False),
+            failures_to_down=entry.get('failures_to_down', FAILURES_TO_DOWN),
+            window_size=entry.get('window_size', WINDOW_SIZE),
+            successes_to_up=entry.get('successes_to_up', SUCCESSES_TO_UP),
+            degraded_latency_ms=entry.get('degraded_latency_ms', DEGRADED_LATENCY_MS),
+            reprobe_count=entry.get('reprobe_count', REPROBE_COUNT),
+            reprobe_delay=entry.get('reprobe_delay', REPROBE_DELAY)
+        )
+        for entry in entries
+    ]
+
+
+async def check_server_status(session, target):
+    """Check if a target is online; returns (is_online, latency_ms)"""
+    started = time.perf_counter()
     try:
-        response = requests.post(f'{DOWNTIME_TRACKER_URL}/trigger-offline', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            print(f"[{datetime.now()}] ✗ Server OFFLINE - Downtime tracking started")
-            print(f"    Offline since: {data.get('offline_since')}")
-        return True
-    except Exception as e:
-        print(f"[{datetime.now()}] Failed to trigger offline: {e}")
-        return False
+        timeout = aiohttp.ClientTimeout(total=target.timeout)
+        async with session.get(target.url, timeout=timeout) as response:
+            # Drain the body so the connection goes back to the pool
+            await response.read()
+            latency_ms = (time.perf_counter() - started) * 1000
+            return response.status == 200, latency_ms
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[{datetime.now()}] {target.name} check failed: {e!r}")
+        return False, (time.perf_counter() - started) * 1000
 
 
-def trigger_online():
-    """Notify downtime tracker that server is back online"""
+async def deliver_batch(session, rows):
+    """POST one batch to the tracker's bulk endpoint; returns True if it was accepted"""
+    events = [
+        {'id': event_id, 'type': event_type, 'timestamp': timestamp, 'source': source}
+        for _, event_id, event_type, timestamp, source, _, _ in rows
+    ]
     try:
-        response = requests.post(f'{DOWNTIME_TRACKER_URL}/trigger-online', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            print(f"[{datetime.now()}] ✓ Server ONLINE - Downtime tracking stopped")
-            print(f"    Downtime duration: {data.get('downtime_duration_seconds', 0):.0f}s")
-            print(f"    Total downtime: {data.get('total_downtime_seconds', 0):.0f}s")
-        return True
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with session.post(f'{DOWNTIME_TRACKER_URL}/events',
+                                json={'events': events}, timeout=timeout) as response:
+            if response.status == 400:
+                # Retrying a malformed batch can never succeed; don't block the queue on it
+                print(f"[{datetime.now()}] Tracker rejected {len(events)} event(s): {await response.text()}")
+                return True
+            if response.status != 200:
+                print(f"[{datetime.now()}] Tracker returned HTTP {response.status}")
+                return False
+            data = await response.json()
     except Exception as e:
-        print(f"[{datetime.now()}] Failed to trigger online: {e}")
+        print(f"[{datetime.now()}] Failed to reach tracker: {e!r}")
         return False
 
+    for event in events:
+        result = data.get('results', {}).get(event['id'])
+        if result == 'applied':
+            label = '✗ Server OFFLINE' if event['type'] == 'offline' else '✓ Server ONLINE'
+            print(f"[{datetime.now()}] {label} recorded by tracker (at {event['timestamp']})")
+    print(f"    Total downtime: {data.get('total_downtime_seconds', 0):.0f}s")
+    return True
+
+
+async def delivery_loop(session, outbox):
+    """Drain the outbox to the tracker, in order, with backoff on failure"""
+    while True:
+        try:
+            await asyncio.wait_for(outbox.wakeup.wait(), timeout=DELIVERY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        outbox.wakeup.clear()
+
+        try:
+            while True:
+                rows = outbox.due_batch(time.time())
+                if not rows:
+                    break
+                if not await deliver_batch(session, rows):
+                    delay = outbox.mark_failed(rows, time.time())
+                    print(f"[{datetime.now()}] {outbox.pending()} event(s) queued; retrying in {delay:.0f}s")
+                    break
+                outbox.mark_delivered([row[0] for row in rows])
+        except Exception as e:
+            print(f"[{datetime.now()}] Unexpected delivery error: {e}")
+
+
+def handle_status(outbox, target, new_state):
+    """React to a state change for one target"""
+    previous_status = target.last_status
+    previous_state = target.state
+    target.state = new_state
+
+    if previous_state is None or new_state == previous_state:
+        return
+
+    print(f"[{datetime.now()}] {target.name} is {new_state.upper()} (was {previous_state})")
+    # Only UP <-> DOWN matters to the tracker; DEGRADED still counts as online
+    if target.notify_tracker and target.last_status != previous_status:
+        # Stamp the event with when the change really happened, not when it was confirmed
+        event_type = 'online' if target.last_status else 'offline'
+        outbox.enqueue(event_type, target.transition_time())
+
+    if previous_state == DOWN:
+        # Start the failure window fresh so old failures can't re-trip it
+        target.recent.clear()
+
+
+async def probe(session, outbox, target):
+    """Run one check, record it and evaluate the state machine"""
+    is_online, latency_ms = await check_server_status(session, target)
+    target.record(is_online, latency_ms)
+    handle_status(outbox, target, target.evaluate())
+
+
+async def watch_target(session, outbox, target):
+    """Check one target forever on its own fixed cadence"""
+    # Spread the first checks out so a large fleet doesn't fire all at once
+    await asyncio.sleep(random.uniform(0, target.interval * target.jitter))
+    next_check = time.monotonic()
+
+    while True:
+        try:
+            await probe(session, outbox, target)
+            # A check that disagrees with the verdict triggers a quick burst of
+            # re-probes, so thresholds are met in seconds instead of intervals
+            for _ in range(target.reprobe_count):
+                if not target.needs_confirmation():
+                    break
+                await asyncio.sleep(target.reprobe_delay)
+                await probe(session, outbox, target)
+        except Exception as e:
+            print(f"[{datetime.now()}] Unexpected error checking {target.name}: {e}")
+
+        # Schedule from the previous deadline so slow checks don't cause drift
+        next_check += target.interval * (1 + random.uniform(-target.jitter, target.jitter))
+        await asyncio.sleep(max(next_check - time.monotonic(), 0))
+
+
+async def report_loop(targets):
+    """Periodically print per-target status and latency"""
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        print(f"[{datetime.now()}] Status of {len(targets)} target(s):")
+        for target in targets:
+            state = (target.state or '?').upper() if target.state != UP else 'up'
+            latency = f"{target.avg_latency_ms:.0f}ms" if target.avg_latency_ms is not None else '—'
+            print(f"    {target.name:<24} {state:<8} avg {latency:>7}  "
+                  f"failures {target.failures}/{target.checks}")
+
+
+async def run(targets):
+    """Watch all targets concurrently over one pooled client session"""
+    outbox = Outbox()
+    if outbox.pending():
+        print(f"[{datetime.now()}] Resuming delivery of {outbox.pending()} queued event(s)")
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(
+            report_loop(targets),
+            delivery_loop(session, outbox),
+            *(watch_target(session, outbox, target) for target in targets)
+        )
+
 
 def main():
     """Main monitoring loop"""
-    global last_status
-    
+    targets = load_targets()
+
     print(f"[{datetime.now()}] Starting server monitor...")
-    print(f"  Main server: {MAIN_SERVER_URL}")
+    print(f"  Targets: {len(targets)}")
+    for target in targets[:10]:
+        print(f"    {target.name}: {target.url} (every {target.interval:.0f}s)")
     print(f"  Downtime tracker: {DOWNTIME_TRACKER_URL}")
-    print(f"  Check interval: {CHECK_INTERVAL}s")
     print("-" * 60)
-    
-    while True:
-        try:
-            current_status = check_server_status()
-            
-            # Detect status change
-            if last_status is not None and current_status != last_status:
-                if not current_status:
-                    # Server went offline
-                    trigger_offline()
-                else:
-                    # Server came back online
-                    trigger_online()
-            
-            # Update last status
-            last_status = current_status
-            
-            # Wait before next check
-            time.sleep(CHECK_INTERVAL)
-            
-        except KeyboardInterrupt:
-            print(f"\n[{datetime.now()}] Monitor stopped by user")
-            break
-        except Exception as e:
-            print(f"[{datetime.now()}] Unexpected error: {e}")
-            time.sleep(CHECK_INTERVAL)
+
+    try:
+        asyncio.run(run(targets))
+    except KeyboardInterrupt:
+        print(f"\n[{datetime.now()}] Monitor stopped by user")
 
 
 if __name__ == '__main__':
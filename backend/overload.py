@@ -0,0 +1,137 @@
+"""
+Overload protection for the public downtime tracker.
+
+TokenBucketLimiter
+    Per-client token buckets in a bounded LRU. A client can burst up to
+    `burst` requests and then gets `rate` per second. Idle clients are
+    evicted oldest first once `max_clients` is reached, so a flood of
+    spoofed or rotating addresses costs bounded memory. An evicted client
+    simply starts again with a full bucket.
+SingleFlight
+    Concurrent calls with the same key share one execution: the first
+    caller runs the function and the rest wait for its result. A burst of
+    identical triggers becomes one state transition.
+TimeSliceCache
+    One computed value per time slice. Concurrent readers inside a slice
+    share the value (and wait for the single computation in flight) instead
+    of each hitting the store.
+
+All three are per process; the store stays the source of truth across
+workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets with LRU eviction"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected_total = 0
+        self._buckets = OrderedDict()  # key -> [tokens, last refill], least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now=None):
+        """(allowed, retry_after_seconds) for one request from `key`"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            self.rejected_total += 1
+            return False, (1 - bucket[0]) / self.rate
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.collapsed_total = 0
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call for `key` is already in flight; either way
+        return (its result, shared), where shared is True for callers that
+        only waited on another caller's run.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.collapsed_total += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+
+class TimeSliceCache:
+    """The value of compute(), recomputed at most once per `slice_seconds` (0 disables)"""
+
+    def __init__(self, compute, slice_seconds):
+        self.compute = compute
+        self.slice_seconds = slice_seconds
+        self._entry = None  # (slice, generation, value)
+        self._generation = 0
+        self._flight = SingleFlight()
+
+    def get(self):
+        if self.slice_seconds <= 0:
+            return self.compute()
+        key = (int(time.monotonic() / self.slice_seconds), self._generation)
+        entry = self._entry
+        if entry is not None and entry[:2] == key:
+            return entry[2]
+        return self._flight.do(key, lambda: self._refresh(key))[0]
+
+    def _refresh(self, key):
+        entry = self._entry
+        if entry is not None and entry[:2] == key:
+            return entry[2]  # Filled by the previous flight while we queued
+        value = self.compute()
+        if key[1] == self._generation:
+            self._entry = (*key, value)
+        return value
+
+    def invalidate(self):
+        """Drop the cached value, e.g. after this process changed the state"""
+        self._generation += 1
+        self._entry = None
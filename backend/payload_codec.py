@@ -0,0 +1,230 @@
+"""
+Compact encodings of the stats payload: MessagePack and deltas.
+
+Plain JSON stays the default; clients opt in per request.
+
+    Accept: application/msgpack   (or ?format=msgpack)
+        The same payload, MessagePack-encoded. Needs the optional msgpack
+        package; without it every client gets JSON.
+
+    ?since=<version>   (delta mode)
+        Only what changed since the snapshot the client already has:
+        {"delta": true, "version": v, "base": <since or null>,
+         "changed": {...}, "removed": [[key, ...], ...]}
+        Nested objects are diffed key by key; everything else (numbers,
+        strings, lists) is replaced whole. Start with an empty `since=` and
+        send back each response's `version`. A null base means the client's
+        version was too old to be remembered, and `changed` is the full
+        payload, to be applied to an empty object.
+
+Streams use the same choices: ?delta=1 turns every event after the first
+into a delta against the previous one, and a MessagePack stream is a plain
+sequence of MessagePack objects (a nil object is a keepalive) instead of
+Server-Sent Events. Each tick is encoded once per variant that has
+subscribers, however many clients share it.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from event_stream import EventBroadcaster
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+CONTENT_TYPES = {'json': JSON_TYPE, 'msgpack': MSGPACK_TYPE}
+
+
+def negotiate(accept=None, format_param=None):
+    """
+    'msgpack' if the client asked for it (explicitly via ?format=, or by
+    ranking a MessagePack type at least as high as JSON in Accept) and
+    msgpack is installed; 'json' otherwise.
+    """
+    if msgpack is None:
+        return 'json'
+    if format_param:
+        return 'msgpack' if format_param.lower() == 'msgpack' else 'json'
+    json_q = msgpack_q = 0.0
+    for part in (accept or '').split(','):
+        media_type, *params = part.split(';')
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in (JSON_TYPE, 'application/*', '*/*'):
+            json_q = max(json_q, q)
+    return 'msgpack' if msgpack_q > 0 and msgpack_q >= json_q else 'json'
+
+
+def encode(payload, fmt):
+    if fmt == 'msgpack':
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def diff(old, new):
+    """(changed, removed) turning `old` into `new`; see the module docstring for the shape"""
+    changed = {}
+    removed = []
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested_changed, nested_removed = diff(old[key], value)
+            if nested_changed:
+                changed[key] = nested_changed
+            removed.extend([key, *path] for path in nested_removed)
+        elif old[key] != value:
+            changed[key] = value
+    removed.extend([key] for key in old if key not in new)
+    return changed, removed
+
+
+def delta_payload(version, base, old, new):
+    """Delta envelope from snapshot `base` (payload `old`, or None if unknown) to `version`"""
+    if old is None:
+        changed, removed = new, []
+    else:
+        changed, removed = diff(old, new)
+    return {'delta': True, 'version': version, 'base': base, 'changed': changed, 'removed': removed}
+
+
+class PayloadEncoder:
+    """
+    Alternate encodings of the JSON bodies a ResponseCache serves.
+    Remembers the last `depth` payloads by version (the body's ETag) so a
+    delta can be taken against any of them. Each variant of the current
+    snapshot (format, delta base) is encoded once and then reused.
+    """
+
+    def __init__(self, depth=32):
+        self.depth = depth
+        self._payloads = OrderedDict()  # version -> decoded payload, oldest first
+        self._variants = {}  # (base, fmt) -> (body, etag), for the current version only
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _remember(self, body, version):
+        payload = self._payloads.get(version)
+        if payload is None:
+            payload = self._payloads[version] = json.loads(body)
+            while len(self._payloads) > self.depth:
+                self._payloads.popitem(last=False)
+        return payload
+
+    def encode(self, body, version, fmt='json', since=None):
+        """
+        (body, etag, content_type) for the JSON `body` of snapshot `version`
+        in `fmt`; a delta against `since` unless that is None. Plain JSON
+        passes through untouched.
+        """
+        if fmt == 'json' and since is None:
+            return body, version, JSON_TYPE
+        with self._lock:
+            if version != self._current:
+                self._variants = {}
+                self._current = version
+            payload = self._remember(body, version)
+            base = since if since in self._payloads else None
+            variant = self._variants.get((base, fmt))
+            if variant is None:
+                if since is None:
+                    encoded = encode(payload, fmt)
+                    etag = f'{version}-{fmt}'
+                else:
+                    old = self._payloads.get(base)
+                    encoded = encode(delta_payload(version, base, old, payload), fmt)
+                    etag = f'{version}-{base or "full"}-{fmt}'
+                variant = self._variants[(base, fmt)] = (encoded, etag)
+        return variant[0], variant[1], CONTENT_TYPES[fmt]
+
+
+class BinaryBroadcaster(EventBroadcaster):
+    """EventBroadcaster for a stream of MessagePack objects rather than SSE messages"""
+
+    KEEPALIVE = b'\xc0'  # MessagePack nil
+
+    @staticmethod
+    def format_message(data, event=None):
+        return data
+
+    def preamble(self):
+        return self.KEEPALIVE
+
+
+class StreamVariants:
+    """
+    One broadcaster per stream variant (format, delta). publish() encodes a
+    tick once for each variant that has subscribers; deltas are taken
+    against the previous tick this process published.
+    """
+
+    def __init__(self, queue_size=8):
+        self.broadcasters = {
+            ('json', False): EventBroadcaster(queue_size=queue_size),
+            ('json', True): EventBroadcaster(queue_size=queue_size),
+            ('msgpack', False): BinaryBroadcaster(queue_size=queue_size),
+            ('msgpack', True): BinaryBroadcaster(queue_size=queue_size)
+        }
+        self._previous = None  # (version, payload) of the last tick published, if it was decoded
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self):
+        return sum(broadcaster.subscriber_count for broadcaster in self.broadcasters.values())
+
+    @staticmethod
+    def _message(payload, fmt):
+        encoded = encode(payload, fmt)
+        return encoded if fmt == 'msgpack' else encoded.decode('utf-8')
+
+    def publish(self, body, version):
+        """Relay the JSON `body` of snapshot `version` to every variant with subscribers"""
+        with self._lock:
+            active = [(key, broadcaster) for key, broadcaster in self.broadcasters.items()
+                      if broadcaster.subscriber_count]
+            payload = None
+            if any(key != ('json', False) for key, _ in active):
+                payload = json.loads(body)
+            previous = self._previous
+            self._previous = (version, payload) if payload is not None else None
+
+            for (fmt, delta), broadcaster in active:
+                if (fmt, delta) == ('json', False):
+                    broadcaster.publish(body.decode('utf-8'))
+                elif delta:
+                    base, old = previous or (None, None)
+                    broadcaster.publish(self._message(delta_payload(version, base, old, payload), fmt))
+                else:
+                    broadcaster.publish(self._message(payload, fmt))
+
+    def open(self, fmt, delta, current):
+        """
+        (broadcaster, initial) for a new subscriber. `current()` returns the
+        latest (body, version) and is only called once the subscriber is
+        registered, so no tick in between is missed.
+        """
+        broadcaster = self.broadcasters[(fmt, delta)]
+
+        def initial():
+            body, version = current()
+            if (fmt, delta) == ('json', False):
+                return body.decode('utf-8')
+            payload = json.loads(body)
+            return self._message(delta_payload(version, None, None, payload) if delta else payload, fmt)
+
+        return broadcaster, initial
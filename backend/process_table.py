@@ -0,0 +1,94 @@
+"""
+Cached per-process resource table for /api/homeserver/processes.
+
+The table is refreshed from the sampler thread (at most every
+refresh_interval seconds), never from a request. psutil.process_iter()
+hands back the same Process object for a pid on every pass, so
+cpu_percent(interval=None) measures the time since the previous refresh
+without blocking. Requests only slice lists that were pre-sorted at
+refresh time.
+
+Only names and resource counters are exposed. Command lines, environment
+and paths are never read, since they can contain secrets.
+"""
+
+import time
+
+import psutil
+
+# Rows per sort key that top() can ever return (and that export() shares)
+MAX_TOP = 100
+
+# Fields read per process in one oneshot() pass; cmdline/environ deliberately absent
+PROCESS_ATTRS = ['pid', 'name', 'username', 'cpu_percent', 'memory_percent',
+                 'memory_info', 'num_threads', 'status']
+
+# Sort keys accepted by top()
+SORT_KEYS = {
+    'cpu': 'cpu_percent',
+    'memory': 'memory_percent',
+    'rss': 'rss_bytes',
+    'threads': 'num_threads'
+}
+
+
+class ProcessTable:
+    """Periodically refreshed snapshot of the host's processes"""
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = None  # Unix time of the last refresh
+        self.total = 0
+        self._sorted = {}  # sort key -> rows, highest first
+        self._last_refresh = 0.0
+
+    def refresh(self, now=None):
+        """Re-read the process table if refresh_interval has passed"""
+        now = now or time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return False
+        self._last_refresh = now
+
+        rows = []
+        for proc in psutil.process_iter(PROCESS_ATTRS, ad_value=None):
+            info = proc.info
+            memory = info.get('memory_info')
+            rows.append({
+                'pid': info['pid'],
+                'name': info.get('name'),
+                'username': info.get('username'),
+                'cpu_percent': info.get('cpu_percent') or 0.0,
+                'memory_percent': round(info.get('memory_percent') or 0.0, 2),
+                'rss_bytes': memory.rss if memory else 0,
+                'num_threads': info.get('num_threads') or 0,
+                'status': info.get('status')
+            })
+
+        # Swap in complete results so readers never see a half-built table
+        self._sorted = {
+            key: sorted(rows, key=lambda row, field=field: row[field], reverse=True)
+            for key, field in SORT_KEYS.items()
+        }
+        self.total = len(rows)
+        self.refreshed_at = time.time()
+        return True
+
+    def top(self, n=10, sort='cpu'):
+        """The n heaviest processes by `sort` (one of SORT_KEYS)"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+        return self._sorted.get(sort, [])[:min(n, MAX_TOP)]
+
+    def export(self):
+        """The servable part of the table, for workers that don't sample themselves"""
+        return {
+            'sorted': {key: rows[:MAX_TOP] for key, rows in self._sorted.items()},
+            'total': self.total,
+            'refreshed_at': self.refreshed_at
+        }
+
+    def load(self, exported):
+        """Replace the table with one produced by export() in another process"""
+        self._sorted = exported['sorted']
+        self.total = exported['total']
+        self.refreshed_at = exported['refreshed_at']
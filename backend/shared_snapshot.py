@@ -0,0 +1,128 @@
+"""
+Latest metrics snapshot shared between gunicorn workers through memory.
+
+One worker wins an exclusive flock and becomes the collector. It samples
+psutil, serializes the stats payload and writes the result into a
+memory-mapped segment on tmpfs. The other workers map the same segment
+and read it. A reader whose last-seen sequence number is still current
+just compares 8 bytes in shared memory: no syscalls, no JSON. When the
+collector dies its flock is released and the next worker to try takes
+over.
+
+Writes use a seqlock: the sequence number is odd while a write is in
+progress and even when it is done. A reader retries if the number was
+odd, or if it changed while the reader was copying.
+
+multiprocessing.shared_memory isn't used because its resource tracker
+(before Python 3.13) unlinks the segment when whichever worker attached
+first exits. A file under /dev/shm is the same memory without that
+catch.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+# seq, sampled_at, processes_at, body/snapshot/processes lengths, etag
+HEADER = struct.Struct('<Qddiii24s')
+SEQ = struct.Struct('<Q')
+
+SharedView = namedtuple('SharedView', 'seq sampled_at processes_at etag body snapshot processes')
+
+
+def default_path(name):
+    """tmpfs-backed location for a segment named `name` (falls back to the temp dir)"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else os.environ.get('TMPDIR', '/tmp')
+    return os.path.join(directory, name)
+
+
+class SharedSnapshot:
+    """Single-writer, many-reader segment holding the latest serialized snapshot"""
+
+    def __init__(self, path, size=1 << 20):
+        self.path = path
+        self.size = size
+        self.is_collector = False
+        self._map = None
+        self._pid = None
+        self._lock_file = None
+
+    def _ensure_open(self):
+        # A mapping inherited over fork still works, but the flock must be per process
+        if self._map is not None and self._pid == os.getpid():
+            return
+        with open(self.path, 'a+b') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.size:
+                f.truncate(self.size)
+            self._map = mmap.mmap(f.fileno(), self.size)
+        self._pid = os.getpid()
+        self.is_collector = False
+        self._lock_file = None
+
+    # ---- collector election ----
+    def try_become_collector(self):
+        """Take the collector role if no live process holds it (non-blocking)"""
+        self._ensure_open()
+        if self.is_collector:
+            return True
+        lock_file = open(f'{self.path}.lock', 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held (and the fd kept open) for the life of the process
+        self._lock_file = lock_file
+        self.is_collector = True
+        return True
+
+    # ---- writing ----
+    def write(self, sampled_at, etag, body, snapshot, processes_at, processes):
+        """Publish a new snapshot (collector only); all payloads are bytes"""
+        length = HEADER.size + len(body) + len(snapshot) + len(processes)
+        if length > self.size:
+            raise ValueError(f'snapshot of {length} bytes does not fit in {self.size} bytes')
+        seq = SEQ.unpack_from(self._map, 0)[0]
+        seq += 2 if seq % 2 == 0 else 1  # Recover from a writer that died mid-write
+        SEQ.pack_into(self._map, 0, seq - 1)  # Odd: write in progress
+        offset = HEADER.size
+        for part in (body, snapshot, processes):
+            self._map[offset:offset + len(part)] = part
+            offset += len(part)
+        HEADER.pack_into(self._map, 0, seq - 1, sampled_at, processes_at,
+                         len(body), len(snapshot), len(processes), etag.encode('ascii'))
+        SEQ.pack_into(self._map, 0, seq)  # Even: consistent again
+
+    # ---- reading ----
+    def read(self, last_seq=0, last_processes_at=None, retries=100):
+        """
+        The current snapshot, or None if nothing newer than `last_seq` has
+        been published. The process table is only copied when it changed
+        since `last_processes_at` (otherwise `processes` is None).
+        """
+        self._ensure_open()
+        for _ in range(retries):
+            seq = SEQ.unpack_from(self._map, 0)[0]
+            if seq == last_seq or seq == 0:
+                return None
+            if seq % 2:
+                time.sleep(0)  # Writer mid-update; let it finish
+                continue
+            (_, sampled_at, processes_at, body_len, snapshot_len,
+             processes_len, etag) = HEADER.unpack_from(self._map, 0)
+            offset = HEADER.size
+            body = self._map[offset:offset + body_len]
+            offset += body_len
+            snapshot = self._map[offset:offset + snapshot_len]
+            offset += snapshot_len
+            processes = None
+            if processes_at != last_processes_at:
+                processes = self._map[offset:offset + processes_len]
+            if SEQ.unpack_from(self._map, 0)[0] == seq:
+                return SharedView(seq, sampled_at, processes_at, etag.decode('ascii'),
+                                  body, snapshot, processes)
+        return None
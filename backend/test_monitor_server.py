@@ -0,0 +1,38 @@
+"""Detection state machine of monitor_server.Target (run with `python -m pytest`)"""
+
+from datetime import datetime, timedelta, timezone
+
+from monitor_server import DOWN, UP, Target, handle_status
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.events = []
+
+    def enqueue(self, event_type, occurred_at, source='monitor'):
+        self.events.append((event_type, occurred_at))
+
+
+def run_checks(target, outbox, checks):
+    for passed, offset in checks:
+        target.record(passed, 10.0, START + timedelta(seconds=offset))
+        handle_status(outbox, target, target.evaluate())
+
+
+def test_offline_stamped_at_start_of_trailing_failures():
+    target = Target('web', 'http://example.invalid', notify_tracker=True)
+    outbox = RecordingOutbox()
+    run_checks(target, outbox, [(True, -30), (False, 0), (True, 30), (True, 60), (False, 90), (False, 92)])
+    assert target.state == DOWN
+    assert outbox.events == [('offline', START + timedelta(seconds=90))]
+
+
+def test_online_stamped_at_start_of_success_streak():
+    target = Target('web', 'http://example.invalid', notify_tracker=True)
+    outbox = RecordingOutbox()
+    run_checks(target, outbox, [(True, 0), (False, 10), (False, 20), (False, 30), (True, 40), (True, 50)])
+    assert target.state == UP
+    assert outbox.events == [('offline', START + timedelta(seconds=10)),
+                             ('online', START + timedelta(seconds=40))]
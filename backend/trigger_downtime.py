@@ -1,18 +1,45 @@
 """
 Manual trigger script for downtime tracker
-Use this to manually mark your server as offline or online
+Use this to manually mark your server as offline or online,
+and to move outage and metrics history between instances:
+
+    python trigger_downtime.py export outages -o outages.ndjson
+    IMPORT_TOKEN=... python trigger_downtime.py import outages outages.ndjson --url http://new-host:5001/api/downtime
+    python trigger_downtime.py export metrics --format csv --table metric_rollup -o rollups.csv
+
+Exports are streamed to the file as the service sends them and imports are
+read and sent a batch at a time, so history of any size runs in constant
+memory. Imports need the target service's IMPORT_TOKEN (--token, or the
+IMPORT_TOKEN environment variable). All calls share one keep-alive session.
 """
 
-import requests
+import argparse
+import csv
+import json
+import os
 import sys
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DOWNTIME_TRACKER_URL = os.environ.get('DOWNTIME_TRACKER_URL', 'https://portfolio-blry.onrender.com/api/downtime')
+HOMESERVER_URL = os.environ.get('HOMESERVER_URL', 'http://localhost:8487/api/homeserver')
+
+# One pooled keep-alive session for every request (connection errors are retried)
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_maxsize=4, max_retries=3))
+session.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=3))
 
-DOWNTIME_TRACKER_URL = 'https://portfolio-blry.onrender.com/api/downtime'
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Longest wait for an export chunk or an import response (seconds)
+REQUEST_TIMEOUT = 60
 
 
 def trigger_offline():
     """Mark server as offline"""
     try:
-        response = requests.post(f'{DOWNTIME_TRACKER_URL}/trigger-offline')
+        response = session.post(f'{DOWNTIME_TRACKER_URL}/trigger-offline')
         data = response.json()
         print(f"✗ Server marked as OFFLINE")
         print(f"  Status: {data.get('status')}")
@@ -25,7 +52,7 @@ def trigger_offline():
 def trigger_online():
     """Mark server as online"""
     try:
-        response = requests.post(f'{DOWNTIME_TRACKER_URL}/trigger-online')
+        response = session.post(f'{DOWNTIME_TRACKER_URL}/trigger-online')
         data = response.json()
         print(f"✓ Server marked as ONLINE")
         print(f"  Status: {data.get('status')}")
@@ -39,7 +66,7 @@ def trigger_online():
 def check_status():
     """Check current downtime status"""
     try:
-        response = requests.get(f'{DOWNTIME_TRACKER_URL}/status')
+        response = session.get(f'{DOWNTIME_TRACKER_URL}/status')
         data = response.json()
         print(f"Current Status:")
         print(f"  Is offline: {data.get('is_offline')}")
@@ -53,7 +80,7 @@ def check_status():
 def reset():
     """Reset downtime tracker"""
     try:
-        response = requests.post(f'{DOWNTIME_TRACKER_URL}/reset')
+        response = session.post(f'{DOWNTIME_TRACKER_URL}/reset')
         data = response.json()
         print(f"Downtime tracker reset")
         print(f"  Status: {data.get('status')}")
@@ -62,25 +89,134 @@ def reset():
         print(f"Error: {e}")
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python trigger_downtime.py offline   - Mark server as offline")
-        print("  python trigger_downtime.py online    - Mark server as online")
-        print("  python trigger_downtime.py status    - Check current status")
-        print("  python trigger_downtime.py reset     - Reset downtime tracker")
-        sys.exit(1)
+# ====== BULK EXPORT / IMPORT ======
+def service_url(kind, url=None):
+    """Base URL of the service holding `kind` ('outages' or 'metrics') history"""
+    return url or (DOWNTIME_TRACKER_URL if kind == 'outages' else HOMESERVER_URL)
+
+
+def export_history(kind, fmt='ndjson', table=None, output=None, url=None):
+    """Stream an export to `output` (a path, or stdout) without holding it in memory"""
+    params = {'format': fmt}
+    if table:
+        params['table'] = table
+    with session.get(f'{service_url(kind, url)}/export', params=params, stream=True,
+                     timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise SystemExit(f"Export failed ({response.status_code}): {response.text}")
+        out = open(output, 'wb') if output else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in response.iter_content(chunk_size=EXPORT_CHUNK_SIZE):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if output:
+                out.close()
+            else:
+                out.flush()
+    print(f"Exported {kind}: {written} bytes", file=sys.stderr)
+
+
+def _csv_value(value):
+    """CSV cells are strings: empty means null, numbers become numbers again"""
+    if value == '':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_records(source, fmt):
+    """Yield records from an NDJSON or CSV export, one line at a time"""
+    if fmt == 'csv':
+        for row in csv.DictReader(source):
+            yield {field: _csv_value(value) for field, value in row.items()}
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def post_batch(url, records, token=None):
+    """POST one import batch, waiting out 429s as the service asks; returns the response payload"""
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    while True:
+        response = session.post(url, json={'records': records}, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429:
+            time.sleep(float(response.headers.get('Retry-After', '1')))
+            continue
+        data = response.json()
+        if response.status_code != 200:
+            raise SystemExit(f"Import failed ({response.status_code}): {data.get('error')}")
+        return data
+
+
+def import_history(kind, path, fmt=None, batch_size=500, url=None, token=None):
+    """Read an export and send it in batches of batch_size records"""
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+    url = f'{service_url(kind, url)}/import'
+    source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    sent = skipped = 0
+    try:
+        batch = []
+        for record in read_records(source, fmt):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                skipped += post_batch(url, batch, token).get('skipped', 0)
+                sent += len(batch)
+                batch = []
+                print(f"  {sent} records sent ({skipped} already present)")
+        if batch:
+            skipped += post_batch(url, batch, token).get('skipped', 0)
+            sent += len(batch)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"Imported {kind}: {sent - skipped} new, {skipped} already present")
 
-    command = sys.argv[1].lower()
 
-    if command == 'offline':
+def build_parser():
+    parser = argparse.ArgumentParser(description='Downtime tracker triggers and history export/import')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('offline', help='Mark server as offline')
+    commands.add_parser('online', help='Mark server as online')
+    commands.add_parser('status', help='Check current status')
+    commands.add_parser('reset', help='Reset downtime tracker')
+
+    export = commands.add_parser('export', help='Stream outage or metrics history to a file')
+    export.add_argument('kind', choices=('outages', 'metrics'))
+    export.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    export.add_argument('--table', help='metrics only: metric_sample and/or metric_rollup (comma-separated)')
+    export.add_argument('-o', '--output', help='Output file (default stdout)')
+    export.add_argument('--url', help='Service base URL (default DOWNTIME_TRACKER_URL / HOMESERVER_URL)')
+
+    load = commands.add_parser('import', help='Send an export to a service in batches')
+    load.add_argument('kind', choices=('outages', 'metrics'))
+    load.add_argument('path', help="Export file, or - for stdin")
+    load.add_argument('--format', choices=('ndjson', 'csv'), help='Default: from the file extension')
+    load.add_argument('--batch-size', type=int, default=500, help='Records per request (default 500)')
+    load.add_argument('--url', help='Service base URL (default DOWNTIME_TRACKER_URL / HOMESERVER_URL)')
+    load.add_argument('--token', default=os.environ.get('IMPORT_TOKEN'),
+                      help="The service's IMPORT_TOKEN (default: IMPORT_TOKEN environment variable)")
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+
+    if args.command == 'offline':
         trigger_offline()
-    elif command == 'online':
+    elif args.command == 'online':
         trigger_online()
-    elif command == 'status':
+    elif args.command == 'status':
         check_status()
-    elif command == 'reset':
+    elif args.command == 'reset':
         reset()
-    else:
-        print(f"Unknown command: {command}")
-        sys.exit(1)
+    elif args.command == 'export':
+        export_history(args.kind, args.format, args.table, args.output, args.url)
+    elif args.command == 'import':
+        import_history(args.kind, args.path, args.format, args.batch_size, args.url, args.token)